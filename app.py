@@ -1,24 +1,40 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, g, url_for
 from dotenv import load_dotenv
 import firebase_admin
 from firebase_admin import credentials, firestore, auth
-import random
 import logging
 import os
-from google.api_core.exceptions import GoogleAPICallError
+import hashlib
+import json
+import threading
+import time
 from logging.handlers import RotatingFileHandler
-from google.cloud.firestore import FieldFilter
+from cache import TokenCache, WordCache
+from words import normalize_word
+from scheduler import MIN_QUALITY, MAX_QUALITY, PASSING_QUALITY, utcnow
+from word_store import create_word_store, STORE_ERRORS, UPDATED, ALREADY
+from word_export import EXPORT_FORMATS, encode_rows, gzip_chunks
+from metrics import create_metrics, InstrumentedWordStore
+from log_queue import JsonFormatter, start_queue_logging
+from rate_limit import create_rate_limiter, ConcurrencyLimiter
+from write_behind import create_write_behind, WriteBehindWordStore
+from compression import COMPRESSIBLE_MIMETYPES, PrecompressedBody, choose_encoding, compress
 
 app = Flask(__name__)
 
+load_dotenv()
+
 # 確保日誌目錄存在
 log_dir = 'logs'
 if not os.path.exists(log_dir):
     os.makedirs(log_dir)
 
-# 設定日誌格式
-log_formatter = logging.Formatter(
-    '%(asctime)s - %(levelname)s - %(module)s - %(lineno)d - %(message)s')
+# 設定日誌格式：LOG_FORMAT=json（預設）輸出結構化紀錄，text 為單行文字
+if os.getenv("LOG_FORMAT", "json").lower() == "text":
+    log_formatter = logging.Formatter(
+        '%(asctime)s - %(levelname)s - %(module)s - %(lineno)d - %(message)s')
+else:
+    log_formatter = JsonFormatter()
 
 # 設定檔案日誌處理器
 file_handler = RotatingFileHandler(os.path.join(log_dir, 'app.log'),
@@ -32,33 +48,115 @@ console_handler = logging.StreamHandler()
 console_handler.setFormatter(log_formatter)
 console_handler.setLevel(logging.INFO)
 
-# 取得 logger 並添加處理器
+# 取得 logger，經由佇列交給背景執行緒寫入檔案與控制台，請求執行緒不做日誌 I/O
+# 標記 sample 的高頻率 INFO 紀錄依 LOG_SAMPLE_RATE 抽樣
 logger = logging.getLogger(__name__)
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+log_queue_handler = start_queue_logging(logger, [file_handler, console_handler],
+                                        queue_size=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+                                        sample_rate=float(os.getenv("LOG_SAMPLE_RATE", "0.1")))
 logger.setLevel(logging.DEBUG)
 
-load_dotenv()
+# 效能指標：METRICS_ENABLED 啟用 /metrics，SERVER_TIMING 在回應加上 Server-Timing 標頭
+# 兩者皆未啟用時不包裝任何函式，計時器為空物件
+metrics = create_metrics(enabled=os.getenv("METRICS_ENABLED", "false").lower() == "true",
+                         server_timing=os.getenv("SERVER_TIMING", "false").lower() == "true")
+jsonify = metrics.wrap("jsonify", jsonify)
+
+# 單字儲存實作：firestore（預設）、sqlite 或 memory
+WORD_STORE_BACKEND = os.getenv("WORD_STORE", "firestore").lower()
 
-# Firebase 初始化
+# Firebase 初始化：只載入憑證，Firestore 用戶端在第一次使用時才建立
+# gunicorn preload_app 時主程序不會建立 gRPC 連線，fork 後每個 worker 各自建立一次
+# 使用本機儲存實作時可不提供憑證（離線模式，身份驗證將無法使用）
 try:
     cred_path = os.getenv("FIREBASE_CREDENTIALS_PATH")
-    if not cred_path:
-        logger.critical("FIREBASE_CREDENTIALS_PATH 環境變數未設定！", exc_info=True)
-        raise EnvironmentError("缺少環境變數：FIREBASE_CREDENTIALS_PATH")
-    cred = credentials.Certificate(cred_path)
-    firebase_admin.initialize_app(cred)
-    db = firestore.client()
-    logger.info("Firebase 初始化成功 (使用 .env 檔案)")
+    if cred_path:
+        cred = credentials.Certificate(cred_path)
+        firebase_admin.initialize_app(cred)
+        logger.info("Firebase 初始化成功 (使用 .env 檔案)")
+    elif WORD_STORE_BACKEND == "firestore":
+        logger.warning("未設定 FIREBASE_CREDENTIALS_PATH，連線 Firestore 前需提供憑證")
+    else:
+        logger.warning(f"未設定 FIREBASE_CREDENTIALS_PATH，以離線模式使用 {WORD_STORE_BACKEND} 儲存")
 except Exception as e:
     logger.critical(f"Firebase 初始化失敗: {str(e)}", exc_info=True)
     raise
 
+_firestore_clients = {}
+_firestore_clients_lock = threading.Lock()
+
+# 取得 Firestore 用戶端，每個程序第一次使用時建立（以程序 ID 區分，不沿用 fork 前的連線）
+def firestore_client(client_class):
+    key = (client_class, os.getpid())
+    client = _firestore_clients.get(key)
+    if client is None:
+        with _firestore_clients_lock:
+            client = _firestore_clients.get(key)
+            if client is None:
+                try:
+                    firebase_app = firebase_admin.get_app()
+                except ValueError:
+                    logger.critical("FIREBASE_CREDENTIALS_PATH 環境變數未設定！")
+                    raise EnvironmentError("缺少環境變數：FIREBASE_CREDENTIALS_PATH")
+                client = client_class(project=firebase_app.project_id,
+                                      credentials=firebase_app.credential.get_credential())
+                _firestore_clients[key] = client
+    return client
+
+def get_db():
+    return firestore_client(firestore.Client)
+
+# 指定本程序使用的 Firestore 用戶端（離線測試以記憶體中的替身取代，見 conftest.py）
+def use_firestore_client(client, client_class=firestore.Client):
+    with _firestore_clients_lock:
+        _firestore_clients[(client_class, os.getpid())] = client
+
+def get_async_db():
+    return firestore_client(firestore.AsyncClient)
+
+# 保留 `from app import db` 的用法，存取時才建立用戶端
+def __getattr__(name):
+    if name == "db":
+        return get_db()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+word_store = create_word_store(WORD_STORE_BACKEND, get_db)
+if metrics.active:
+    word_store = InstrumentedWordStore(word_store, metrics)
+
+# 以使用者為單位的流量限制：RATE_LIMIT_PER_SECOND 大於 0 時啟用，超過時回傳 429
+# 設定 RATE_LIMIT_REDIS_URL 時由所有 worker 共用權杖桶，否則每個 worker 各自計算
+rate_limiter = create_rate_limiter(logger)
+
+# 全域並行請求上限：MAX_CONCURRENT_REQUESTS 大於 0 時，同時處理的請求超過上限即回傳 503
+concurrency_limiter = ConcurrencyLimiter(int(os.getenv("MAX_CONCURRENT_REQUESTS", "0")))
+
+# 身份驗證快取設定
+TOKEN_CLOCK_SKEW = 30
+token_cache = TokenCache(maxsize=int(os.getenv("TOKEN_CACHE_SIZE", "10000")),
+                         clock_skew=TOKEN_CLOCK_SKEW,
+                         max_ttl=int(os.getenv("TOKEN_CACHE_MAX_TTL", "3600")),
+                         negative_ttl=int(os.getenv("TOKEN_NEGATIVE_TTL", "60")))
+
 # 驗證使用者身份
 def verify_user(token):
+    hit, uid = token_cache.lookup(token)
+    if hit:
+        return uid
+    return verify_token(token)
+
+# 向 Firebase 驗證 token（不查快取），結果寫入快取
+def verify_token(token):
     try:
-        decoded_token = auth.verify_id_token(token, clock_skew_seconds=30)
-        return decoded_token['uid']
+        decoded_token = auth.verify_id_token(token, clock_skew_seconds=TOKEN_CLOCK_SKEW)
+        uid = decoded_token['uid']
+        token_cache.put(token, uid, decoded_token.get('exp'))
+        return uid
+    except auth.InvalidIdTokenError as e:
+        # 無效或過期的 token 結果固定，短暫快取以免重複驗證
+        token_cache.put_invalid(token)
+        logger.error(f"驗證使用者失敗: {str(e)}")
+        return None
     except Exception as e:
         logger.error(f"驗證使用者失敗: {str(e)}", exc_info=True)
         return None
@@ -71,35 +169,202 @@ def request_token():
     if not auth_header.startswith('Bearer '):
         return jsonify({"success": False, "message": "身份驗證標頭格式錯誤！"}), 401
     token = auth_header.split(' ')[1]
-    uid = verify_user(token)
+    with metrics.timer("verify_user"):
+        uid = verify_user(token)
     if not uid:
         return jsonify({"success": False, "message": "身份驗證失敗！"}), 401
+    wait = rate_limiter.check(uid, request.path)
+    if wait > 0:
+        return rate_limited(wait)
     return uid
 
+def rate_limited(wait):
+    return (jsonify({"success": False, "message": "請求過於頻繁，請稍後再試！"}), 429,
+            {"Retry-After": rate_limiter.retry_after(wait)})
+
+# 單字快取設定
+word_cache = WordCache(max_bytes=int(os.getenv("WORD_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+                       ttl=int(os.getenv("WORD_CACHE_TTL", "300")))
+
+# 不熟標記延後寫入：WRITE_BEHIND_INTERVAL（秒）大於 0 時，標記變更先套用到快取並放入佇列，
+# 同一單字的多次切換合併為一次，定期與程式結束時批次寫入儲存
+write_behind = create_write_behind(word_store, word_cache, logger)
+if write_behind.enabled:
+    word_store = WriteBehindWordStore(word_store, write_behind)
+
+# 取得快取的單字；指定版本時，快取的版本不同就視為未快取
+def cached_entry(uid, version=None):
+    if version is None:
+        return word_cache.get(uid)
+    return word_cache.get_version(uid, version)
+
+# 取得使用者的單字快取，未快取時從儲存載入
+def load_word_entry(uid, version=None):
+    entry = cached_entry(uid, version)
+    if entry is None:
+        words = word_store.load(uid)
+        entry = word_cache.put(uid, words, version)
+        logger.debug(f"從資料庫載入使用者 {uid} 的單字完成，數量: {len(words)}")
+    return entry
+
+# 分頁載入單字：已快取時從記憶體分頁，否則使用儲存的查詢游標
+# 兩者皆依單字原文排序，游標為上一頁最後一個單字
+# 啟用快取且已知版本時整份載入並快取，之後的分頁與其他路由直接從記憶體讀取
+def load_words_page(uid, is_unfamiliar, limit, start_after=None, version=None):
+    entry = cached_entry(uid, version)
+    if entry is None and word_cache.enabled and version is not None:
+        entry = load_word_entry(uid, version)
+    if entry is not None:
+        return entry.page(limit, start_after, is_unfamiliar)
+    records, next_cursor = word_store.load_page(uid, is_unfamiliar, limit, start_after)
+    return [r.to_dict() for r in records], next_cursor
+
+# 逐筆取得單字：已快取時從記憶體讀取，否則邊讀取儲存邊回傳
+def iter_words(uid, is_unfamiliar=None, version=None):
+    entry = cached_entry(uid, version)
+    if entry is not None:
+        yield from entry.filter(is_unfamiliar)
+        return
+    for record in word_store.iter_words(uid, is_unfamiliar):
+        yield record.to_dict()
+
 # 載入單字
-def load_words(uid, is_unfamiliar=None):
+def load_words(uid, is_unfamiliar=None, version=None):
     try:
-        query = db.collection("toeic_words").where(filter=FieldFilter("user_id", "==", uid))
-        if is_unfamiliar is not None:
-            query = query.where(filter=FieldFilter("is_unfamiliar", "==", is_unfamiliar))
-        words = [{
-            "id": doc.id,
-            "word": doc.to_dict().get("word", ""),
-            "is_unfamiliar": doc.to_dict().get("is_unfamiliar", False)
-        } for doc in query.stream()]
-        logger.info(f"載入使用者 {uid} 的單字完成，數量: {len(words)}, 不熟單字模式: {is_unfamiliar}")
+        with metrics.timer("load_words"):
+            words = load_word_entry(uid, version).filter(is_unfamiliar)
+        logger.info(f"載入使用者 {uid} 的單字完成，數量: {len(words)}, 不熟單字模式: {is_unfamiliar}",
+                    extra={"sample": True})
         return words
-    except GoogleAPICallError as e:
+    except STORE_ERRORS as e:
         logger.error(f"Firestore 資料庫錯誤: {e}", exc_info=True)
         raise
     except Exception as e:
         logger.critical(f"系統未預期錯誤: {e}", exc_info=True)
         raise
 
-# 主頁
+# 單次批次請求的單字數量上限
+MAX_BATCH_WORDS = int(os.getenv("MAX_BATCH_WORDS", "5000"))
+
+# 取得批次請求中的單字清單
+# 支援 JSON 陣列、{"words": [...]}、上傳檔案 (file) 或以換行分隔的表單欄位 (words)
+def request_word_list():
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get("words")
+    if isinstance(data, list):
+        return [w.strip() if isinstance(w, str) else w for w in data]
+    upload = request.files.get('file')
+    if upload is not None:
+        text = upload.read().decode('utf-8-sig', errors='replace')
+    else:
+        text = request.form.get('words')
+    if text is None:
+        return None
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+# 取得批次操作的單字清單（去除空白與重複並保留順序）
+def request_unique_words():
+    words = request_word_list()
+    if words is None:
+        return None
+    return list(dict.fromkeys(w for w in words if isinstance(w, str) and w))
+
+# 記錄每個請求的路由延遲，並視設定加上 Server-Timing 標頭
+if metrics.active:
+    @app.before_request
+    def start_request_timer():
+        g.metrics_token = metrics.begin_request()
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def finish_request_timer(response):
+        token = g.pop('metrics_token', None)
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        server_timing = metrics.end_request(token, route, request.method, response.status_code,
+                                            time.perf_counter() - g.request_start)
+        if server_timing:
+            response.headers['Server-Timing'] = server_timing
+        return response
+
+def server_busy():
+    return jsonify({"success": False, "message": "伺服器忙碌中，請稍後再試！"}), 503, {"Retry-After": "1"}
+
+# 同時處理的請求達到上限時立即拒絕，不佔用 worker 執行緒等待資料庫
+if concurrency_limiter.enabled:
+    @app.before_request
+    def admit_request():
+        if not concurrency_limiter.acquire():
+            return server_busy()
+        g.admitted = True
+
+    @app.teardown_request
+    def release_request(exc):
+        if g.pop('admitted', False):
+            concurrency_limiter.release()
+
+# 靜態檔案網址加上內容雜湊 (?v=...)：內容改變時網址跟著改變，因此帶有雜湊的請求可以長期快取
+STATIC_MAX_AGE = 365 * 24 * 3600
+static_versions = {}
+
+def static_version(filename):
+    version = static_versions.get(filename)
+    if version is None:
+        try:
+            with open(os.path.join(app.static_folder, filename), 'rb') as f:
+                version = static_versions[filename] = hashlib.sha256(f.read()).hexdigest()[:12]
+        except OSError:
+            return None
+    return version
+
+@app.template_global()
+def static_url(filename):
+    return url_for('static', filename=filename, v=static_version(filename))
+
+# 超過此大小（位元組）的 JSON / HTML 等文字回應依 Accept-Encoding 以 br 或 gzip 壓縮
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+
+def compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is not None:
+        response.set_data(compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.after_request
+def cache_and_compress(response):
+    if request.endpoint != 'static':
+        return compress_response(response)
+    version = request.args.get('v')
+    if response.status_code == 200 and version and version == static_version(request.view_args['filename']):
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+# 主頁不含任何與請求相關的內容，渲染一次後快取，各編碼的壓縮結果也只計算一次
+index_page = None
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    global index_page
+    if index_page is None or app.debug:
+        index_page = PrecompressedBody(render_template('index.html').encode('utf-8'))
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    response = Response(index_page.get(encoding), mimetype='text/html')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(f"{index_page.etag}-{encoding or 'identity'}")
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 # 儲存單字
 @app.route('/save_word', methods=['POST'])
@@ -110,21 +375,63 @@ def save_word():
     if not request.form or 'word' not in request.form:
         return jsonify({'message': '請求格式錯誤'}), 400
     try:
-        existing_words = [w["word"] for w in load_words(uid)]
         word = request.form['word'].strip()
-        if word in existing_words:
+        # 不以快取判斷重複（其他 worker 可能已刪除），以固定文件 ID 建立，單字已存在時由儲存拒絕
+        versions = []
+        record = word_store.add(uid, word, versions)
+        if record is None:
             return jsonify({'message': '單字已存在', 'success': False}), 409
-        new_word = {
-            "user_id": uid,
-            "word": word,
-            "is_unfamiliar": False
-        }
-        db.collection("toeic_words").add(new_word)
+        word_cache.add_words(uid, [record], versions)
         return jsonify({'message': '單字儲存成功', 'success': True}), 201
     except Exception as e:
         logger.error(f"儲存單字失敗: {e}")
         return jsonify({'message': '儲存單字失敗', 'success': False}), 500
 
+# 批次匯入單字
+@app.route('/save_words', methods=['POST'])
+def save_words():
+    uid = request_token()
+    if not isinstance(uid, str):
+        return uid
+    words = request_word_list()
+    if words is None:
+        return jsonify({'message': '請求格式錯誤', 'success': False}), 400
+    if len(words) > MAX_BATCH_WORDS:
+        return jsonify({'message': f'單次最多匯入 {MAX_BATCH_WORDS} 個單字', 'success': False}), 413
+    try:
+        # 只在記憶體中去除請求內的重複；已存在的單字由儲存在交易中讀取判斷，不需載入整份清單
+        seen = set()
+        results = []
+        new_words = []
+        for word in words:
+            if not isinstance(word, str) or not word:
+                results.append({"word": word, "status": "invalid"})
+                continue
+            key = normalize_word(word)
+            if key in seen:
+                results.append({"word": word, "status": "duplicate"})
+                continue
+            seen.add(key)
+            result = {"word": word, "status": "created"}
+            results.append(result)
+            new_words.append(result)
+        versions = []
+        records = word_store.add_many(uid, [r["word"] for r in new_words], versions)
+        created_words = {record.word for record in records}
+        for result in new_words:
+            if result["word"] not in created_words:
+                # 單字已存在（或與其他請求同時寫入）
+                result["status"] = "duplicate"
+        word_cache.add_words(uid, records, versions)
+        created = sum(1 for r in results if r["status"] == "created")
+        logger.info(f"使用者 {uid} 批次匯入單字完成，新增: {created}, 總數: {len(words)}")
+        return jsonify({'message': f'已匯入 {created} 個單字', 'success': True,
+                        'created': created, 'results': results})
+    except STORE_ERRORS as e:
+        logger.error(f"批次匯入單字失敗: {e}", exc_info=True)
+        word_cache.invalidate(uid)
+        return jsonify({'message': '批次匯入單字失敗', 'success': False}), 500
+
 # 刪除單字
 @app.route('/delete_word', methods=['POST'])
 def delete_word():
@@ -135,23 +442,45 @@ def delete_word():
     if not word:
         return jsonify({"success": False, "message": "請輸入要刪除的單字！"})
     try:
-        query = (db.collection("toeic_words")
-                 .where(filter=FieldFilter("user_id", "==", uid))
-                 .where(filter=FieldFilter("word", "==", word))
-                 .limit(1))
-        docs = query.stream()
-        deleted = False
-        for doc in docs:
-            doc.reference.delete()
-            deleted = True
+        versions = []
+        deleted = word_store.delete(uid, word, versions)
         if deleted:
+            word_cache.remove_words(uid, [word], versions)
             return jsonify({"success": True, "message": f"單字 '{word}' 已刪除！"})
         else:
             return jsonify({"success": False, "message": "找不到此單字！"})
-    except GoogleAPICallError as e:
+    except STORE_ERRORS as e:
         logger.error(f"刪除單字 '{word}' 失敗: {e}", exc_info=True)
         return jsonify({"success": False, "message": f"刪除單字 '{word}' 失敗"}), 500
 
+# 批次刪除單字
+@app.route('/delete_words', methods=['POST'])
+def delete_words():
+    uid = request_token()
+    if not isinstance(uid, str):
+        return uid
+    words = request_unique_words()
+    if not words:
+        return jsonify({"success": False, "message": "請輸入要刪除的單字！"}), 400
+    if len(words) > MAX_BATCH_WORDS:
+        return jsonify({"success": False, "message": f"單次最多處理 {MAX_BATCH_WORDS} 個單字"}), 413
+    try:
+        versions = []
+        deleted = word_store.delete_many(uid, words, versions)
+        word_cache.remove_words(uid, deleted, versions)
+        deleted_set = set(deleted)
+        return jsonify({"success": True, "message": f"已刪除 {len(deleted)} 個單字！",
+                        "deleted": deleted,
+                        "not_found": [w for w in words if w not in deleted_set]})
+    except STORE_ERRORS as e:
+        logger.error(f"批次刪除單字失敗: {e}", exc_info=True)
+        word_cache.invalidate(uid)
+        return jsonify({"success": False, "message": "批次刪除單字失敗"}), 500
+
+# 搜尋結果數量設定
+SEARCH_DEFAULT_LIMIT = 50
+SEARCH_MAX_LIMIT = 500
+
 # 搜尋單字
 @app.route('/search_word', methods=['POST'])
 def search_word():
@@ -161,12 +490,31 @@ def search_word():
     keyword = request.form['keyword'].strip()
     if not keyword:
         return jsonify({"success": False, "message": "請輸入搜尋關鍵字！"})
-    words = load_words(uid)
-    matched_words = [w["word"] for w in words if keyword.lower() in w["word"].lower()]
+    limit = min(max(request.form.get('limit', SEARCH_DEFAULT_LIMIT, type=int), 1), SEARCH_MAX_LIMIT)
+    fuzzy = request.form.get('fuzzy', 'false') == 'true'
+    # 快取依版本確認：其他 worker 或執行個體寫入後重新載入，不回傳過期的結果
+    if word_cache.enabled:
+        matched_words = load_word_entry(uid, word_store.version(uid)).index.search(keyword, limit=limit,
+                                                                                  fuzzy=fuzzy)
+    else:
+        matched_words = word_store.search(uid, keyword, limit=limit, fuzzy=fuzzy)
     if matched_words:
         return jsonify({"success": True,"words": matched_words})
     return jsonify({"success": False, "message": "沒有符合的單字！"})
 
+# 設定單一單字的不熟標記；啟用延後寫入時依快取判斷結果並放入佇列
+# 快取以內層儲存的版本確認（只讀取統計文件，不先送出已在快取中的待寫入變更），版本不同時才重新載入
+def set_unfamiliar_flag(uid, word, is_unfamiliar):
+    if write_behind.enabled:
+        entry = word_cache.get_version(uid, write_behind.store.version(uid))
+        if entry is None:
+            entry = load_word_entry(uid, word_store.version(uid))
+        return write_behind.set_unfamiliar(uid, word, is_unfamiliar, entry)
+    versions = []
+    status = word_store.set_unfamiliar(uid, word, is_unfamiliar, versions)
+    word_cache.set_unfamiliar(uid, [word] if status == UPDATED else [], is_unfamiliar, versions)
+    return status
+
 # 標記不熟單字
 @app.route('/mark_unfamiliar', methods=['POST'])
 def mark_unfamiliar():
@@ -175,22 +523,14 @@ def mark_unfamiliar():
         return uid
     word = request.form['word'].strip()
     try:
-        query = (db.collection("toeic_words")
-                 .where(filter=FieldFilter("user_id", "==", uid))
-                 .where(filter=FieldFilter("word", "==", word))
-                 .limit(1))
-        docs = query.stream()
-        updated = False
-        for doc in docs:
-            if doc.to_dict().get("is_unfamiliar", False):
-                return jsonify({"success": False, "message": f"'{word}' 已經是不熟單字！"})
-            doc.reference.update({"is_unfamiliar": True})
-            updated = True
-        if updated:
+        status = set_unfamiliar_flag(uid, word, True)
+        if status == ALREADY:
+            return jsonify({"success": False, "message": f"'{word}' 已經是不熟單字！"})
+        if status == UPDATED:
             return jsonify({"success": True, "message": f"'{word}' 已標記為不熟！"})
         else:
             return jsonify({"success": False, "message": "找不到此單字！"})
-    except GoogleAPICallError as e:
+    except STORE_ERRORS as e:
         logger.error(f"標記不熟單字 '{word}' 失敗: {e}", exc_info=True)
         return jsonify({"success": False, "message": f"標記不熟單字 '{word}' 失敗"}), 500
 
@@ -202,42 +542,139 @@ def unmark_unfamiliar():
         return uid
     word = request.form['word'].strip()
     try:
-        query = (db.collection("toeic_words")
-                 .where(filter=FieldFilter("user_id", "==", uid))
-                 .where(filter=FieldFilter("word", "==", word))
-                 .limit(1))
-        docs = query.stream()
-        updated = False
-        for doc in docs:
-            if not doc.to_dict().get("is_unfamiliar", False):
-                return jsonify({"success": False, "message": f"'{word}' 本來就不是不熟單字！"})
-            doc.reference.update({"is_unfamiliar": False})
-            updated = True
-        if updated:
+        status = set_unfamiliar_flag(uid, word, False)
+        if status == ALREADY:
+            return jsonify({"success": False, "message": f"'{word}' 本來就不是不熟單字！"})
+        if status == UPDATED:
             return jsonify({"success": True, "message": f"'{word}' 已取消標記不熟！"})
         else:
             return jsonify({"success": False, "message": "找不到此單字！"})
-    except GoogleAPICallError as e:
+    except STORE_ERRORS as e:
         logger.error(f"取消標記不熟單字 '{word}' 失敗: {e}", exc_info=True)
         return jsonify({"success": False, "message": f"取消標記不熟單字 '{word}' 失敗"}), 500
 
-# 複習單字
-@app.route('/review_words', methods=['POST'])
-def review_words():
+# 批次設定不熟標記
+def set_unfamiliar_words(is_unfamiliar):
     uid = request_token()
     if not isinstance(uid, str):
         return uid
+    words = request_unique_words()
+    if not words:
+        return jsonify({"success": False, "message": "請輸入單字！"}), 400
+    if len(words) > MAX_BATCH_WORDS:
+        return jsonify({"success": False, "message": f"單次最多處理 {MAX_BATCH_WORDS} 個單字"}), 413
     try:
-        is_unfamiliar = request.form.get('is_unfamiliar', 'false') == 'true'
-        words = load_words(uid, is_unfamiliar)
+        versions = []
+        updated, already, not_found = word_store.set_unfamiliar_many(uid, words, is_unfamiliar, versions)
+        word_cache.set_unfamiliar(uid, updated, is_unfamiliar, versions)
+        action = "標記為不熟" if is_unfamiliar else "取消標記不熟"
+        return jsonify({"success": True, "message": f"已將 {len(updated)} 個單字{action}！",
+                        "updated": updated,
+                        "already": already,
+                        "not_found": not_found})
+    except STORE_ERRORS as e:
+        logger.error(f"批次設定不熟標記失敗: {e}", exc_info=True)
+        word_cache.invalidate(uid)
+        return jsonify({"success": False, "message": "批次設定不熟標記失敗"}), 500
+
+# 批次標記不熟單字
+@app.route('/mark_unfamiliar_words', methods=['POST'])
+def mark_unfamiliar_words():
+    return set_unfamiliar_words(True)
+
+# 批次取消標記不熟單字
+@app.route('/unmark_unfamiliar_words', methods=['POST'])
+def unmark_unfamiliar_words():
+    return set_unfamiliar_words(False)
+
+# 單字清單分頁上限
+WORDS_PAGE_MAX = 1000
+
+# 以串流回應輸出單字清單（JSON 陣列或 NDJSON），不需先在記憶體組出完整清單
+def stream_words_response(uid, is_unfamiliar, fmt, version=None):
+    words = iter_words(uid, is_unfamiliar, version)
+
+    def generate():
+        try:
+            if fmt == 'ndjson':
+                for word in words:
+                    yield json.dumps(word) + "\n"
+                return
+            yield '{"success": true, "words": ['
+            for i, word in enumerate(words):
+                yield ("," if i else "") + json.dumps(word)
+            yield ']}'
+        except STORE_ERRORS as e:
+            logger.error(f"串流輸出單字失敗: {e}", exc_info=True)
+            raise
+
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+# 單字清單的 ETag：使用者雜湊加上單字版本，同一瀏覽器切換帳號時不會誤用其他使用者的快取
+def word_list_etag(uid, version):
+    return f"{hashlib.sha256(uid.encode()).hexdigest()[:16]}-{version}"
+
+# 單字清單回應：先讀取單字版本，與 If-None-Match 相同時回傳 304，不載入單字
+# 版本需在載入單字前讀取，載入期間若有寫入，下一次請求的版本不同而重新下載
+def word_list_response(uid, is_unfamiliar, empty_message):
+    version = word_store.version(uid)
+    etag = word_list_etag(uid, version)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        # 304 只收基本成本，回傳內容時依讀取量補收
+        wait = rate_limiter.charge(uid, request.path, word_list_limit())
+        if wait > 0:
+            return rate_limited(wait)
+        response = word_list_body(uid, is_unfamiliar, empty_message, version)
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Authorization')
+    return response
+
+# 單字清單的分頁大小；串流或未指定 limit 時為 None（整份清單）
+def word_list_limit():
+    limit = request.values.get('limit', type=int)
+    if limit is None or request.values.get('stream') in ('json', 'ndjson'):
+        return None
+    return min(max(limit, 1), WORDS_PAGE_MAX)
+
+# 單字清單內容：支援分頁 (limit/start_after) 與串流 (stream=json|ndjson)
+def word_list_body(uid, is_unfamiliar, empty_message, version):
+    fmt = request.values.get('stream')
+    if fmt in ('json', 'ndjson'):
+        return stream_words_response(uid, is_unfamiliar, fmt, version)
+    limit = word_list_limit()
+    if limit is None:
+        words = load_words(uid, is_unfamiliar, version)
         if not words:
-            return jsonify({"success": False, "message": "目前沒有單字可複習！"})
+            return jsonify({"success": False, "message": empty_message})
         return jsonify({"success": True, "words": words})
+    start_after = request.values.get('start_after') or None
+    words, next_cursor = load_words_page(uid, is_unfamiliar, limit, start_after, version)
+    if not words and start_after is None:
+        return jsonify({"success": False, "message": empty_message})
+    return jsonify({"success": True, "words": words, "next_cursor": next_cursor})
+
+# 複習單字
+@app.route('/review_words', methods=['GET', 'POST'])
+def review_words():
+    uid = request_token()
+    if not isinstance(uid, str):
+        return uid
+    try:
+        is_unfamiliar = request.values.get('is_unfamiliar', 'false') == 'true'
+        return word_list_response(uid, is_unfamiliar, "目前沒有單字可複習！")
     except Exception as e:
         logger.error(f"複習單字錯誤: {str(e)}", exc_info=True)
         return jsonify({"success": False, "message": f"伺服器錯誤: {str(e)}"}), 500
 
-# 隨機 10 個單字
+# 隨機單字數量設定
+RANDOM_DEFAULT_WORDS = 10
+RANDOM_MAX_WORDS = 100
+
+# 隨機單字（預設 10 個）
 @app.route('/random_words', methods=['POST'])
 def random_words():
     uid = request_token()
@@ -245,30 +682,119 @@ def random_words():
         return uid
     try:
         is_unfamiliar = request.form.get('is_unfamiliar', 'false') == 'true'
-        words = load_words(uid, is_unfamiliar)
-        if not words:
+        n = min(max(request.form.get('n', RANDOM_DEFAULT_WORDS, type=int), 1), RANDOM_MAX_WORDS)
+        # 從快取的單字 ID 陣列抽樣，不需複製整個單字清單；快取依版本確認
+        if word_cache.enabled:
+            random_words = load_word_entry(uid, word_store.version(uid)).sample(n, is_unfamiliar)
+        else:
+            random_words = [r.to_dict() for r in word_store.sample(uid, n, is_unfamiliar)]
+        if not random_words:
             return jsonify({"success": False, "message": "目前沒有單字可選擇！"})
-        random_words = random.sample(words, min(10, len(words)))
         return jsonify({"success": True, "words": random_words})
     except Exception as e:
         logger.error(f"隨機單字錯誤: {str(e)}", exc_info=True)
         return jsonify({"success": False, "message": f"伺服器錯誤: {str(e)}"}), 500
 
 # 載入所有單字
-@app.route('/load_all_words', methods=['POST'])
+@app.route('/load_all_words', methods=['GET', 'POST'])
 def load_all_words():
     uid = request_token()
     if not isinstance(uid, str):
         return uid
     try:
-        words = load_words(uid)
+        return word_list_response(uid, None, "目前沒有單字！")
+    except Exception as e:
+        logger.error(f"載入所有單字錯誤: {str(e)}", exc_info=True)
+        return jsonify({"success": False, "message": f"伺服器錯誤: {str(e)}"}), 500
+
+# 到期單字數量設定
+DUE_DEFAULT_WORDS = 20
+DUE_MAX_WORDS = 100
+
+# 取得已到期需要複習的單字（依到期時間排序）
+@app.route('/due_words', methods=['POST'])
+def due_words():
+    uid = request_token()
+    if not isinstance(uid, str):
+        return uid
+    try:
+        limit = min(max(request.form.get('limit', DUE_DEFAULT_WORDS, type=int), 1), DUE_MAX_WORDS)
+        words = []
+        for record, schedule in word_store.load_due(uid, utcnow(), limit):
+            word = record.to_dict()
+            word.update(schedule.to_dict())
+            words.append(word)
         if not words:
-            return jsonify({"success": False, "message": "目前沒有單字！"})
+            return jsonify({"success": False, "message": "目前沒有到期的單字！"})
         return jsonify({"success": True, "words": words})
     except Exception as e:
-        logger.error(f"載入所有單字錯誤: {str(e)}", exc_info=True)
+        logger.error(f"到期單字錯誤: {str(e)}", exc_info=True)
         return jsonify({"success": False, "message": f"伺服器錯誤: {str(e)}"}), 500
 
+# 記錄複習結果（quality 0–5），更新下次複習時間；低於及格分數時標記為不熟
+@app.route('/review_result', methods=['POST'])
+def review_result():
+    uid = request_token()
+    if not isinstance(uid, str):
+        return uid
+    word = request.form.get('word', '').strip()
+    quality = request.form.get('quality', type=int)
+    if not word or quality is None or not MIN_QUALITY <= quality <= MAX_QUALITY:
+        return jsonify({"success": False, "message": "請求格式錯誤"}), 400
+    try:
+        versions = []
+        schedule = word_store.record_review(uid, word, quality, utcnow(), versions)
+        if schedule is None:
+            return jsonify({"success": False, "message": "找不到此單字！"})
+        word_cache.set_unfamiliar(uid, [word], quality < PASSING_QUALITY, versions)
+        return jsonify({"success": True, "message": f"'{word}' 下次複習時間已更新！",
+                        "schedule": schedule.to_dict()})
+    except STORE_ERRORS as e:
+        logger.error(f"記錄複習結果 '{word}' 失敗: {e}", exc_info=True)
+        return jsonify({"success": False, "message": f"記錄複習結果 '{word}' 失敗"}), 500
+
+# 單字統計：只讀取一份統計文件，不需載入所有單字
+@app.route('/stats', methods=['POST'])
+def stats():
+    uid = request_token()
+    if not isinstance(uid, str):
+        return uid
+    try:
+        user_stats = word_store.stats(uid)
+        last_updated = user_stats["last_updated"]
+        user_stats["last_updated"] = last_updated.isoformat() if last_updated is not None else None
+        return jsonify({"success": True, "stats": user_stats})
+    except STORE_ERRORS as e:
+        logger.error(f"讀取單字統計失敗: {e}", exc_info=True)
+        return jsonify({"success": False, "message": "讀取單字統計失敗"}), 500
+
+# 匯出單字（含複習排程）：format=csv（預設）或 ndjson，compress=gzip 時輸出 gzip 檔
+# 直接串流儲存的查詢結果，不經過單字快取，記憶體用量與單字數量無關
+@app.route('/export', methods=['GET', 'POST'])
+def export():
+    uid = request_token()
+    if not isinstance(uid, str):
+        return uid
+    fmt = request.values.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"success": False, "message": "不支援的匯出格式"}), 400
+    compress = request.values.get('compress') == 'gzip'
+    rows = word_store.export(uid)
+
+    def generate():
+        try:
+            chunks = encode_rows(rows, fmt)
+            yield from gzip_chunks(chunks) if compress else chunks
+        except STORE_ERRORS as e:
+            logger.error(f"匯出單字失敗: {e}", exc_info=True)
+            raise
+
+    filename = f"toeic_words.{fmt}" + (".gz" if compress else "")
+    response = Response(stream_with_context(generate()),
+                        mimetype='application/gzip' if compress else EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 # 驗證作者碼
 @app.route('/verify_author', methods=['POST'])
 def verify_author():
@@ -278,5 +804,17 @@ def verify_author():
         return jsonify({"success": False, "message": "作者驗證碼錯誤！"}), 401
     return jsonify({"success": True, "message": "驗證碼正確"})
 
+# Prometheus 格式的效能指標
+@app.route('/metrics')
+def metrics_endpoint():
+    if not metrics.enabled:
+        return jsonify({"success": False, "message": "效能指標未啟用"}), 404
+    body = metrics.render({"toeic_token_cache": token_cache.stats(),
+                           "toeic_word_cache": word_cache.stats(),
+                           "toeic_rate_limit": {"limited": rate_limiter.limited},
+                           "toeic_concurrency": concurrency_limiter.stats(),
+                           "toeic_write_behind": write_behind.stats()})
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
 if __name__ == '__main__':
     app.run(debug=False)
@@ -0,0 +1,416 @@
+import asyncio
+import base64
+import json
+import os
+import time
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import parse_etags, quote_etag
+
+import app as flask_module
+from app import (logger, metrics, token_cache, word_cache, rate_limiter, concurrency_limiter, COMPRESS_MIN_SIZE,
+                 SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT, RANDOM_DEFAULT_WORDS, RANDOM_MAX_WORDS, WORDS_PAGE_MAX)
+from cache import UserWords
+from compression import COMPRESSIBLE_MIMETYPES, choose_encoding, compress
+from rate_limit import MemoryBackend
+from word_store import AsyncFirestoreWordStore, ThreadedAsyncWordStore
+from write_behind import AsyncWriteBehindWordStore
+
+# ASGI 模式：常用路由以非同步方式處理，等待 Firestore 時不佔用 worker；
+# 其餘路由與靜態檔案交給原本的 Flask 應用程式（在執行緒池中執行）
+# 啟動方式：uvicorn asgi_app:app
+
+# 非同步單字儲存：firestore 使用 AsyncClient，其他實作在執行緒池中呼叫同步儲存
+# 同步儲存已包含延後寫入的處理，AsyncClient 則另外在讀寫前送出待寫入的不熟標記
+if flask_module.WORD_STORE_BACKEND == "firestore":
+    async_word_store = AsyncFirestoreWordStore(flask_module.get_async_db)
+    if flask_module.write_behind.enabled:
+        async_word_store = AsyncWriteBehindWordStore(async_word_store, flask_module.write_behind)
+else:
+    async_word_store = ThreadedAsyncWordStore(flask_module.word_store)
+
+# token 未快取時，是否以 token 中尚未驗證的 uid 在驗證的同時預先載入單字（預設關閉）
+# 需同時啟用流量限制：所有預先載入共用 SPECULATIVE_BUCKET 的權杖桶，偽造的 token 觸發的讀取量不超過限制的速率，
+# 額度用完時改為驗證後才載入；預先載入的結果只在驗證通過、uid 相同且通過該使用者的流量限制後才寫入快取與回應
+SPECULATIVE_LOAD = os.getenv("ASYNC_SPECULATIVE_LOAD", "false").lower() == "true"
+SPECULATIVE_BUCKET = ":speculative"
+
+
+# 取出 token 中的 uid（sub）但不驗證簽章；格式錯誤或已過期時回傳 None
+def unverified_uid(token):
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        if claims.get("exp", 0) <= time.time():
+            return None
+    except (IndexError, ValueError, TypeError, AttributeError):
+        return None
+    uid = claims.get("sub")
+    return uid if isinstance(uid, str) and uid else None
+
+
+def auth_failed():
+    return JSONResponse({"success": False, "message": "身份驗證失敗！"}, 401)
+
+
+# 取出 Authorization 標頭中的 token，格式錯誤時回傳錯誤回應
+def bearer_token(request):
+    auth_header = request.headers.get('Authorization')
+    if not auth_header:
+        return None, JSONResponse({"success": False, "message": "未提供身份驗證令牌！"}, 401)
+    if not auth_header.startswith('Bearer '):
+        return None, JSONResponse({"success": False, "message": "身份驗證標頭格式錯誤！"}, 401)
+    return auth_header.split(' ')[1], None
+
+
+# 在執行緒池中向 Firebase 驗證 token
+async def verify_token(token):
+    with metrics.timer("verify_user"):
+        return await asyncio.to_thread(flask_module.verify_token, token)
+
+
+# 取得使用者的單字快取，未快取時從非同步儲存載入；指定版本時，快取的版本不同就重新載入
+async def load_word_entry(uid, version=None):
+    entry = word_cache.get(uid) if version is None else word_cache.get_version(uid, version)
+    if entry is None:
+        with metrics.timer("load_words"):
+            words = await async_word_store.load(uid)
+        entry = word_cache.put(uid, words, version)
+    return entry
+
+
+# 預先載入依版本確認快取；驗證前不寫入快取，未快取時回傳 (單字, 版本)
+async def prefetch_words(uid):
+    version = await async_word_store.version(uid)
+    entry = word_cache.get_version(uid, version)
+    if entry is not None:
+        return entry
+    with metrics.timer("load_words"):
+        return await async_word_store.load(uid), version
+
+
+# 以 token 中尚未驗證的 uid 開始預先載入，回傳 (uid, 工作)；不預先載入時回傳 (None, None)
+async def start_prefetch(token, path):
+    if not SPECULATIVE_LOAD or not rate_limiter.enabled:
+        return None, None
+    claimed_uid = unverified_uid(token)
+    if claimed_uid is None or await rate_limit_wait(SPECULATIVE_BUCKET, path, count=False) > 0:
+        return None, None
+    prefetch = asyncio.create_task(prefetch_words(claimed_uid))
+    # 取消或捨棄時仍取出例外，避免未處理例外的警告
+    prefetch.add_done_callback(lambda task: task.cancelled() or task.exception())
+    return claimed_uid, prefetch
+
+
+# 流量限制；共用後端（Redis）需要網路往返，在執行緒池中呼叫
+async def rate_limit_wait(uid, path, count=True):
+    if not rate_limiter.enabled:
+        return 0.0
+    if isinstance(rate_limiter.backend, MemoryBackend):
+        return rate_limiter.check(uid, path, count)
+    return await asyncio.to_thread(rate_limiter.check, uid, path, count)
+
+
+async def rate_limit_charge(uid, path, limit):
+    if not rate_limiter.enabled:
+        return 0.0
+    if isinstance(rate_limiter.backend, MemoryBackend):
+        return rate_limiter.charge(uid, path, limit)
+    return await asyncio.to_thread(rate_limiter.charge, uid, path, limit)
+
+
+def rate_limited(wait):
+    return JSONResponse({"success": False, "message": "請求過於頻繁，請稍後再試！"}, 429,
+                        headers={"Retry-After": rate_limiter.retry_after(wait)})
+
+
+# 驗證身份，load_entry 為 True 時一併取得單字快取（停用快取時為 None），快取依版本確認
+# 回傳 (uid, 單字快取, 錯誤回應)
+async def authenticate(request, load_entry=False):
+    token, error = bearer_token(request)
+    if error is not None:
+        return None, None, error
+    load_entry = load_entry and word_cache.enabled
+    claimed_uid, prefetch = None, None
+    hit, uid = token_cache.lookup(token)
+    if not hit:
+        if load_entry:
+            claimed_uid, prefetch = await start_prefetch(token, request.url.path)
+        try:
+            uid = await verify_token(token)
+        except BaseException:
+            if prefetch is not None:
+                prefetch.cancel()
+            raise
+    if prefetch is not None and uid != claimed_uid:
+        prefetch.cancel()
+        prefetch = None
+    if not uid:
+        return None, None, auth_failed()
+    wait = await rate_limit_wait(uid, request.url.path)
+    if wait > 0:
+        if prefetch is not None:
+            prefetch.cancel()
+        return None, None, rate_limited(wait)
+    entry = None
+    if prefetch is not None:
+        words = await prefetch
+        entry = words if isinstance(words, UserWords) else word_cache.put(uid, *words)
+    elif load_entry:
+        entry = await load_word_entry(uid, await async_word_store.version(uid))
+    return uid, entry, None
+
+
+# 合併查詢字串與表單欄位（查詢字串優先，與 Flask 的 request.values 相同）
+async def request_values(request):
+    values = dict(await request.form()) if request.method == "POST" else {}
+    values.update(request.query_params)
+    return values
+
+
+def int_value(values, key, default=None):
+    try:
+        return int(values[key])
+    except (KeyError, TypeError, ValueError):
+        return default
+
+
+def server_error(message, e):
+    logger.error(f"{message}: {str(e)}", exc_info=True)
+    return JSONResponse({"success": False, "message": f"伺服器錯誤: {str(e)}"}, 500)
+
+
+# 儲存單字
+async def save_word(request):
+    uid, _, error = await authenticate(request)
+    if error is not None:
+        return error
+    form = await request.form()
+    if not form or 'word' not in form:
+        return JSONResponse({'message': '請求格式錯誤'}, 400)
+    try:
+        word = form['word'].strip()
+        # 不以快取判斷重複（其他 worker 可能已刪除），以固定文件 ID 建立，單字已存在時由儲存拒絕
+        versions = []
+        record = await async_word_store.add(uid, word, versions)
+        if record is None:
+            return JSONResponse({'message': '單字已存在', 'success': False}, 409)
+        word_cache.add_words(uid, [record], versions)
+        return JSONResponse({'message': '單字儲存成功', 'success': True}, 201)
+    except Exception as e:
+        logger.error(f"儲存單字失敗: {e}")
+        return JSONResponse({'message': '儲存單字失敗', 'success': False}, 500)
+
+
+# 搜尋單字
+async def search_word(request):
+    try:
+        uid, entry, error = await authenticate(request, load_entry=True)
+        if error is not None:
+            return error
+        values = await request_values(request)
+        keyword = values.get('keyword', '').strip()
+        if not keyword:
+            return JSONResponse({"success": False, "message": "請輸入搜尋關鍵字！"})
+        limit = min(max(int_value(values, 'limit', SEARCH_DEFAULT_LIMIT), 1), SEARCH_MAX_LIMIT)
+        fuzzy = values.get('fuzzy', 'false') == 'true'
+        if entry is not None:
+            matched_words = entry.index.search(keyword, limit=limit, fuzzy=fuzzy)
+        else:
+            matched_words = await async_word_store.search(uid, keyword, limit=limit, fuzzy=fuzzy)
+        if matched_words:
+            return JSONResponse({"success": True, "words": matched_words})
+        return JSONResponse({"success": False, "message": "沒有符合的單字！"})
+    except Exception as e:
+        return server_error("搜尋單字錯誤", e)
+
+
+# 隨機單字
+async def random_words(request):
+    try:
+        uid, entry, error = await authenticate(request, load_entry=True)
+        if error is not None:
+            return error
+        values = await request_values(request)
+        is_unfamiliar = values.get('is_unfamiliar', 'false') == 'true'
+        n = min(max(int_value(values, 'n', RANDOM_DEFAULT_WORDS), 1), RANDOM_MAX_WORDS)
+        if entry is not None:
+            words = entry.sample(n, is_unfamiliar)
+        else:
+            words = [r.to_dict() for r in await async_word_store.sample(uid, n, is_unfamiliar)]
+        if not words:
+            return JSONResponse({"success": False, "message": "目前沒有單字可選擇！"})
+        return JSONResponse({"success": True, "words": words})
+    except Exception as e:
+        return server_error("隨機單字錯誤", e)
+
+
+# 逐筆取得單字：已快取時從記憶體讀取，否則邊讀取儲存邊回傳
+async def iter_words(uid, entry, is_unfamiliar):
+    if entry is not None:
+        for word in entry.filter(is_unfamiliar):
+            yield word
+        return
+    async for record in async_word_store.iter_words(uid, is_unfamiliar):
+        yield record.to_dict()
+
+
+async def stream_words(words, fmt):
+    if fmt == 'ndjson':
+        async for word in words:
+            yield json.dumps(word) + "\n"
+        return
+    yield '{"success": true, "words": ['
+    separator = ""
+    async for word in words:
+        yield separator + json.dumps(word)
+        separator = ","
+    yield ']}'
+
+
+# 單字清單回應：支援分頁 (limit/start_after) 與串流 (stream=json|ndjson)
+async def word_list_response(uid, entry, values, is_unfamiliar, empty_message):
+    fmt = values.get('stream')
+    if fmt in ('json', 'ndjson'):
+        media_type = 'application/x-ndjson' if fmt == 'ndjson' else 'application/json'
+        return StreamingResponse(stream_words(iter_words(uid, entry, is_unfamiliar), fmt), media_type=media_type)
+    limit = int_value(values, 'limit')
+    if limit is None:
+        if entry is None:
+            entry = UserWords(await async_word_store.load(uid), time.monotonic())
+        words = entry.filter(is_unfamiliar)
+        if not words:
+            return JSONResponse({"success": False, "message": empty_message})
+        return JSONResponse({"success": True, "words": words})
+    start_after = values.get('start_after') or None
+    limit = min(max(limit, 1), WORDS_PAGE_MAX)
+    if entry is not None:
+        words, next_cursor = entry.page(limit, start_after, is_unfamiliar)
+    else:
+        records, next_cursor = await async_word_store.load_page(uid, is_unfamiliar, limit, start_after)
+        words = [r.to_dict() for r in records]
+    if not words and start_after is None:
+        return JSONResponse({"success": False, "message": empty_message})
+    return JSONResponse({"success": True, "words": words, "next_cursor": next_cursor})
+
+
+# 條件式單字清單回應：先讀取單字版本，與 If-None-Match 相同時回傳 304，不載入單字（與 Flask 版本相同）
+async def conditional_word_list(request, uid, values, is_unfamiliar, empty_message):
+    version = await async_word_store.version(uid)
+    etag = flask_module.word_list_etag(uid, version)
+    if parse_etags(request.headers.get('If-None-Match')).contains_weak(etag):
+        response = Response(status_code=304)
+    else:
+        # 304 只收基本成本，回傳內容時依讀取量補收
+        limit = int_value(values, 'limit')
+        if limit is not None and values.get('stream') not in ('json', 'ndjson'):
+            limit = min(max(limit, 1), WORDS_PAGE_MAX)
+        else:
+            limit = None
+        wait = await rate_limit_charge(uid, request.url.path, limit)
+        if wait > 0:
+            return rate_limited(wait)
+        entry = await load_word_entry(uid, version) if word_cache.enabled else None
+        response = await word_list_response(uid, entry, values, is_unfamiliar, empty_message)
+    response.headers['ETag'] = quote_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['Vary'] = 'Authorization'
+    return response
+
+
+# 複習單字
+async def review_words(request):
+    try:
+        uid, _, error = await authenticate(request)
+        if error is not None:
+            return error
+        values = await request_values(request)
+        is_unfamiliar = values.get('is_unfamiliar', 'false') == 'true'
+        return await conditional_word_list(request, uid, values, is_unfamiliar, "目前沒有單字可複習！")
+    except Exception as e:
+        return server_error("複習單字錯誤", e)
+
+
+# 載入所有單字
+async def load_all_words(request):
+    try:
+        uid, _, error = await authenticate(request)
+        if error is not None:
+            return error
+        values = await request_values(request)
+        return await conditional_word_list(request, uid, values, None, "目前沒有單字！")
+    except Exception as e:
+        return server_error("載入所有單字錯誤", e)
+
+
+# 記錄路由延遲並視設定加上 Server-Timing 標頭
+def timed_route(path, handler):
+    if not metrics.active:
+        return handler
+
+    async def timed(request):
+        token = metrics.begin_request()
+        start = time.perf_counter()
+        response = await handler(request)
+        server_timing = metrics.end_request(token, path, request.method, response.status_code,
+                                            time.perf_counter() - start)
+        if server_timing:
+            response.headers['Server-Timing'] = server_timing
+        return response
+    return timed
+
+
+# 與 Flask 路由相同：超過 COMPRESS_MIN_SIZE 的文字回應依 Accept-Encoding 壓縮（串流回應除外）
+def compressed(handler):
+    async def negotiate(request):
+        response = await handler(request)
+        if (response.status_code != 200 or isinstance(response, StreamingResponse)
+                or 'Content-Encoding' in response.headers
+                or (response.media_type or '').split(';')[0] not in COMPRESSIBLE_MIMETYPES
+                or len(response.body) < COMPRESS_MIN_SIZE):
+            return response
+        vary = response.headers.get('Vary')
+        response.headers['Vary'] = f"{vary}, Accept-Encoding" if vary else 'Accept-Encoding'
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is not None:
+            response.body = compress(response.body, encoding)
+            response.headers['Content-Length'] = str(len(response.body))
+            response.headers['Content-Encoding'] = encoding
+        return response
+    return negotiate
+
+
+# 同時處理的請求達到上限時立即拒絕（與 Flask 路由共用上限）
+def admitted(handler):
+    if not concurrency_limiter.enabled:
+        return handler
+
+    async def admit(request):
+        if not concurrency_limiter.acquire():
+            return JSONResponse({"success": False, "message": "伺服器忙碌中，請稍後再試！"}, 503,
+                                headers={"Retry-After": "1"})
+        try:
+            return await handler(request)
+        finally:
+            concurrency_limiter.release()
+    return admit
+
+
+ASYNC_ROUTES = {
+    '/save_word': save_word,
+    '/search_word': search_word,
+    '/random_words': random_words,
+    '/review_words': review_words,
+    '/load_all_words': load_all_words
+}
+
+# 單字清單另外接受 GET，讓瀏覽器以 ETag 快取
+GET_ROUTES = {'/review_words', '/load_all_words'}
+
+app = Starlette(routes=[Route(path, timed_route(path, admitted(compressed(handler))),
+                              methods=['GET', 'POST'] if path in GET_ROUTES else ['POST'])
+                        for path, handler in ASYNC_ROUTES.items()]
+                + [Mount('/', app=WSGIMiddleware(flask_module.app))])
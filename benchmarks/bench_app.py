@@ -0,0 +1,26 @@
+import logging
+import os
+import sys
+
+# 基準測試用的 WSGI 應用程式：使用本機單字儲存並以模擬身份驗證取代 Firebase
+# 可直接由 gunicorn 載入：gunicorn benchmarks.bench_app:app
+os.environ.setdefault("WORD_STORE", "sqlite")
+os.environ.setdefault("WORD_STORE_PATH", "bench_words.db")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import app as app_module
+
+# 模擬 token 格式為 "bench-<uid>"
+BENCH_TOKEN_PREFIX = "bench-"
+
+
+def verify_bench_user(token):
+    if token.startswith(BENCH_TOKEN_PREFIX):
+        return token[len(BENCH_TOKEN_PREFIX):]
+    return None
+
+
+app_module.verify_user = verify_bench_user
+app_module.verify_token = verify_bench_user
+app_module.logger.setLevel(getattr(logging, os.getenv("BENCH_LOG_LEVEL", "WARNING")))
+app = app_module.app
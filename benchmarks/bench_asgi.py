@@ -0,0 +1,5 @@
+# ASGI 模式的基準測試應用程式：uvicorn benchmarks.bench_asgi:app
+from benchmarks import bench_app
+import asgi_app
+
+app = asgi_app.app
@@ -0,0 +1,79 @@
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import firestore
+from google.cloud.firestore_v1.base_document import DocumentSnapshot
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from words import WordRecord
+
+
+# 比較 load_words 改版前後每份文件的轉換成本與每次請求的記憶體用量
+# 以離線建立的 DocumentSnapshot 模擬 Firestore 回傳結果，不需連線
+
+# 建立模擬文件：改版前讀取完整文件，改版後只投影 word 與 is_unfamiliar
+def make_snapshots(n, projected):
+    client = firestore.Client(project="bench", credentials=AnonymousCredentials())
+    collection = client.collection("toeic_words")
+    snapshots = []
+    for i in range(n):
+        data = {"word": f"word{i:06d}", "is_unfamiliar": i % 5 == 0}
+        if not projected:
+            data["user_id"] = "bench_user_0123456789abcdef"
+        snapshots.append(DocumentSnapshot(collection.document(f"doc{i:020d}"), data, True, None, None, None))
+    return snapshots
+
+
+# 改版前：每份文件呼叫兩次 to_dict() 並轉為 dict
+def convert_before(snapshots):
+    return [{
+        "id": doc.id,
+        "word": doc.to_dict().get("word", ""),
+        "is_unfamiliar": doc.to_dict().get("is_unfamiliar", False)
+    } for doc in snapshots]
+
+
+# 改版後：每份文件呼叫一次 to_dict() 並轉為 __slots__ 資料列
+def convert_after(snapshots):
+    return [WordRecord.from_doc(doc) for doc in snapshots]
+
+
+def measure(convert, snapshots, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        convert(snapshots)
+        best = min(best, time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    result = convert(snapshots)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {
+        "us_per_doc": best / len(snapshots) * 1e6,
+        "retained_kb": retained / 1024,
+        "peak_kb": peak / 1024
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="load_words 文件轉換微基準測試")
+    parser.add_argument("--docs", type=int, default=10000, help="模擬文件數量")
+    parser.add_argument("--repeat", type=int, default=5, help="重複次數（取最快一次）")
+    args = parser.parse_args()
+    before = measure(convert_before, make_snapshots(args.docs, projected=False), args.repeat)
+    after = measure(convert_after, make_snapshots(args.docs, projected=True), args.repeat)
+    print(f"文件數量: {args.docs}")
+    print(f"{'':8}{'us/doc':>10}{'retained KB':>14}{'peak KB':>12}")
+    for name, result in (("before", before), ("after", after)):
+        print(f"{name:8}{result['us_per_doc']:>10.2f}{result['retained_kb']:>14.1f}{result['peak_kb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
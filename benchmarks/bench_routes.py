@@ -0,0 +1,286 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import string
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+# 各路由的基準測試：以 Flask test client（client 模式）或 HTTP（http 模式）發送請求
+# 使用模擬身份驗證與本機 SQLite 單字儲存，並以不同大小的合成單字庫測試
+ROUTES = ["save_word", "search_word", "random_words", "review_words", "load_all_words"]
+DEFAULT_SIZES = [10, 1000, 50000]
+UNFAMILIAR_RATIO = 0.2
+
+
+# 產生固定亂數種子的合成單字庫
+def synthetic_words(size, seed):
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 12))))
+    return sorted(words)
+
+
+# 將合成單字庫寫入單字儲存
+def seed_store(store, sizes):
+    vocabularies = {}
+    for size in sizes:
+        uid = f"bench_{size}"
+        words = synthetic_words(size, seed=size)
+        store.delete_many(uid, [r.word for r in store.load(uid)])
+        store.add_many(uid, words)
+        store.set_unfamiliar_many(uid, words[:int(size * UNFAMILIAR_RATIO)], True)
+        vocabularies[uid] = words
+    return vocabularies
+
+
+# 產生每個路由第 i 次請求的表單資料
+def request_data(route, words, i, rng):
+    if route == "save_word":
+        return {"word": f"benchnew{i:07d}"}
+    if route == "search_word":
+        word = rng.choice(words)
+        start = rng.randint(0, max(len(word) - 3, 0))
+        return {"keyword": word[start:start + 3]}
+    if route == "random_words":
+        return {"is_unfamiliar": rng.choice(["true", "false"])}
+    if route == "review_words":
+        return {"is_unfamiliar": "true"}
+    return {}
+
+
+# client 模式：在同一個程序內以 Flask test client 發送請求
+class ClientTransport:
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.local = threading.local()
+
+    def post(self, route, data, uid):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = self.flask_app.test_client()
+        response = client.post(f"/{route}", data=data, headers={"Authorization": f"Bearer bench-{uid}"})
+        response.get_data()
+        return response.status_code
+
+    def peak_rss_kb(self):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# http 模式：對執行中的伺服器發送請求
+class HttpTransport:
+    def __init__(self, url, server_pids=()):
+        self.url = url.rstrip("/")
+        self.server_pids = server_pids
+
+    def post(self, route, data, uid):
+        request = urllib.request.Request(f"{self.url}/{route}",
+                                         data=urllib.parse.urlencode(data).encode("utf-8"),
+                                         headers={"Authorization": f"Bearer bench-{uid}"})
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+    # 伺服器各程序記憶體高峰（VmHWM）的總和
+    def peak_rss_kb(self):
+        total = 0
+        for pid in self.server_pids():
+            try:
+                with open(f"/proc/{pid}/status") as status:
+                    for line in status:
+                        if line.startswith("VmHWM:"):
+                            total += int(line.split()[1])
+            except OSError:
+                continue
+        return total or None
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(int(round(p / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def run_scenario(transport, route, uid, words, requests, concurrency, warmup):
+    rng = random.Random(f"{route}-{uid}")
+    payloads = [request_data(route, words, i, rng) for i in range(warmup + requests)]
+    for data in payloads[:warmup]:
+        transport.post(route, data, uid)
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def send(data):
+        nonlocal errors
+        start = time.perf_counter()
+        status = transport.post(route, data, uid)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if status >= 500:
+                errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, payloads[warmup:]))
+    duration = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "route": route,
+        "vocab_size": len(words),
+        "requests": requests,
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "throughput_rps": requests / duration,
+        "peak_rss_kb": transport.peak_rss_kb()
+    }
+
+
+# 啟動伺服器並等待可連線：gunicorn（WSGI）或 uvicorn（ASGI 模式）
+def start_server(server, port, workers, threads, store_path):
+    env = dict(os.environ, WORD_STORE="sqlite", WORD_STORE_PATH=store_path)
+    if server == "uvicorn":
+        command = ["uvicorn", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers),
+                   "--log-level", "warning", "benchmarks.bench_asgi:app"]
+    else:
+        command = ["gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(workers),
+                   "--threads", str(threads), "benchmarks.bench_app:app"]
+    process = subprocess.Popen([sys.executable, "-m"] + command, cwd=ROOT, env=env)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(url + "/").read()
+            return process, url
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"{server} 啟動逾時")
+
+
+def child_pids(pid):
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as children:
+            pids.extend(int(child) for child in children.read().split())
+    except OSError:
+        pass
+    return pids
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# 比較兩次結果，列出 p50/p95/吞吐量的變化比例
+def compare(previous_path, report):
+    with open(previous_path, encoding="utf-8") as f:
+        previous = {(r["route"], r["vocab_size"]): r for r in json.load(f)["results"]}
+    print(f"\n與 {previous_path} 比較（新/舊）")
+    print(f"{'route':16}{'size':>8}{'p50':>8}{'p95':>8}{'rps':>8}")
+    for result in report["results"]:
+        old = previous.get((result["route"], result["vocab_size"]))
+        if old is None:
+            continue
+        print(f"{result['route']:16}{result['vocab_size']:>8}"
+              f"{result['p50_ms'] / old['p50_ms']:>8.2f}"
+              f"{result['p95_ms'] / old['p95_ms']:>8.2f}"
+              f"{result['throughput_rps'] / old['throughput_rps']:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="路由基準測試")
+    parser.add_argument("--mode", choices=["client", "http"], default="client",
+                        help="client: Flask test client；http: 對 gunicorn 發送請求")
+    parser.add_argument("--url", help="http 模式下已啟動伺服器的網址（未指定則自動啟動伺服器）")
+    parser.add_argument("--server", choices=["gunicorn", "uvicorn"], default="gunicorn",
+                        help="自動啟動的伺服器：gunicorn（WSGI）或 uvicorn（ASGI 模式）")
+    parser.add_argument("--port", type=int, default=8099, help="自動啟動伺服器的連接埠")
+    parser.add_argument("--workers", type=int, default=2, help="自動啟動伺服器的 worker 數")
+    parser.add_argument("--threads", type=int, default=4, help="自動啟動 gunicorn 的 thread 數")
+    parser.add_argument("--store-path", default=os.path.join(ROOT, "bench_words.db"),
+                        help="http 模式使用的 SQLite 檔案")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="單字庫大小，以逗號分隔")
+    parser.add_argument("--routes", default=",".join(ROUTES), help="測試的路由，以逗號分隔")
+    parser.add_argument("--requests", type=int, default=200, help="每個情境的請求數")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時發送的請求數")
+    parser.add_argument("--warmup", type=int, default=5, help="不計入結果的暖機請求數")
+    parser.add_argument("--output", help="結果 JSON 檔案路徑")
+    parser.add_argument("--compare", help="與先前的結果 JSON 比較")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+    routes = args.routes.split(",")
+
+    process = None
+    if args.mode == "client":
+        os.environ.setdefault("WORD_STORE", "memory")
+        from benchmarks import bench_app
+        store = bench_app.app_module.word_store
+        transport = ClientTransport(bench_app.app)
+    else:
+        from word_store import SQLiteWordStore
+        store = SQLiteWordStore(args.store_path)
+        url = args.url
+        if url is None:
+            process, url = start_server(args.server, args.port, args.workers, args.threads, args.store_path)
+        transport = HttpTransport(url, lambda: child_pids(process.pid) if process else [])
+
+    try:
+        vocabularies = seed_store(store, sizes)
+        results = []
+        for uid, words in vocabularies.items():
+            for route in routes:
+                result = run_scenario(transport, route, uid, words, args.requests, args.concurrency, args.warmup)
+                results.append(result)
+                print(f"{route:16}{len(words):>8} p50 {result['p50_ms']:8.2f}ms  p95 {result['p95_ms']:8.2f}ms  "
+                      f"p99 {result['p99_ms']:8.2f}ms  {result['throughput_rps']:9.1f} req/s  "
+                      f"rss {result['peak_rss_kb']} KB  errors {result['errors']}")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "mode": args.mode,
+            "server": args.server if args.mode == "http" else None,
+            "requests": args.requests,
+            "concurrency": args.concurrency
+        },
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        compare(args.compare, report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+import bisect
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from search_index import SearchIndex
+from words import normalize_word
+
+
+# Firebase ID token 驗證結果快取
+# 以 token 的 SHA-256 雜湊為鍵，依 token 的 exp 與時鐘誤差決定有效期限，
+# 並對驗證失敗的 token 做短暫的負向快取
+class TokenCache:
+    def __init__(self, maxsize=10000, clock_skew=30, max_ttl=3600, negative_ttl=60):
+        self.maxsize = maxsize
+        self.clock_skew = clock_skew
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    # 查詢快取，回傳 (是否命中, uid)；負向快取命中時 uid 為 None
+    def lookup(self, token):
+        key = self._key(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            uid, expires_at = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            if uid is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return True, uid
+
+    # 快取驗證成功的 token，有效期限不超過 exp + 時鐘誤差
+    def put(self, token, uid, exp):
+        if exp is None:
+            return
+        now = time.time()
+        expires_at = min(exp + self.clock_skew, now + self.max_ttl)
+        if expires_at <= now:
+            return
+        self._store(self._key(token), uid, expires_at)
+
+    # 快取驗證失敗的 token
+    def put_invalid(self, token):
+        if self.negative_ttl <= 0:
+            return
+        self._store(self._key(token), None, time.time() + self.negative_ttl)
+
+    def _store(self, key, uid, expires_at):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (uid, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.negative_hits = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "negative_hits": self.negative_hits
+            }
+
+
+# 可 O(1) 新增/移除並 O(k) 隨機抽樣的鍵集合（陣列 + 位置索引）
+class SamplePool:
+    def __init__(self, keys=()):
+        self.keys = list(keys)
+        self.positions = {key: i for i, key in enumerate(self.keys)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key):
+        if key not in self.positions:
+            self.positions[key] = len(self.keys)
+            self.keys.append(key)
+
+    # 以最後一個元素填補被移除的位置
+    def discard(self, key):
+        position = self.positions.pop(key, None)
+        if position is None:
+            return
+        last = self.keys.pop()
+        if position < len(self.keys):
+            self.keys[position] = last
+            self.positions[last] = position
+
+
+# 每個使用者的單字快取內容
+class UserWords:
+    # 估算單筆單字佔用的記憶體（資料列、字串與搜尋索引的固定開銷）
+    ENTRY_OVERHEAD = 800
+
+    def __init__(self, words, loaded_at, version=None):
+        self.words = {normalize_word(w.word): w for w in words}
+        self.loaded_at = loaded_at
+        # 快取內容對應的單字版本；None 表示無法確定對應哪個版本（本程序寫入過或載入時未指定版本）
+        self.version = version
+        self.nbytes = sum(self._size(w) for w in self.words.values())
+        self._pools = {
+            flag: SamplePool(k for k, w in self.words.items() if w.is_unfamiliar == flag)
+            for flag in (True, False)
+        }
+        self._index = None
+        self._ordered = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _size(cls, word):
+        return cls.ENTRY_OVERHEAD + len(word.word) + len(word.id)
+
+    # 搜尋索引在第一次搜尋時才建立，之後隨寫入同步更新
+    @property
+    def index(self):
+        with self._lock:
+            if self._index is None:
+                self._index = SearchIndex(w.word for w in self.words.values())
+            return self._index
+
+    def contains(self, word):
+        return normalize_word(word) in self.words
+
+    def get(self, word):
+        return self.words.get(normalize_word(word))
+
+    def filter(self, is_unfamiliar=None):
+        with self._lock:
+            if is_unfamiliar is None:
+                return [w.to_dict() for w in self.words.values()]
+            return [w.to_dict() for w in self.words.values() if w.is_unfamiliar == is_unfamiliar]
+
+    # 隨機抽樣 n 個單字，成本與單字總數無關
+    def sample(self, n, is_unfamiliar=None):
+        with self._lock:
+            if is_unfamiliar is None:
+                pools = [self._pools[True].keys, self._pools[False].keys]
+            else:
+                pools = [self._pools[is_unfamiliar].keys]
+            total = sum(len(keys) for keys in pools)
+            picked = []
+            for i in random.sample(range(total), min(n, total)):
+                for keys in pools:
+                    if i < len(keys):
+                        picked.append(self.words[keys[i]].to_dict())
+                        break
+                    i -= len(keys)
+            return picked
+
+    # 依單字原文排序分頁（與 Firestore 的 order_by("word") 順序一致），回傳 (單字, 下一頁游標)
+    def page(self, limit, start_after=None, is_unfamiliar=None):
+        with self._lock:
+            if self._ordered is None:
+                self._ordered = sorted((w.word, k) for k, w in self.words.items())
+            position = 0
+            if start_after is not None:
+                position = bisect.bisect_right(self._ordered, (start_after, "\U0010ffff"))
+            picked = []
+            for word, key in self._ordered[position:]:
+                cached = self.words[key]
+                if is_unfamiliar is None or cached.is_unfamiliar == is_unfamiliar:
+                    picked.append(cached.to_dict())
+                    if len(picked) == limit:
+                        break
+            return picked, picked[-1]["word"] if len(picked) == limit else None
+
+    # 以下寫入方法回傳記憶體用量的變化量
+    def add(self, word):
+        key = normalize_word(word.word)
+        with self._lock:
+            old = self.words.get(key)
+            if old is not None:
+                self._pools[old.is_unfamiliar].discard(key)
+            self.words[key] = word
+            self._pools[word.is_unfamiliar].add(key)
+            if self._ordered is not None:
+                if old is not None:
+                    self._ordered.remove((old.word, key))
+                bisect.insort(self._ordered, (word.word, key))
+            if self._index is not None:
+                self._index.add(word.word)
+            delta = self._size(word) - (self._size(old) if old is not None else 0)
+            self.nbytes += delta
+            return delta
+
+    def remove(self, word):
+        with self._lock:
+            key = normalize_word(word)
+            old = self.words.pop(key, None)
+            if old is None:
+                return 0
+            self._pools[old.is_unfamiliar].discard(key)
+            if self._ordered is not None:
+                del self._ordered[bisect.bisect_left(self._ordered, (old.word, key))]
+            if self._index is not None:
+                self._index.remove(old.word)
+            self.nbytes -= self._size(old)
+            return -self._size(old)
+
+    def set_unfamiliar(self, word, is_unfamiliar):
+        with self._lock:
+            key = normalize_word(word)
+            cached = self.words.get(key)
+            if cached is not None and cached.is_unfamiliar != is_unfamiliar:
+                self._pools[cached.is_unfamiliar].discard(key)
+                self._pools[is_unfamiliar].add(key)
+                cached.is_unfamiliar = is_unfamiliar
+
+
+# 以使用者為單位的單字快取
+# 採 LRU 淘汰並限制總記憶體用量，寫入時同步更新（write-through）
+class WordCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, uid):
+        with self._lock:
+            entry = self._entries.get(uid)
+            if entry is not None and self.ttl > 0 and time.monotonic() - entry.loaded_at > self.ttl:
+                self._remove(uid)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(uid)
+            self.hits += 1
+            return entry
+
+    # 依單字版本取得快取：版本不同或不確定時移除並回傳 None，由呼叫端以該版本重新載入
+    def get_version(self, uid, version):
+        entry = self.get(uid)
+        if entry is None:
+            return None
+        with self._lock:
+            if entry.version is None or entry.version != version:
+                if self._entries.get(uid) is entry:
+                    self._remove(uid)
+                return None
+        return entry
+
+    def put(self, uid, words, version=None):
+        entry = UserWords(words, time.monotonic(), version)
+        if entry.nbytes > self.max_bytes:
+            return entry
+        with self._lock:
+            self._remove(uid)
+            self._entries[uid] = entry
+            self.nbytes += entry.nbytes
+            while self.nbytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+        return entry
+
+    # 本程序寫入儲存後更新快取（僅在該使用者已被快取時）；versions 為儲存回報的 [(寫入前版本, 寫入後版本), ...]
+    # 每次寫入都接續快取的版本時才套用變更並採用寫入後的版本；不接續表示其他程序也寫入過，快取缺少那些變更而移除
+    # versions 為 None 時（延後寫入尚未送出的變更）只套用變更，版本不變
+    def add_words(self, uid, words, versions=None):
+        self._apply(uid, versions, lambda entry: sum(entry.add(word) for word in words))
+
+    def remove_words(self, uid, words, versions=None):
+        self._apply(uid, versions, lambda entry: sum(entry.remove(word) for word in words))
+
+    def set_unfamiliar(self, uid, words, is_unfamiliar, versions=None):
+        def change(entry):
+            for word in words:
+                entry.set_unfamiliar(word, is_unfamiliar)
+            return 0
+        self._apply(uid, versions, change)
+
+    # 其他途徑（例如延後寫入）寫入的變更已在快取中，只更新版本
+    def advance(self, uid, versions):
+        self._apply(uid, versions, lambda entry: 0)
+
+    def _apply(self, uid, versions, change):
+        with self._lock:
+            entry = self._entries.get(uid)
+            if entry is None:
+                return
+            version = entry.version
+            for before, after in versions or ():
+                if version is None or before != version:
+                    self._remove(uid)
+                    return
+                version = after
+            self.nbytes += change(entry)
+            entry.version = version
+
+    def invalidate(self, uid):
+        with self._lock:
+            self._remove(uid)
+
+    def _remove(self, uid):
+        entry = self._entries.pop(uid, None)
+        if entry is not None:
+            self.nbytes -= entry.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self._entries),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
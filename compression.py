@@ -0,0 +1,57 @@
+import gzip
+import hashlib
+import threading
+from werkzeug.http import parse_accept_header
+
+# brotli 為選用套件，未安裝時只使用 gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 值得壓縮的內容類型（圖片等已壓縮的格式不在此列）
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "text/html",
+    "text/css",
+    "text/csv",
+    "text/plain"
+}
+
+# 動態回應的壓縮等級：偏重速度，壓縮率與最高等級差距不大
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+# 依 Accept-Encoding 選擇編碼：優先 br，其次 gzip；都不接受時回傳 None
+def choose_encoding(accept_encoding):
+    accepted = parse_accept_header(accept_encoding)
+    if brotli is not None and accepted["br"] > 0:
+        return "br"
+    if accepted["gzip"] > 0:
+        return "gzip"
+    return None
+
+
+def compress(data, encoding, gzip_level=GZIP_LEVEL, brotli_quality=BROTLI_QUALITY):
+    if encoding == "br":
+        return brotli.compress(data, quality=brotli_quality)
+    return gzip.compress(data, compresslevel=gzip_level, mtime=0)
+
+
+# 內容固定的回應（例如渲染後的主頁），各編碼的壓縮結果只計算一次並以最高壓縮等級壓縮
+class PrecompressedBody:
+    def __init__(self, data):
+        self.data = data
+        self.etag = hashlib.sha256(data).hexdigest()[:16]
+        self._variants = {None: data}
+        self._lock = threading.Lock()
+
+    def get(self, encoding):
+        with self._lock:
+            body = self._variants.get(encoding)
+            if body is None:
+                body = self._variants[encoding] = compress(self.data, encoding, gzip_level=9, brotli_quality=11)
+            return body
@@ -0,0 +1,65 @@
+import logging
+import os
+
+import pytest
+from dotenv import load_dotenv
+from google.api_core.exceptions import GoogleAPICallError
+from google.cloud.firestore import AsyncClient, FieldFilter
+
+logger = logging.getLogger(__name__)
+
+# 測試使用的資料庫：TEST_FIRESTORE=memory 使用記憶體中的 Firestore 替身（不需憑證、不連線），
+# TEST_FIRESTORE=firestore 連線真正的 Firestore；未指定時，有設定 FIREBASE_CREDENTIALS_PATH（含 .env）才連線
+# 每個 pytest-xdist worker 是獨立程序，各有一份替身資料，離線模式可用 pytest -n auto 平行執行
+load_dotenv()
+TEST_FIRESTORE = os.getenv("TEST_FIRESTORE") or ("firestore" if os.getenv("FIREBASE_CREDENTIALS_PATH") else "memory")
+if TEST_FIRESTORE == "memory":
+    # 不初始化 Firebase，身份驗證由各測試以 monkeypatch 模擬
+    os.environ["FIREBASE_CREDENTIALS_PATH"] = ""
+
+import app
+import memory_firestore
+from word_store import AsyncFirestoreWordStore, FirestoreWordStore
+
+memory_db = None
+if TEST_FIRESTORE == "memory":
+    memory_db = memory_firestore.Client()
+    app.use_firestore_client(memory_db)
+    app.use_firestore_client(memory_firestore.AsyncClient(memory_db), AsyncClient)
+    FirestoreWordStore.transactional = staticmethod(memory_firestore.transactional)
+    AsyncFirestoreWordStore.async_transactional = staticmethod(memory_firestore.async_transactional)
+
+# 測試使用者與測試中會寫入的單字
+TEST_USER_ID = 'test_user_id'
+TEST_WORDS = ['exam', 'good', 'bad', 'cool', 'test']
+
+
+# 連線 Firestore 時逐一刪除測試單字
+def delete_test_words(stage):
+    db = app.get_db()
+    for word in TEST_WORDS:
+        try:
+            query = (db.collection("toeic_words")
+                     .where(filter=FieldFilter("user_id", "==", TEST_USER_ID))
+                     .where(filter=FieldFilter("word", "==", word))
+                     .limit(1))
+            for doc in query.get():
+                doc.reference.delete()
+        except GoogleAPICallError as e:
+            logger.error(f"{stage}：刪除單字 '{word}' 失敗: {e}")
+
+
+def reset_test_data(stage):
+    if memory_db is not None:
+        memory_db.reset()
+    else:
+        delete_test_words(stage)
+    app.word_cache.clear()
+
+
+# 每個測試前後清除測試資料；離線模式直接清空記憶體中的資料
+@pytest.fixture(autouse=True)
+def clean_test_data():
+    reset_test_data("測試前清理")
+    yield
+    reset_test_data("測試後清理")
@@ -0,0 +1,100 @@
+import argparse
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from app import db, logger
+from maintenance import rebuild_stats
+from word_export import DUMP_FIELDS, export_row, import_row
+from word_store import FIRESTORE_BATCH_LIMIT
+
+
+# 副檔名為 .gz 時以 gzip 讀寫
+def open_text(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+# 備份整個 toeic_words 集合（所有使用者）為 NDJSON
+# 以分割查詢平行讀取，每個分割寫入各自的暫存檔，最後依序合併
+def dump(path, partitions=8, workers=8):
+    queries = [partition.query() for partition in db.collection_group("toeic_words").get_partitions(partitions)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        def dump_partition(i):
+            part = os.path.join(tmp, f"part-{i}")
+            count = 0
+            with open(part, "w", encoding="utf-8") as f:
+                for doc in queries[i].stream():
+                    data = doc.to_dict()
+                    data["id"] = doc.id
+                    f.write(json.dumps(export_row(data, DUMP_FIELDS), ensure_ascii=False) + "\n")
+                    count += 1
+            return part, count
+
+        with ThreadPoolExecutor(workers) as pool:
+            results = list(pool.map(dump_partition, range(len(queries))))
+        with open_text(path, "w") as out:
+            for part, _ in results:
+                with open(part, encoding="utf-8") as f:
+                    shutil.copyfileobj(f, out)
+    total = sum(count for _, count in results)
+    logger.info(f"單字備份完成：{len(queries)} 個分割，共 {total} 筆，輸出至 {path}")
+    return total
+
+
+# 由 NDJSON 備份還原，保留原本的文件 ID；已存在的文件會被覆寫
+# 分批平行寫入，同時進行中的批次數有上限，記憶體用量與檔案大小無關
+def restore(path, workers=8, update_stats=True):
+    collection = db.collection("toeic_words")
+
+    def write(rows):
+        batch = db.batch()
+        for row in rows:
+            batch.set(collection.document(row.pop("id")), row)
+        batch.commit()
+        return len(rows)
+
+    total = 0
+    pending = set()
+    with open_text(path, "r") as f, ThreadPoolExecutor(workers) as pool:
+        rows = []
+        for line in f:
+            if not line.strip():
+                continue
+            rows.append(import_row(json.loads(line)))
+            if len(rows) == FIRESTORE_BATCH_LIMIT:
+                pending.add(pool.submit(write, rows))
+                rows = []
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                total += sum(future.result() for future in done)
+        if rows:
+            pending.add(pool.submit(write, rows))
+        total += sum(future.result() for future in pending)
+    logger.info(f"單字還原完成：共 {total} 筆，來源 {path}")
+    # 還原直接寫入單字文件，需重新計算使用者統計
+    if update_stats:
+        rebuild_stats()
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="備份或還原整個 toeic_words 集合（NDJSON，副檔名 .gz 時壓縮）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    dump_parser = subparsers.add_parser("dump", help="備份所有使用者的單字")
+    dump_parser.add_argument("path")
+    dump_parser.add_argument("--partitions", type=int, default=8, help="分割查詢數量")
+    dump_parser.add_argument("--workers", type=int, default=8, help="平行讀取的執行緒數")
+    restore_parser = subparsers.add_parser("restore", help="由備份還原單字")
+    restore_parser.add_argument("path")
+    restore_parser.add_argument("--workers", type=int, default=8, help="平行寫入的執行緒數")
+    restore_parser.add_argument("--skip-stats", action="store_true", help="還原後不重新計算使用者統計")
+    args = parser.parse_args()
+    if args.command == "dump":
+        dump(args.path, partitions=args.partitions, workers=args.workers)
+    else:
+        restore(args.path, workers=args.workers, update_stats=not args.skip_stats)
@@ -0,0 +1,64 @@
+import os
+
+# gunicorn 正式環境設定：gunicorn -c gunicorn.conf.py app:app
+# 所有數值皆可用環境變數覆寫
+
+
+# 可用的 CPU 核心數：容器以 cgroup 限制 CPU 時以配額為準
+def available_cpus():
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(int(int(quota) / int(period) + 0.5), 1))
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if quota > 0:
+                cpus = min(cpus, max(int(quota / period + 0.5), 1))
+        except (OSError, ValueError):
+            pass
+    return cpus
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+
+# 預設每個可用核心一個 worker（GUNICORN_WORKERS=auto），每個 worker 以多個執行緒等待 Firestore
+# 單字快取依統計文件的版本確認，各 worker 的快取不會回傳其他 worker 寫入前的內容；
+# 取捨：快取、token 快取與延後寫入佇列在每個 worker 各有一份，命中率下降、Firestore 讀取與記憶體用量增加；
+# 記憶體中的流量限制也是每個 worker 各自計算，需要精確的上限時設定 RATE_LIMIT_REDIS_URL 共用
+workers = os.getenv("GUNICORN_WORKERS", "auto")
+workers = available_cpus() if workers == "auto" else int(workers)
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+# 在主程序載入應用程式後再 fork，worker 共用已載入的模組，啟動較快；
+# Firestore 用戶端延遲到各 worker 第一次使用時才建立
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") or None
+
+
+# worker 啟動後先建立 Firestore 用戶端，第一個請求不需等待，憑證錯誤也能在啟動時發現
+# 啟用延後寫入時一併啟動背景執行緒，重播已結束 worker 留下的日誌
+def post_worker_init(worker):
+    import app
+    if app.WORD_STORE_BACKEND == "firestore":
+        app.get_db()
+    app.write_behind.start()
+
+
+# worker 結束前寫入所有待寫入的不熟標記
+def worker_exit(server, worker):
+    import app
+    app.write_behind.stop()
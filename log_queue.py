@@ -0,0 +1,120 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+# LogRecord 的內建屬性，其餘屬性視為 extra 欄位輸出
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+# 以單行 JSON 輸出日誌紀錄，extra 傳入的欄位一併輸出
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "lineno": record.lineno,
+            "message": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and key != "sample":
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc_info"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+# 高頻率的 INFO 紀錄（以 extra={"sample": True} 標記）依來源位置抽樣，
+# 每 every 筆保留一筆，並在保留的紀錄加上略過的筆數
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.every = max(int(round(1 / rate)), 1) if rate > 0 else 0
+        self._skipped = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, "sample", False) or record.levelno > logging.INFO or self.every == 1:
+            return True
+        if self.every == 0:
+            return False
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            skipped = self._skipped.get(key, 0)
+            if skipped + 1 < self.every:
+                self._skipped[key] = skipped + 1
+                return False
+            self._skipped[key] = 0
+        record.sampled_out = skipped
+        return True
+
+
+# 在請求執行緒只做訊息組合與放入佇列；佇列已滿時丟棄並計數，不等待
+class NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._exception_formatter = logging.Formatter()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    # 保留原始訊息與例外文字，交由背景執行緒的 formatter 輸出
+    def prepare(self, record):
+        message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+        record = logging.makeLogRecord(vars(record))
+        record.msg = message
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+# 可重複呼叫 stop（例如已手動停止後程式結束時再次呼叫）
+class SafeQueueListener(QueueListener):
+    running = False
+
+    def start(self):
+        super().start()
+        self.running = True
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            super().stop()
+
+
+# 讓 logger 經由佇列輸出到指定 handlers，實際 I/O 由背景執行緒進行
+# 背景執行緒在程式結束時寫完佇列中的紀錄後停止
+def start_queue_logging(logger, handlers, queue_size=10000, sample_rate=1.0):
+    queue_handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+    queue_handler.setLevel(min(handler.level for handler in handlers))
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+
+    def start_listener():
+        listener = SafeQueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        queue_handler.listener = listener
+
+    # 子程序不會繼承背景執行緒，改用新的佇列與執行緒
+    def restart_in_child():
+        queue_handler.queue = queue.Queue(queue_size)
+        start_listener()
+
+    start_listener()
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=restart_in_child)
+    logger.addHandler(queue_handler)
+    return queue_handler
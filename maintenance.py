@@ -0,0 +1,70 @@
+import argparse
+from google.cloud.firestore import Increment
+from app import db, logger
+from scheduler import Schedule, utcnow
+from word_store import FIRESTORE_BATCH_LIMIT, STATS_COLLECTION
+
+# Firestore 資料維護工具：新增功能後補齊既有資料，每個子命令可重複執行
+
+
+# 為尚未有排程欄位的單字補上立即到期的排程，讓到期查詢 (due <=) 能查到舊單字
+def backfill_schedule(dry_run=False):
+    fields = Schedule.new(utcnow()).to_fields()
+    batch = db.batch()
+    pending = updated = 0
+    for doc in db.collection("toeic_words").select(["due"]).stream():
+        if doc.to_dict().get("due") is not None:
+            continue
+        batch.update(doc.reference, fields)
+        pending += 1
+        updated += 1
+        if pending >= FIRESTORE_BATCH_LIMIT:
+            if not dry_run:
+                batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending and not dry_run:
+        batch.commit()
+    logger.info(f"複習排程補齊完成 (dry_run={dry_run})：更新 {updated} 筆")
+    return {"updated": updated}
+
+
+# 由所有單字文件重新計算每位使用者的統計文件
+def rebuild_stats(dry_run=False):
+    counts = {}
+    for doc in db.collection("toeic_words").select(["user_id", "is_unfamiliar"]).stream():
+        data = doc.to_dict()
+        total, unfamiliar = counts.get(data.get("user_id"), (0, 0))
+        counts[data.get("user_id")] = (total + 1, unfamiliar + int(data.get("is_unfamiliar", False)))
+    counts.pop(None, None)
+    batch = db.batch()
+    pending = 0
+    for uid, (total, unfamiliar) in counts.items():
+        # 版本遞增而非重設，避免與用戶端已快取的 ETag 相同
+        batch.set(db.collection(STATS_COLLECTION).document(uid),
+                  {"total": total, "unfamiliar": unfamiliar, "version": Increment(1), "last_updated": utcnow()},
+                  merge=True)
+        pending += 1
+        if pending >= FIRESTORE_BATCH_LIMIT:
+            if not dry_run:
+                batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending and not dry_run:
+        batch.commit()
+    logger.info(f"使用者統計重建完成 (dry_run={dry_run})：{len(counts)} 位使用者")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="toeic_words 資料維護")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    schedule_parser = subparsers.add_parser("backfill-schedule", help="替沒有複習排程的單字補上立即到期的排程")
+    schedule_parser.add_argument("--dry-run", action="store_true", help="只統計，不寫入 Firestore")
+    stats_parser = subparsers.add_parser("rebuild-stats", help="由所有單字重新計算每位使用者的統計文件")
+    stats_parser.add_argument("--dry-run", action="store_true", help="只統計，不寫入 Firestore")
+    args = parser.parse_args()
+    if args.command == "backfill-schedule":
+        backfill_schedule(dry_run=args.dry_run)
+    else:
+        rebuild_stats(dry_run=args.dry_run)
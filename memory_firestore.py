@@ -0,0 +1,444 @@
+import copy
+import functools
+import threading
+import uuid
+from datetime import datetime, timezone
+
+from google.api_core.exceptions import AlreadyExists, NotFound
+from google.cloud.firestore_v1.transforms import Increment, Sentinel
+
+# 記憶體中的 Firestore 替身，供離線測試使用（見 conftest.py）
+# 只實作本專案用到的部分：文件讀寫、FieldFilter / where / order_by / start_after / limit / select 查詢、
+# count 聚合、批次寫入、交易、get_all 與 collection_group 分割查詢
+# 所有操作共用一個鎖，交易從開始到提交期間持有鎖，因此交易內的讀寫不會被其他執行緒穿插
+# 交易需使用本模組的 transactional（conftest.py 會替 FirestoreWordStore 換上），google 的裝飾器依賴程式庫內部介面
+# AsyncClient 包裝同一份資料提供非同步介面（供 AsyncFirestoreWordStore 使用），交易使用本模組的 async_transactional
+
+OPERATORS = {
+    "==": lambda value, target: value == target,
+    "!=": lambda value, target: value is not None and value != target,
+    "<": lambda value, target: value is not None and value < target,
+    "<=": lambda value, target: value is not None and value <= target,
+    ">": lambda value, target: value is not None and value > target,
+    ">=": lambda value, target: value is not None and value >= target,
+    "in": lambda value, target: value in target,
+    "not-in": lambda value, target: value is not None and value not in target,
+    "array_contains": lambda value, target: isinstance(value, list) and target in value
+}
+
+
+# 套用寫入的欄位：Increment 累加，SERVER_TIMESTAMP 以目前時間取代
+def apply_fields(old, fields):
+    data = copy.deepcopy(old) if old is not None else {}
+    for field, value in fields.items():
+        if isinstance(value, Increment):
+            data[field] = data.get(field, 0) + value.value
+        elif isinstance(value, Sentinel):
+            data[field] = datetime.now(timezone.utc)
+        else:
+            data[field] = copy.deepcopy(value)
+    return data
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def get(self, field):
+        return copy.deepcopy(self._data[field])
+
+
+class DocumentReference:
+    def __init__(self, client, collection, id):
+        self._client = client
+        self._collection = collection
+        self.id = id
+
+    @property
+    def path(self):
+        return f"{self._collection}/{self.id}"
+
+    @property
+    def _documents(self):
+        return self._client._collection_data(self._collection)
+
+    def get(self, field_paths=None, transaction=None, **kwargs):
+        with self._client._lock:
+            data = self._documents.get(self.id)
+            return DocumentSnapshot(self, _select(data, field_paths))
+
+    def set(self, document_data, merge=False):
+        with self._client._lock:
+            self._documents[self.id] = apply_fields(self._documents.get(self.id) if merge else None,
+                                                    document_data)
+
+    def create(self, document_data):
+        with self._client._lock:
+            if self.id in self._documents:
+                raise AlreadyExists(f"文件已存在: {self._collection}/{self.id}")
+            self._documents[self.id] = apply_fields(None, document_data)
+
+    def update(self, field_updates):
+        with self._client._lock:
+            if self.id not in self._documents:
+                raise NotFound(f"找不到文件: {self._collection}/{self.id}")
+            self._documents[self.id] = apply_fields(self._documents[self.id], field_updates)
+
+    def delete(self):
+        with self._client._lock:
+            self._documents.pop(self.id, None)
+
+
+def _select(data, fields):
+    if data is None or fields is None:
+        return copy.deepcopy(data)
+    return {field: copy.deepcopy(data[field]) for field in fields if field in data}
+
+
+class AggregationResult:
+    def __init__(self, alias, value):
+        self.alias = alias
+        self.value = value
+
+
+class CountQuery:
+    def __init__(self, query, alias):
+        self._query = query
+        self._alias = alias
+
+    def get(self, transaction=None, **kwargs):
+        return [[AggregationResult(self._alias, len(self._query._matches()))]]
+
+
+class Query:
+    def __init__(self, client, collection):
+        self._client = client
+        self._collection = collection
+        self._filters = []
+        self._orders = []
+        self._start_after = None
+        self._limit = None
+        self._fields = None
+
+    def _copy(self, **changes):
+        query = Query(self._client, self._collection)
+        query.__dict__.update(self.__dict__)
+        query._filters = list(self._filters)
+        query._orders = list(self._orders)
+        query.__dict__.update(changes)
+        return query
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        if op_string not in OPERATORS:
+            raise NotImplementedError(f"不支援的查詢運算子: {op_string}")
+        return self._copy(_filters=self._filters + [(field_path, op_string, value)])
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(_orders=self._orders + [(field_path, direction == "DESCENDING")])
+
+    def start_after(self, document_fields):
+        if isinstance(document_fields, DocumentSnapshot):
+            document_fields = document_fields.to_dict()
+        return self._copy(_start_after=document_fields)
+
+    def limit(self, count):
+        return self._copy(_limit=count)
+
+    def select(self, field_paths):
+        return self._copy(_fields=list(field_paths))
+
+    def count(self, alias=None):
+        return CountQuery(self._copy(_limit=None), alias)
+
+    def _matches(self):
+        with self._client._lock:
+            documents = list(self._client._collection_data(self._collection).items())
+        matches = [(id, data) for id, data in documents
+                   if all(field in data and OPERATORS[op](data[field], value)
+                          for field, op, value in self._filters)]
+        # 與 Firestore 相同：排序欄位不存在的文件不會出現在結果中；未指定排序時依文件 ID
+        for field, descending in reversed(self._orders):
+            matches = [(id, data) for id, data in matches if field in data]
+            matches.sort(key=lambda item: item[1][field], reverse=descending)
+        if not self._orders:
+            matches.sort(key=lambda item: item[0])
+        if self._start_after is not None:
+            cursor = tuple(self._start_after[field] for field, _ in self._orders)
+            matches = [(id, data) for id, data in matches
+                       if _after(tuple(data[field] for field, _ in self._orders), cursor,
+                                 [descending for _, descending in self._orders])]
+        if self._limit is not None:
+            matches = matches[:self._limit]
+        return matches
+
+    def stream(self, transaction=None, **kwargs):
+        for id, data in self._matches():
+            yield DocumentSnapshot(DocumentReference(self._client, self._collection, id),
+                                   _select(data, self._fields))
+
+    def get(self, transaction=None, **kwargs):
+        return list(self.stream())
+
+
+def _after(values, cursor, descending):
+    for value, target, desc in zip(values, cursor, descending):
+        if value != target:
+            return value < target if desc else value > target
+    return False
+
+
+class CollectionReference(Query):
+    @property
+    def id(self):
+        return self._collection
+
+    def document(self, document_id=None):
+        return DocumentReference(self._client, self._collection, document_id or uuid.uuid4().hex[:20])
+
+    def add(self, document_data, document_id=None):
+        reference = self.document(document_id)
+        reference.create(document_data)
+        return datetime.now(timezone.utc), reference
+
+
+# 集合群組：本替身只有頂層集合，與同名集合相同；分割查詢只回傳一個分割
+class QueryPartition:
+    def __init__(self, query):
+        self._query = query
+
+    def query(self):
+        return self._query
+
+
+class CollectionGroup(Query):
+    def get_partitions(self, partition_count, **kwargs):
+        return [QueryPartition(self)]
+
+
+# 批次寫入：提交時才依序套用
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(lambda: reference.set(document_data, merge=merge))
+
+    def create(self, reference, document_data):
+        self._writes.append(lambda: reference.create(document_data))
+
+    def update(self, reference, field_updates):
+        self._writes.append(lambda: reference.update(field_updates))
+
+    def delete(self, reference):
+        self._writes.append(reference.delete)
+
+    # 與 Firestore 相同：任一寫入失敗時整批不套用
+    def commit(self, **kwargs):
+        with self._client._lock:
+            snapshot = copy.deepcopy(self._client._data)
+            try:
+                for write in self._writes:
+                    write()
+            except Exception:
+                self._client._data = snapshot
+                raise
+            finally:
+                self._writes = []
+        return []
+
+
+# 交易：只提供公開的讀寫方法，由本模組的 transactional 執行，不依賴 google 程式庫的內部介面
+class Transaction(WriteBatch):
+    def get(self, reference_or_query, **kwargs):
+        if isinstance(reference_or_query, DocumentReference):
+            return iter([reference_or_query.get()])
+        return reference_or_query.stream()
+
+    def rollback(self):
+        self._writes = []
+
+
+# 對應 google.cloud.firestore.transactional：執行期間持有用戶端的鎖，交易內的讀寫不會被其他執行緒穿插，
+# 因此不需重試；函式正常結束時提交，發生例外時捨棄所有寫入
+def transactional(to_wrap):
+    @functools.wraps(to_wrap)
+    def wrapper(transaction, *args, **kwargs):
+        with transaction._client._lock:
+            try:
+                result = to_wrap(transaction, *args, **kwargs)
+            except BaseException:
+                transaction.rollback()
+                raise
+            transaction.commit()
+        return result
+    return wrapper
+
+
+class Client:
+    def __init__(self, project="test-project"):
+        self.project = project
+        self._data = {}
+        self._lock = threading.RLock()
+
+    def _collection_data(self, name):
+        return self._data.setdefault(name, {})
+
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def collection_group(self, collection_id):
+        return CollectionGroup(self, collection_id)
+
+    def document(self, path):
+        collection, id = path.split("/", 1)
+        return DocumentReference(self, collection, id)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return Transaction(self)
+
+    def get_all(self, references, field_paths=None, transaction=None, **kwargs):
+        for reference in references:
+            yield reference.get(field_paths)
+
+    # 清空所有資料（每個測試前呼叫）
+    def reset(self):
+        with self._lock:
+            self._data.clear()
+
+
+# 非同步介面：包裝同步替身，所有操作立即完成，不會讓出事件迴圈
+class AsyncDocumentReference:
+    def __init__(self, reference):
+        self._reference = reference
+        self.id = reference.id
+
+    @property
+    def path(self):
+        return self._reference.path
+
+    async def get(self, field_paths=None, transaction=None, **kwargs):
+        return self._reference.get(field_paths)
+
+    async def set(self, document_data, merge=False):
+        self._reference.set(document_data, merge=merge)
+
+    async def create(self, document_data):
+        self._reference.create(document_data)
+
+    async def update(self, field_updates):
+        self._reference.update(field_updates)
+
+    async def delete(self):
+        self._reference.delete()
+
+
+class AsyncCountQuery:
+    def __init__(self, query):
+        self._query = query
+
+    async def get(self, transaction=None, **kwargs):
+        return self._query.get()
+
+
+class AsyncQuery:
+    def __init__(self, query):
+        self._query = query
+
+    def where(self, *args, **kwargs):
+        return AsyncQuery(self._query.where(*args, **kwargs))
+
+    def order_by(self, *args, **kwargs):
+        return AsyncQuery(self._query.order_by(*args, **kwargs))
+
+    def start_after(self, document_fields):
+        return AsyncQuery(self._query.start_after(document_fields))
+
+    def limit(self, count):
+        return AsyncQuery(self._query.limit(count))
+
+    def select(self, field_paths):
+        return AsyncQuery(self._query.select(field_paths))
+
+    def count(self, alias=None):
+        return AsyncCountQuery(self._query.count(alias))
+
+    async def stream(self, transaction=None, **kwargs):
+        for snapshot in self._query.stream():
+            yield snapshot
+
+    async def get(self, transaction=None, **kwargs):
+        return self._query.get()
+
+
+class AsyncCollectionReference(AsyncQuery):
+    @property
+    def id(self):
+        return self._query.id
+
+    def document(self, document_id=None):
+        return AsyncDocumentReference(self._query.document(document_id))
+
+
+# 非同步交易：寫入與同步版本相同先暫存，參照換回同步的文件參照
+class AsyncTransaction(Transaction):
+    def set(self, reference, document_data, merge=False):
+        super().set(reference._reference, document_data, merge=merge)
+
+    def create(self, reference, document_data):
+        super().create(reference._reference, document_data)
+
+    def update(self, reference, field_updates):
+        super().update(reference._reference, field_updates)
+
+    def delete(self, reference):
+        super().delete(reference._reference)
+
+
+# 對應 google.cloud.firestore.async_transactional；替身的非同步操作不會讓出事件迴圈，
+# 與 transactional 相同，執行期間持有用戶端的鎖即可確保交易不被穿插
+def async_transactional(to_wrap):
+    @functools.wraps(to_wrap)
+    async def wrapper(transaction, *args, **kwargs):
+        with transaction._client._lock:
+            try:
+                result = await to_wrap(transaction, *args, **kwargs)
+            except BaseException:
+                transaction.rollback()
+                raise
+            transaction.commit()
+        return result
+    return wrapper
+
+
+class AsyncClient:
+    def __init__(self, client):
+        self._client = client
+        self.project = client.project
+
+    def collection(self, name):
+        return AsyncCollectionReference(self._client.collection(name))
+
+    def document(self, path):
+        return AsyncDocumentReference(self._client.document(path))
+
+    def transaction(self, **kwargs):
+        return AsyncTransaction(self._client)
+
+    async def get_all(self, references, field_paths=None, transaction=None, **kwargs):
+        for reference in references:
+            yield await reference.get(field_paths)
@@ -0,0 +1,254 @@
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+
+# 延遲直方圖的區間上限（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 目前請求各階段耗時，供 Server-Timing 標頭使用；不在請求中時為 None
+_request_stages = ContextVar("request_stages", default=None)
+
+
+# 停用時使用的計時器，不做任何事
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record_stage(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+# 請求與階段計時、讀寫計數，並以 Prometheus 文字格式輸出
+# enabled 控制直方圖與計數器，server_timing 控制每個請求的 Server-Timing 標頭；
+# 兩者皆停用時計時器為共用的空物件，幾乎沒有額外成本
+class Metrics:
+    def __init__(self, enabled=False, server_timing=False, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.server_timing = server_timing
+        self.active = enabled or server_timing
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def timer(self, stage):
+        if not self.active:
+            return NULL_TIMER
+        return _Timer(self, stage)
+
+    # 包裝函式，每次呼叫時記錄為指定階段
+    def wrap(self, stage, func):
+        if not self.active:
+            return func
+
+        def timed(*args, **kwargs):
+            with _Timer(self, stage):
+                return func(*args, **kwargs)
+        timed.__name__ = getattr(func, "__name__", stage)
+        return timed
+
+    def observe(self, name, labels, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def count(self, name, labels=(), n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + n
+
+    def record_stage(self, stage, seconds):
+        self.observe("toeic_stage_duration_seconds", (("stage", stage),), seconds)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages.append((stage, seconds))
+
+    # 請求開始：建立本次請求的階段紀錄
+    def begin_request(self):
+        if not self.active:
+            return None
+        return _request_stages.set([])
+
+    # 請求結束：記錄路由延遲並回傳 Server-Timing 標頭內容（未啟用時為 None）
+    def end_request(self, token, route, method, status, seconds):
+        if token is None:
+            return None
+        stages = _request_stages.get()
+        _request_stages.reset(token)
+        self.observe("toeic_request_duration_seconds", (("route", route), ("method", method)), seconds)
+        self.count("toeic_requests_total", (("route", route), ("method", method), ("status", str(status))))
+        if not self.server_timing:
+            return None
+        totals = {}
+        for stage, duration in stages or ():
+            totals[stage] = totals.get(stage, 0.0) + duration
+        totals["total"] = seconds
+        return ", ".join(f"{stage};dur={duration * 1000:.2f}" for stage, duration in totals.items())
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    # 輸出 Prometheus 文字格式；gauges 為 {名稱前綴: {欄位: 數值}}，例如快取統計
+    def render(self, gauges=None):
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+        for prefix, values in sorted((gauges or {}).items()):
+            for field, value in sorted(values.items()):
+                lines.append(f"# TYPE {prefix}_{field} gauge")
+                lines.append(f"{prefix}_{field} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# 讀取方法：由回傳值計算讀取的文件數
+# search / sample 回傳的是篩選後的結果，實際讀取數依實作而定（Firestore 會讀取整份清單），因此不計入
+STORE_READS = {
+    "load": len,
+    "load_page": lambda result: len(result[0]),
+    "load_due": len,
+    "stats": lambda result: 1,
+    "version": lambda result: 1
+}
+
+# 寫入方法；批次方法的寫入數為單字清單長度
+STORE_WRITES = {"add", "delete", "set_unfamiliar", "record_review"}
+STORE_BATCH_WRITES = {"add_many", "delete_many", "set_unfamiliar_many"}
+
+
+# 為單字儲存的每個方法計時，並統計讀取的文件數與發出的寫入數
+class InstrumentedWordStore:
+    def __init__(self, store, metrics):
+        self._store = store
+        self._metrics = metrics
+
+    @property
+    def wrapped(self):
+        return self._store
+
+    def __getattr__(self, name):
+        attribute = getattr(self._store, name)
+        if not callable(attribute):
+            return attribute
+        metrics = self._metrics
+        stage = f"store_{name}"
+        reads = STORE_READS.get(name)
+
+        def timed(*args, **kwargs):
+            with _Timer(metrics, stage):
+                result = attribute(*args, **kwargs)
+            if reads is not None:
+                metrics.count("toeic_store_documents_read_total", (("method", name),), reads(result))
+            elif name in STORE_BATCH_WRITES:
+                metrics.count("toeic_store_writes_total", (("method", name),), len(args[1]))
+            elif name in STORE_WRITES:
+                metrics.count("toeic_store_writes_total", (("method", name),))
+            return result
+        return timed
+
+    def iter_words(self, uid, is_unfamiliar=None):
+        return self._iterate("iter_words", self._store.iter_words(uid, is_unfamiliar))
+
+    def export(self, uid):
+        return self._iterate("export", self._store.export(uid))
+
+    # 逐筆讀取：累計每次取得下一筆的時間與筆數
+    def _iterate(self, name, words):
+        metrics = self._metrics
+        words = iter(words)
+        elapsed = 0.0
+        count = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    record = next(words)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - start
+                count += 1
+                yield record
+        finally:
+            metrics.record_stage(f"store_{name}", elapsed)
+            metrics.count("toeic_store_documents_read_total", (("method", name),), count)
+
+
+def create_metrics(enabled=False, server_timing=False):
+    metrics = Metrics(enabled=enabled, server_timing=server_timing)
+    metrics.describe("toeic_request_duration_seconds", "Request latency by route")
+    metrics.describe("toeic_stage_duration_seconds", "Time spent per request stage")
+    metrics.describe("toeic_requests_total", "Requests by route and status")
+    metrics.describe("toeic_store_documents_read_total", "Documents read from the word store")
+    metrics.describe("toeic_store_writes_total", "Writes issued to the word store")
+    return metrics
@@ -0,0 +1,63 @@
+import argparse
+from app import db, logger
+from word_store import FIRESTORE_BATCH_LIMIT
+from words import word_doc_id
+
+
+# 將自動 ID 的單字文件搬移到以 (使用者, 正規化單字) 產生的固定 ID
+# 重複的單字合併為一份，任一份標記不熟則保留不熟標記
+def migrate(dry_run=False):
+    collection = db.collection("toeic_words")
+    docs = list(collection.stream())
+    existing = {doc.id: doc.to_dict() for doc in docs}
+    batch = db.batch()
+    pending = 0
+    moved = merged = skipped = 0
+
+    def commit():
+        nonlocal batch, pending
+        if pending and not dry_run:
+            batch.commit()
+        batch = db.batch()
+        pending = 0
+
+    for doc in docs:
+        data = existing.get(doc.id)
+        if data is None:
+            continue
+        uid = data.get("user_id")
+        word = data.get("word")
+        if not uid or word is None:
+            logger.warning(f"略過格式錯誤的文件: {doc.id}")
+            skipped += 1
+            continue
+        target_id = word_doc_id(uid, word)
+        if doc.id == target_id:
+            continue
+        target = existing.get(target_id)
+        if target is None:
+            existing[target_id] = data
+            batch.set(collection.document(target_id), data)
+            moved += 1
+        else:
+            if data.get("is_unfamiliar", False) and not target.get("is_unfamiliar", False):
+                target["is_unfamiliar"] = True
+                batch.set(collection.document(target_id), target)
+                pending += 1
+            merged += 1
+        batch.delete(doc.reference)
+        del existing[doc.id]
+        pending += 2
+        # 每筆最多 3 個寫入，預留空間避免超過批次上限
+        if pending >= FIRESTORE_BATCH_LIMIT - 3:
+            commit()
+    commit()
+    logger.info(f"單字文件 ID 遷移完成 (dry_run={dry_run})：搬移 {moved} 筆，合併重複 {merged} 筆，略過 {skipped} 筆")
+    return {"moved": moved, "merged": merged, "skipped": skipped}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="將 toeic_words 文件遷移為固定文件 ID")
+    parser.add_argument("--dry-run", action="store_true", help="只統計，不寫入 Firestore")
+    args = parser.parse_args()
+    migrate(dry_run=args.dry_run)
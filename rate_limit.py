@@ -0,0 +1,202 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# 各路由每次請求消耗的權杖數；需要讀取使用者所有單字的路由成本較高，其餘為 DEFAULT_COST
+DEFAULT_COST = 1
+DEFAULT_ROUTE_COSTS = {
+    "/load_all_words": 5,
+    "/review_words": 5,
+    "/search_word": 5,
+    "/random_words": 5,
+    "/export": 20,
+    "/save_words": 5,
+    "/delete_words": 5,
+    "/mark_unfamiliar_words": 5,
+    "/unmark_unfamiliar_words": 5
+}
+
+
+# 單字清單路由支援 ETag：請求時只收 DEFAULT_COST（304 的成本），確定要回傳內容時再補收讀取的成本
+CONDITIONAL_ROUTES = {"/load_all_words", "/review_words"}
+# 分頁請求依 limit 按比例計算：一頁 LIST_COST_WORDS 個單字等於路由成本，整份清單的前端分頁載入不會用完 burst
+LIST_COST_WORDS = 1000
+
+
+# 解析 "路由=成本,路由=成本" 格式的設定，覆寫預設成本
+def parse_route_costs(text, defaults=DEFAULT_ROUTE_COSTS):
+    costs = dict(defaults)
+    for item in (text or "").split(","):
+        if "=" in item:
+            route, cost = item.split("=", 1)
+            costs[route.strip()] = float(cost)
+    return costs
+
+
+# 程序內的權杖桶，依最近使用順序保留最多 maxsize 個使用者
+class MemoryBackend:
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    # 取用 cost 個權杖；足夠時回傳 0，否則不扣除並回傳需要等待的秒數
+    def take(self, key, cost, rate, capacity):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# 多個 worker / 主機共用的權杖桶，以 Lua 腳本在 Redis 中原子地計算
+# 時間取自 Redis 伺服器，各主機的時鐘誤差不影響結果；Redis 無法連線時放行請求
+class RedisBackend:
+    SCRIPT = """
+        local rate = tonumber(ARGV[1])
+        local capacity = tonumber(ARGV[2])
+        local cost = tonumber(ARGV[3])
+        local clock = redis.call('TIME')
+        local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(bucket[1]) or capacity
+        local updated = tonumber(bucket[2]) or now
+        tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+        local wait = 0
+        if tokens >= cost then
+            tokens = tokens - cost
+        else
+            wait = (cost - tokens) / rate
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+        redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+        return tostring(wait)
+    """
+
+    def __init__(self, client, prefix="toeic:rate:", logger=None):
+        self.client = client
+        self.prefix = prefix
+        self.logger = logger
+        self.errors = 0
+        self._script = client.register_script(self.SCRIPT)
+
+    def take(self, key, cost, rate, capacity):
+        try:
+            return float(self._script(keys=[self.prefix + key], args=[rate, capacity, cost]))
+        except Exception as e:
+            self.errors += 1
+            if self.logger is not None:
+                self.logger.warning(f"Redis 流量限制無法使用，暫時放行請求: {e}")
+            return 0.0
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+
+# 以使用者為單位的權杖桶流量限制：每秒補充 rate 個權杖，最多累積 burst 個
+# rate 為 0 時停用
+class RateLimiter:
+    def __init__(self, backend, rate=0, burst=60, costs=None, default_cost=DEFAULT_COST):
+        self.backend = backend
+        self.rate = rate
+        self.burst = burst
+        self.costs = DEFAULT_ROUTE_COSTS if costs is None else costs
+        self.default_cost = default_cost
+        self.limited = 0
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    # 路由成本；limit 為分頁大小（None 表示整份清單）。成本超過 burst 時以 burst 計算，避免永遠無法通過
+    def route_cost(self, route, limit=None):
+        cost = self.costs.get(route, self.default_cost)
+        if limit is not None:
+            cost = cost * limit / LIST_COST_WORDS
+        return min(cost, self.burst)
+
+    # 回傳需要等待的秒數，0 表示放行；單字清單路由只收基本成本，其餘由 charge 補收
+    # count 為 False 時不計入被限制的請求數（用於不會拒絕請求的額度，例如 ASGI 的預先載入）
+    def check(self, uid, route, count=True):
+        if not self.enabled:
+            return 0.0
+        if route in CONDITIONAL_ROUTES:
+            return self._take(uid, min(self.default_cost, self.burst), count)
+        return self._take(uid, self.route_cost(route), count)
+
+    # 單字清單不是 304 時，補收扣除基本成本後的讀取成本
+    def charge(self, uid, route, limit=None):
+        if not self.enabled:
+            return 0.0
+        cost = self.route_cost(route, limit) - min(self.default_cost, self.burst)
+        return self._take(uid, cost) if cost > 0 else 0.0
+
+    def _take(self, uid, cost, count=True):
+        wait = self.backend.take(uid, cost, self.rate, self.burst)
+        if wait > 0 and count:
+            self.limited += 1
+        return wait
+
+    # Retry-After 標頭的秒數（至少 1 秒）
+    @staticmethod
+    def retry_after(wait):
+        return str(max(1, math.ceil(wait)))
+
+
+# 全域並行請求上限：超過時立即拒絕，在 worker 的執行緒全部被佔用前卸載流量
+# max_concurrent 為 0 時停用
+class ConcurrencyLimiter:
+    def __init__(self, max_concurrent=0):
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_concurrent > 0
+
+    def acquire(self):
+        with self._lock:
+            if self.in_flight >= self.max_concurrent:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": self.in_flight, "max": self.max_concurrent, "rejected": self.rejected}
+
+
+# 依環境變數建立流量限制：設定 RATE_LIMIT_REDIS_URL 時使用 Redis（需安裝 redis 套件），否則使用程序內的權杖桶
+def create_rate_limiter(logger=None):
+    redis_url = os.getenv("RATE_LIMIT_REDIS_URL")
+    if redis_url:
+        import redis
+        backend = RedisBackend(redis.Redis.from_url(redis_url), logger=logger)
+    else:
+        backend = MemoryBackend(maxsize=int(os.getenv("RATE_LIMIT_MAX_USERS", "100000")))
+    return RateLimiter(backend,
+                       rate=float(os.getenv("RATE_LIMIT_PER_SECOND", "0")),
+                       burst=float(os.getenv("RATE_LIMIT_BURST", "60")),
+                       costs=parse_route_costs(os.getenv("RATE_LIMIT_COSTS")))
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta, timezone
+
+# SM-2 間隔重複排程
+# 每個單字記錄間隔天數 (interval)、難易度係數 (ease)、連續答對次數 (repetitions) 與下次複習時間 (due)
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+
+# 答題品質 0–5，低於 PASSING_QUALITY 視為忘記，重新從 1 天開始並標記為不熟
+MIN_QUALITY = 0
+MAX_QUALITY = 5
+PASSING_QUALITY = 3
+
+# 單字文件中的排程欄位
+SCHEDULE_FIELDS = ["interval", "ease", "repetitions", "due"]
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+class Schedule:
+    __slots__ = ("interval", "ease", "repetitions", "due")
+
+    def __init__(self, interval=0, ease=DEFAULT_EASE, repetitions=0, due=None):
+        self.interval = interval
+        self.ease = ease
+        self.repetitions = repetitions
+        self.due = due
+
+    # 新單字立即到期
+    @classmethod
+    def new(cls, now):
+        return cls(due=now)
+
+    # 缺少或為 None 的欄位（加入排程前的舊單字）使用新單字的預設值
+    @classmethod
+    def from_dict(cls, data):
+        def value(field, default):
+            return default if data.get(field) is None else data[field]
+        return cls(value("interval", 0), value("ease", DEFAULT_EASE), value("repetitions", 0), data.get("due"))
+
+    # 寫入資料庫的欄位
+    def to_fields(self):
+        return {"interval": self.interval, "ease": self.ease, "repetitions": self.repetitions, "due": self.due}
+
+    # 回應用的欄位，due 轉為 ISO 8601 字串
+    def to_dict(self):
+        fields = self.to_fields()
+        fields["due"] = self.due.isoformat() if self.due is not None else None
+        return fields
+
+    # 依答題品質計算下一次的排程
+    def review(self, quality, now):
+        if quality >= PASSING_QUALITY:
+            if self.repetitions == 0:
+                interval = 1
+            elif self.repetitions == 1:
+                interval = 6
+            else:
+                interval = max(round(self.interval * self.ease), self.interval + 1)
+            repetitions = self.repetitions + 1
+        else:
+            interval = 1
+            repetitions = 0
+        miss = MAX_QUALITY - quality
+        ease = max(MIN_EASE, self.ease + 0.1 - miss * (0.08 + miss * 0.02))
+        return Schedule(interval, round(ease, 4), repetitions, now + timedelta(days=interval))
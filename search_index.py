@@ -0,0 +1,134 @@
+import bisect
+import heapq
+import threading
+from collections import Counter, defaultdict
+
+from words import normalize_word
+
+
+# 取得字串的 n-gram 集合
+def ngrams(text, n):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+# 計算編輯距離（相鄰字母對調視為一次編輯），超過 max_distance 時提早結束並回傳 max_distance + 1
+def edit_distance(a, b, max_distance):
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            cost = min(previous[j] + 1,
+                       current[j - 1] + 1,
+                       previous[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > max_distance:
+            return max_distance + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+# 單字搜尋索引
+# 以排序陣列支援前綴搜尋，以 2-gram/3-gram 倒排索引支援子字串與模糊搜尋
+class SearchIndex:
+    GRAM_SIZES = (2, 3)
+
+    def __init__(self, words=()):
+        self._keys = []
+        self._words = {}
+        self._grams = defaultdict(set)
+        self._lock = threading.Lock()
+        for word in words:
+            self._words[normalize_word(word)] = word
+        self._keys = sorted(self._words)
+        for key in self._keys:
+            self._index(key)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _index(self, key):
+        for n in self.GRAM_SIZES:
+            for gram in ngrams(key, n):
+                self._grams[gram].add(key)
+
+    def _unindex(self, key):
+        for n in self.GRAM_SIZES:
+            for gram in ngrams(key, n):
+                postings = self._grams.get(gram)
+                if postings is not None:
+                    postings.discard(key)
+                    if not postings:
+                        del self._grams[gram]
+
+    def add(self, word):
+        key = normalize_word(word)
+        with self._lock:
+            if key not in self._words:
+                bisect.insort(self._keys, key)
+                self._index(key)
+            self._words[key] = word
+
+    def remove(self, word):
+        key = normalize_word(word)
+        with self._lock:
+            if self._words.pop(key, None) is None:
+                return
+            position = bisect.bisect_left(self._keys, key)
+            del self._keys[position]
+            self._unindex(key)
+
+    # 前綴搜尋：在排序陣列中以二分搜尋找出範圍
+    def _prefix(self, keyword):
+        start = bisect.bisect_left(self._keys, keyword)
+        end = bisect.bisect_left(self._keys, keyword + "\U0010ffff", lo=start)
+        return self._keys[start:end]
+
+    # 子字串搜尋：取關鍵字各 n-gram 倒排清單的交集再逐一確認
+    def _substring(self, keyword):
+        if len(keyword) < min(self.GRAM_SIZES):
+            return [key for key in self._keys if keyword in key]
+        n = min(len(keyword), max(self.GRAM_SIZES))
+        postings = sorted((self._grams.get(gram, set()) for gram in ngrams(keyword, n)), key=len)
+        if not postings or not postings[0]:
+            return []
+        candidates = postings[0].intersection(*postings[1:])
+        return [key for key in candidates if keyword in key]
+
+    # 模糊搜尋：以共同 2-gram 數量過濾候選字，再計算編輯距離
+    def _fuzzy(self, keyword, max_distance):
+        counts = Counter()
+        for gram in ngrams(keyword, 2):
+            counts.update(self._grams.get(gram, ()))
+        matches = []
+        for key, shared in counts.items():
+            # q-gram 下界：每次編輯最多破壞 3 個 2-gram
+            if shared < max(len(keyword), len(key)) - 1 - 3 * max_distance:
+                continue
+            distance = edit_distance(keyword, key, max_distance)
+            if distance <= max_distance:
+                matches.append((distance, key))
+        return matches
+
+    # 依完全相符、前綴、子字串、模糊相符排序後回傳前 limit 個單字
+    def search(self, keyword, limit=50, fuzzy=False):
+        keyword = normalize_word(keyword)
+        if not keyword:
+            return []
+        with self._lock:
+            ranked = {}
+            for key in self._prefix(keyword):
+                ranked[key] = (0 if key == keyword else 1, len(key), key)
+            if len(ranked) < limit:
+                for key in self._substring(keyword):
+                    ranked.setdefault(key, (2, len(key), key))
+            if fuzzy and len(ranked) < limit:
+                max_distance = 1 if len(keyword) <= 4 else 2
+                for distance, key in self._fuzzy(keyword, max_distance):
+                    ranked.setdefault(key, (2 + distance, len(key), key))
+            best = heapq.nsmallest(limit, ranked.values())
+            return [self._words[key] for _, _, key in best]
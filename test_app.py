@@ -2,11 +2,11 @@ import allure
 import pytest
 import logging
 import json
-from app import app
+import os
+import time
+from app import app, token_cache, word_cache, verify_user
 import firebase_admin
 from firebase_admin import auth
-from google.api_core.exceptions import GoogleAPICallError
-from google.cloud.firestore import FieldFilter
 
 # 設定日誌
 logger = logging.getLogger(__name__)
@@ -24,47 +24,11 @@ def mock_token(monkeypatch):
     def mock_verify_id_token(*args, **kwargs):
         return {'uid': 'test_user_id'}
     monkeypatch.setattr(auth, 'verify_id_token', mock_verify_id_token)
-    return "test_token"
+    token_cache.clear()
+    yield "test_token"
+    token_cache.clear()
 
 class TestApp:
-    def setup_method(self):
-        with app.app_context():
-            from app import db
-            def delete_test_word(word):
-                try:
-                    query = (db.collection("toeic_words")
-                             .where(filter=FieldFilter("user_id", "==", 'test_user_id'))
-                             .where(filter=FieldFilter("word", "==", word))
-                             .limit(1))
-                    results = query.get()
-                    for doc in results:
-                        doc.reference.delete()
-                    return True
-                except GoogleAPICallError as e:
-                    logger.error(f"測試前清理：刪除單字 '{word}' 失敗: {e}")
-                    return False
-            for word in ['exam', 'good', 'bad', 'cool', 'test']:
-                delete_test_word(word)
-
-    def teardown_method(self):
-        with app.app_context():
-            from app import db
-            def delete_test_word(word):
-                try:
-                    query = (db.collection("toeic_words")
-                             .where(filter=FieldFilter("user_id", "==", 'test_user_id'))
-                             .where(filter=FieldFilter("word", "==", word))
-                             .limit(1))
-                    results = query.get()
-                    for doc in results:
-                        doc.reference.delete()
-                    return True
-                except GoogleAPICallError as e:
-                    logger.error(f"測試後清理：刪除單字 '{word}' 失敗: {e}")
-                    return False
-            for word in ['exam', 'good', 'bad', 'cool', 'test']:
-                delete_test_word(word)
-
     @allure.feature('首頁功能')
     def test_index(self, client):
         allure.step("測試首頁路由")
@@ -175,3 +139,936 @@ class TestApp:
         assert response.status_code == 201
         data = json.loads(response.data)
         assert data['success'] == True
+
+    @allure.feature('使用者身份驗證')
+    def test_token_cache(self, monkeypatch):
+        allure.step("測試身份驗證快取")
+        logger.info("測試身份驗證快取")
+        calls = []
+        def mock_verify_id_token(token, **kwargs):
+            calls.append(token)
+            if token == 'bad_token':
+                raise auth.InvalidIdTokenError('無效的 token')
+            if token == 'expired_token':
+                return {'uid': 'test_user_id', 'exp': time.time() - 60}
+            return {'uid': 'test_user_id', 'exp': time.time() + 3600}
+        monkeypatch.setattr(auth, 'verify_id_token', mock_verify_id_token)
+        token_cache.clear()
+        assert verify_user('good_token') == 'test_user_id'
+        assert verify_user('good_token') == 'test_user_id'
+        assert verify_user('bad_token') is None
+        assert verify_user('bad_token') is None
+        # 超過 exp 與時鐘誤差的 token 不應被快取
+        verify_user('expired_token')
+        verify_user('expired_token')
+        assert calls == ['good_token', 'bad_token', 'expired_token', 'expired_token']
+        stats = token_cache.stats()
+        assert stats['hits'] == 1
+        assert stats['negative_hits'] == 1
+        token_cache.clear()
+
+    @allure.feature('單字快取')
+    def test_word_cache(self, client, mock_token, monkeypatch):
+        allure.step("測試單字快取")
+        logger.info("測試單字快取")
+        headers = {'Authorization': f'Bearer {mock_token}'}
+        response = client.post('/save_word',
+                            data={'word': 'test'},
+                            headers=headers)
+        assert response.status_code == 201
+        from app import load_words
+        words = load_words('test_user_id')
+        assert any(w['word'] == 'test' for w in words)
+        # 快取命中後不應再讀取 Firestore
+        import app as app_module
+        with monkeypatch.context() as m:
+            m.setattr(app_module, 'word_store', None)
+            words = load_words('test_user_id')
+            assert any(w['word'] == 'test' for w in words)
+            assert word_cache.stats()['hits'] >= 1
+        client.post('/mark_unfamiliar',
+                    data={'word': 'test'},
+                    headers=headers)
+        assert any(w['word'] == 'test' for w in load_words('test_user_id', True))
+        # 依版本的分頁請求整份載入並快取；本程序之後的寫入接續快取的版本，不需重新讀取儲存
+        client.get('/load_all_words?limit=200', headers=headers)
+        client.post('/save_word', data={'word': 'exam'}, headers=headers)
+        with monkeypatch.context() as m:
+            m.setattr(app_module.word_store, 'load', None)
+            m.setattr(app_module.word_store, 'load_page', None)
+            response = client.get('/load_all_words?limit=200', headers=headers)
+            assert [w['word'] for w in json.loads(response.data)['words']] == ['exam', 'test']
+        # 其他執行個體直接寫入儲存後，搜尋與隨機單字依版本重新載入
+        app_module.word_store.add('test_user_id', 'cool')
+        response = client.post('/search_word', data={'keyword': 'cool'}, headers=headers)
+        assert json.loads(response.data)['words'] == ['cool']
+        response = client.post('/random_words', data={'n': 10}, headers=headers)
+        assert sorted(w['word'] for w in json.loads(response.data)['words']) == ['cool', 'exam']
+        client.post('/delete_word',
+                    data={'word': 'test'},
+                    headers=headers)
+        assert not any(w['word'] == 'test' for w in load_words('test_user_id'))
+        word_cache.invalidate('test_user_id')
+        assert word_cache.stats()['users'] == 0
+
+    @allure.feature('單字快取')
+    def test_word_cache_versions(self):
+        allure.step("測試兩個程序的單字快取交錯寫入同一個儲存時不會以新版本回傳過期內容")
+        logger.info("測試兩個程序的單字快取交錯寫入同一個儲存時不會以新版本回傳過期內容")
+        from cache import WordCache
+        from word_store import SQLiteWordStore, UPDATED
+        store = SQLiteWordStore(':memory:')
+        store.add_many('test_user_id', ['exam', 'good'])
+        # 與 word_list_response 相同：先讀版本，快取版本不同時以該版本重新載入
+        def read(cache):
+            version = store.version('test_user_id')
+            entry = cache.get_version('test_user_id', version)
+            if entry is None:
+                entry = cache.put('test_user_id', store.load('test_user_id'), version)
+            return version, sorted(w['word'] for w in entry.filter())
+        worker_a, worker_b = WordCache(), WordCache()
+        assert read(worker_a) == read(worker_b)
+        # 兩個 worker 各自寫入並以寫入回報的版本更新自己的快取：a 的寫入接續快取的版本，
+        # b 寫入前 a 已寫入過，b 的快取缺少 a 的變更而移除
+        versions = []
+        worker_a.add_words('test_user_id', [store.add('test_user_id', 'cool', versions)], versions)
+        assert worker_a.get('test_user_id').version == versions[-1][1]
+        versions = []
+        assert store.delete('test_user_id', 'good', versions)
+        worker_b.remove_words('test_user_id', ['good'], versions)
+        assert worker_b.get('test_user_id') is None
+        expected = (store.version('test_user_id'), ['cool', 'exam'])
+        assert read(worker_a) == expected
+        assert read(worker_b) == expected
+        # 只有本程序寫入時沿用快取，不需重新載入
+        entry = worker_a.get('test_user_id')
+        versions = []
+        assert store.set_unfamiliar('test_user_id', 'exam', True, versions) == UPDATED
+        worker_a.set_unfamiliar('test_user_id', ['exam'], True, versions)
+        assert worker_a.get_version('test_user_id', store.version('test_user_id')) is entry
+        assert [w['word'] for w in entry.filter(True)] == ['exam']
+        # 寫入不接續快取的版本時移除
+        assert worker_b.get_version('test_user_id', expected[0]) is not None
+        worker_b.advance('test_user_id', [(expected[0] + 1, expected[0] + 2)])
+        assert worker_b.get('test_user_id') is None
+
+    @allure.feature('單字儲存')
+    def test_save_word_deterministic_id(self, client, mock_token):
+        allure.step("測試以固定文件 ID 儲存單字")
+        logger.info("測試以固定文件 ID 儲存單字")
+        headers = {'Authorization': f'Bearer {mock_token}'}
+        response = client.post('/save_word',
+                            data={'word': 'test'},
+                            headers=headers)
+        assert response.status_code == 201
+        from app import db
+        from words import word_doc_id
+        doc = db.collection("toeic_words").document(word_doc_id('test_user_id', 'test')).get()
+        assert doc.exists
+        # 未快取時由 Firestore 拒絕大小寫不同的重複單字
+        word_cache.clear()
+        response = client.post('/save_word',
+                            data={'word': ' TEST'},
+                            headers=headers)
+        assert response.status_code == 409
+
+    @allure.feature('批次匯入')
+    def test_save_words(self, client, mock_token, monkeypatch):
+        allure.step("測試批次匯入單字")
+        logger.info("測試批次匯入單字")
+        import app as app_module
+        headers = {'Authorization': f'Bearer {mock_token}'}
+        client.post('/save_word',
+                    data={'word': 'exam'},
+                    headers=headers)
+        # 匯入不需載入整份單字清單
+        with monkeypatch.context() as m:
+            m.setattr(app_module.word_store, 'load', None)
+            response = client.post('/save_words',
+                                json=['good', 'bad', 'Good', 'exam', ''],
+                                headers=headers)
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['success'] == True
+        assert data['created'] == 2
+        assert [r['status'] for r in data['results']] == ['created', 'created', 'duplicate', 'duplicate', 'invalid']
+        from app import load_words
+        words = [w['word'] for w in load_words('test_user_id')]
+        assert 'good' in words and 'bad' in words
+        # 以換行分隔的表單欄位匯入
+        response = client.post('/save_words',
+                            data={'words': 'cool\ntest\n\ncool'},
+                            headers=headers)
+        data = json.loads(response.data)
+        assert data['created'] == 2
+
+    @allure.feature('批次操作')
+    def test_batch_mark_and_delete(self, client, mock_token):
+        allure.step("測試批次標記與刪除單字")
+        logger.info("測試批次標記與刪除單字")
+        headers = {'Authorization': f'Bearer {mock_token}'}
+        client.post('/save_words',
+                    json=['good', 'bad', 'cool'],
+                    headers=headers)
+        client.post('/mark_unfamiliar',
+                    data={'word': 'cool'},
+                    headers=headers)
+        response = client.post('/mark_unfamiliar_words',
+                            json=['good', 'cool', 'missing'],
+                            headers=headers)
+        data = json.loads(response.data)
+        assert data['success'] == True
+        assert data['updated'] == ['good']
+        assert data['already'] == ['cool']
+        assert data['not_found'] == ['missing']
+        from app import load_words
+        unfamiliar = sorted(w['word'] for w in load_words('test_user_id', True))
+        assert unfamiliar == ['cool', 'good']
+        response = client.post('/unmark_unfamiliar_words',
+                            json=['good', 'bad'],
+                            headers=headers)
+        data = json.loads(response.data)
+        assert data['updated'] == ['good']
+        assert data['already'] == ['bad']
+        response = client.post('/delete_words',
+                            json=['good', 'bad', 'missing'],
+                            headers=headers)
+        data = json.loads(response.data)
+        assert data['deleted'] == ['good', 'bad']
+        assert data['not_found'] == ['missing']
+        assert [w['word'] for w in load_words('test_user_id')] == ['cool']
+
+    @allure.feature('單字搜尋')
+    def test_search_word_ranking(self, client, mock_token):
+        allure.step("測試搜尋排序與模糊搜尋")
+        logger.info("測試搜尋排序與模糊搜尋")
+        headers = {'Authorization': f'Bearer {mock_token}'}
+        client.post('/save_words',
+                    json=['test', 'exam', 'cool', 'good'],
+                    headers=headers)
+        response = client.post('/search_word',
+                            data={'keyword': 'oo'},
+                            headers=headers)
+        data = json.loads(response.data)
+        assert data['words'] == ['cool', 'good']
+        response = client.post('/search_word',
+                            data={'keyword': 'oo', 'limit': 1},
+                            headers=headers)
+        assert json.loads(response.data)['words'] == ['cool']
+        # 拼錯的單字需開啟模糊搜尋才找得到
+        response = client.post('/search_word',
+                            data={'keyword': 'exma'},
+                            headers=headers)
+        assert json.loads(response.data)['success'] == False
+        response = client.post('/search_word',
+                            data={'keyword': 'exma', 'fuzzy': 'true'},
+                            headers=headers)
+        assert 'exam' in json.loads(response.data)['words']
+        # 寫入後索引同步更新
+        client.post('/delete_word',
+                    data={'word': 'cool'},
+                    headers=headers)
+        response = client.post('/search_word',
+                            data={'keyword': 'oo'},
+                            headers=headers)
+        assert json.loads(response.data)['words'] == ['good']
+
+    @allure.feature('隨機單字')
+    def test_random_words(self, client, mock_token):
+        allure.step("測試隨機單字抽樣")
+        logger.info("測試隨機單字抽樣")
+        headers = {'Authorization': f'Bearer {mock_token}'}
+        client.post('/save_words',
+                    json=['exam', 'good', 'bad', 'cool', 'test'],
+                    headers=headers)
+        client.post('/mark_unfamiliar_words',
+                    json=['bad', 'cool'],
+                    headers=headers)
+        response = client.post('/random_words',
+                            data={'n': 3},
+                            headers=headers)
+        data = json.loads(response.data)
+        assert data['success'] == True
+        assert len(data['words']) == 3
+        assert all(not w['is_unfamiliar'] for w in data['words'])
+        response = client.post('/random_words',
+                            data={'is_unfamiliar': 'true'},
+                            headers=headers)
+        data = json.loads(response.data)
+        assert sorted(w['word'] for w in data['words']) == ['bad', 'cool']
+        # 取消標記後抽樣池同步更新
+        client.post('/unmark_unfamiliar',
+                    data={'word': 'bad'},
+                    headers=headers)
+        response = client.post('/random_words',
+                            data={'is_unfamiliar': 'true'},
+                            headers=headers)
+        assert [w['word'] for w in json.loads(response.data)['words']] == ['cool']
+
+    @allure.feature('單字列表')
+    def test_load_all_words_pagination(self, client, mock_token):
+        allure.step("測試單字列表分頁")
+        logger.info("測試單字列表分頁")
+        headers = {'Authorization': f'Bearer {mock_token}'}
+        client.post('/save_words',
+                    json=['test', 'exam', 'cool', 'good', 'bad'],
+                    headers=headers)
+        client.post('/mark_unfamiliar_words',
+                    json=['cool', 'test'],
+                    headers=headers)
+        # 未快取時使用 Firestore 查詢游標，已快取時從記憶體分頁，結果需一致
+        for cached in (False, True):
+            word_cache.clear()
+            if cached:
+                from app import load_words
+                load_words('test_user_id')
+            pages = []
+            cursor = None
+            while True:
+                data = {'limit': 2}
+                if cursor:
+                    data['start_after'] = cursor
+                response = client.post('/load_all_words', data=data, headers=headers)
+                body = json.loads(response.data)
+                assert body['success'] == True
+                pages.append([w['word'] for w in body['words']])
+                cursor = body['next_cursor']
+                if not cursor:
+                    break
+            assert [w for page in pages for w in page] == ['bad', 'cool', 'exam', 'good', 'test']
+            assert pages[0] == ['bad', 'cool']
+            response = client.post('/review_words',
+                                data={'is_unfamiliar': 'true', 'limit': 1, 'start_after': 'cool'},
+                                headers=headers)
+            assert [w['word'] for w in json.loads(response.data)['words']] == ['test']
+
+    @allure.feature('單字列表')
+    def test_load_all_words_stream(self, client, mock_token):
+        allure.step("測試串流輸出單字列表")
+        logger.info("測試串流輸出單字列表")
+        headers = {'Authorization': f'Bearer {mock_token}'}
+        client.post('/save_words',
+                    json=['exam', 'good'],
+                    headers=headers)
+        word_cache.clear()
+        response = client.post('/load_all_words',
+                            data={'stream': 'json'},
+                            headers=headers)
+        data = json.loads(response.data)
+        assert data['success'] == True
+        assert sorted(w['word'] for w in data['words']) == ['exam', 'good']
+        response = client.post('/load_all_words',
+                            data={'stream': 'ndjson'},
+                            headers=headers)
+        assert response.mimetype == 'application/x-ndjson'
+        lines = response.data.decode('utf-8').splitlines()
+        assert sorted(json.loads(line)['word'] for line in lines) == ['exam', 'good']
+
+    @allure.feature('單字儲存實作')
+    def test_sqlite_word_store(self, client, mock_token, monkeypatch):
+        allure.step("測試 SQLite 單字儲存實作")
+        logger.info("測試 SQLite 單字儲存實作")
+        import app as app_module
+        from word_store import SQLiteWordStore
+        monkeypatch.setattr(app_module, 'word_store', SQLiteWordStore(':memory:'))
+        headers = {'Authorization': f'Bearer {mock_token}'}
+        response = client.post('/save_word', data={'word': 'exam'}, headers=headers)
+        assert response.status_code == 201
+        app_module.word_store.delete('test_user_id', 'exam')
+        response = client.post('/save_words', json=['exam'], headers=headers)
+        assert json.loads(response.data)['created'] == 1
+        response = client.post('/save_word', data={'word': 'Exam'}, headers=headers)
+        assert response.status_code == 409
+        client.post('/save_words', json=['good', 'cool', 'bad'], headers=headers)
+        client.post('/mark_unfamiliar', data={'word': 'cool'}, headers=headers)
+        word_cache.clear()
+        response = client.post('/review_words',
+                            data={'is_unfamiliar': 'true', 'limit': 10},
+                            headers=headers)
+        assert [w['word'] for w in json.loads(response.data)['words']] == ['cool']
+        # 停用快取時搜尋與抽樣直接使用儲存實作
+        monkeypatch.setattr(word_cache, 'max_bytes', 0)
+        response = client.post('/search_word', data={'keyword': 'oo'}, headers=headers)
+        assert json.loads(response.data)['words'] == ['cool', 'good']
+        response = client.post('/random_words', data={'n': 10}, headers=headers)
+        assert sorted(w['word'] for w in json.loads(response.data)['words']) == ['bad', 'exam', 'good']
+        response = client.post('/delete_words', json=['good', 'missing'], headers=headers)
+        data = json.loads(response.data)
+        assert data['deleted'] == ['good']
+        assert data['not_found'] == ['missing']
+        # 刪除與標記以正規化單字比對，與新增時的重複判斷相同
+        response = client.post('/mark_unfamiliar', data={'word': 'BAD'}, headers=headers)
+        assert json.loads(response.data)['success'] is True
+        response = client.post('/delete_word', data={'word': 'Bad'}, headers=headers)
+        assert json.loads(response.data)['success'] is True
+        assert app_module.word_store.stats('test_user_id')['total'] == 2
+
+    @allure.feature('單字儲存實作')
+    def test_normalized_word_lookup(self, client, mock_token):
+        allure.step("測試刪除與標記以正規化單字尋找文件，且不依賴其他 worker 可能已過期的快取")
+        logger.info("測試刪除與標記以正規化單字尋找文件，且不依賴其他 worker 可能已過期的快取")
+        import app as app_module
+        headers = {'Authorization': f'Bearer {mock_token}'}
+        client.post('/save_words', json=['apple', 'exam'], headers=headers)
+        client.post('/review_words', headers=headers)
+        assert word_cache.get('test_user_id') is not None
+        response = client.post('/mark_unfamiliar', data={'word': 'APPLE'}, headers=headers)
+        assert json.loads(response.data)['success'] is True
+        response = client.post('/delete_word', data={'word': 'Apple'}, headers=headers)
+        assert json.loads(response.data)['success'] is True
+        response = client.post('/review_words', headers=headers)
+        assert [w['word'] for w in json.loads(response.data)['words']] == ['exam']
+        assert app_module.word_store.stats('test_user_id')['unfamiliar'] == 0
+        # 儲存沒有刪除任何單字時不更新快取
+        response = client.post('/delete_word', data={'word': 'missing'}, headers=headers)
+        assert json.loads(response.data)['success'] is False
+        # 其他 worker 刪除單字後，本 worker 的快取仍有該單字，重新儲存不應回傳 409
+        app_module.word_store.delete('test_user_id', 'exam')
+        response = client.post('/save_word', data={'word': 'exam'}, headers=headers)
+        assert response.status_code == 201
+        app_module.word_store.delete('test_user_id', 'exam')
+        response = client.post('/save_words', json=['exam'], headers=headers)
+        assert json.loads(response.data)['created'] == 1
+
+    @allure.feature('延後寫入')
+    def test_write_behind(self, client, mock_token, monkeypatch, tmp_path):
+        allure.step("測試不熟標記的延後寫入、合併與日誌重播")
+        logger.info("測試不熟標記的延後寫入、合併與日誌重播")
+        import app as app_module
+        from word_store import SQLiteWordStore
+        from write_behind import WriteBehindQueue, WriteBehindWordStore
+        store = SQLiteWordStore(':memory:')
+        store.add_many('test_user_id', ['exam', 'good'])
+        journal = str(tmp_path / 'write_behind.journal')
+        queue = WriteBehindQueue(store, word_cache, interval=3600, durability='journal', journal_path=journal)
+        monkeypatch.setattr(app_module, 'write_behind', queue)
+        monkeypatch.setattr(app_module, 'word_store', WriteBehindWordStore(store, queue))
+        headers = {'Authorization': f'Bearer {mock_token}'}
+        try:
+            for path in ('/mark_unfamiliar', '/unmark_unfamiliar', '/mark_unfamiliar'):
+                response = client.post(path, data={'word': 'exam'}, headers=headers)
+                assert json.loads(response.data)['success'] is True
+            response = client.post('/mark_unfamiliar', data={'word': 'exam'}, headers=headers)
+            assert json.loads(response.data)['success'] is False
+            response = client.post('/mark_unfamiliar', data={'word': 'missing'}, headers=headers)
+            assert json.loads(response.data)['message'] == "找不到此單字！"
+            # 三次切換合併為一筆，尚未寫入儲存，但快取已更新
+            assert queue.pending('test_user_id') == 1
+            assert store.stats('test_user_id')['unfamiliar'] == 0
+            response = client.post('/review_words', data={'is_unfamiliar': 'true'}, headers=headers)
+            assert [w['word'] for w in json.loads(response.data)['words']] == ['exam']
+            # 其他寫入與 load / version 之前先送出待寫入變更
+            client.post('/mark_unfamiliar', data={'word': 'good'}, headers=headers)
+            assert app_module.word_store.version('test_user_id') == store.version('test_user_id')
+            assert queue.pending() == 0
+            assert store.stats('test_user_id')['unfamiliar'] == 2
+            # 依版本讀取清單後，切換標記與送出後的清單都使用快取，不重新讀取整份清單
+            client.get('/load_all_words?limit=200', headers=headers)
+            loads = []
+            monkeypatch.setattr(store, 'load', lambda uid: loads.append(uid) or [])
+            for path in ('/unmark_unfamiliar', '/mark_unfamiliar'):
+                response = client.post(path, data={'word': 'exam'}, headers=headers)
+                assert json.loads(response.data)['success'] is True
+            queue.flush()
+            response = client.get('/load_all_words?limit=200', headers=headers)
+            assert len(json.loads(response.data)['words']) == 2
+            assert loads == []
+            monkeypatch.delattr(store, 'load')
+            # 程序異常結束後，下一個程序重播留下的日誌
+            client.post('/unmark_unfamiliar', data={'word': 'good'}, headers=headers)
+            with open(f"{journal}.{os.getpid()}", encoding='utf-8') as f:
+                changes = [json.loads(line) for line in f]
+            assert changes == [{'uid': 'test_user_id', 'word': 'good', 'is_unfamiliar': False}]
+            queue._close_journal()
+            os.rename(f"{journal}.{os.getpid()}", f"{journal}.1")
+            recovered = WriteBehindQueue(store, word_cache, interval=3600, durability='journal',
+                                         journal_path=journal)
+            assert recovered.recover() == 1
+            assert not os.path.exists(f"{journal}.1")
+            assert recovered.flush() == 1
+            assert store.stats('test_user_id')['unfamiliar'] == 1
+            assert recovered.stats()['flushed'] == 1
+            recovered._close_journal(remove=True)
+            # 寫入時發生任何例外都放回佇列，不遺失變更
+            client.post('/unmark_unfamiliar', data={'word': 'exam'}, headers=headers)
+
+            def broken(*args):
+                raise RuntimeError("寫入失敗")
+            monkeypatch.setattr(store, 'set_unfamiliar_many', broken)
+            assert queue.flush() == 0
+            assert queue.pending('test_user_id') == 2
+            assert queue.stats()['failed'] == 1
+            monkeypatch.delattr(store, 'set_unfamiliar_many')
+            assert queue.flush() == 1
+            assert store.stats('test_user_id')['unfamiliar'] == 0
+        finally:
+            queue.stop()
+            word_cache.clear()
+
+    @allure.feature('間隔複習')
+    def test_due_words(self, client, mock_token):
+        allure.step("測試到期單字與複習結果")
+        logger.info("測試到期單字與複習結果")
+        headers = {'Authorization': f'Bearer {mock_token}'}
+        client.post('/save_words', json=['exam', 'good'], headers=headers)
+        response = client.post('/due_words', headers=headers)
+        data = json.loads(response.data)
+        assert data['success'] == True
+        assert sorted(w['word'] for w in data['words']) == ['exam', 'good']
+        assert all(w['repetitions'] == 0 for w in data['words'])
+        response = client.post('/review_result', data={'word': 'exam', 'quality': 9}, headers=headers)
+        assert response.status_code == 400
+        response = client.post('/review_result', data={'word': 'exam', 'quality': 5}, headers=headers)
+        data = json.loads(response.data)
+        assert data['success'] == True
+        assert data['schedule']['interval'] == 1
+        assert data['schedule']['repetitions'] == 1
+        # 答錯的單字標記為不熟，兩個單字都排到明天
+        client.post('/review_result', data={'word': 'good', 'quality': 1}, headers=headers)
+        response = client.post('/review_words', data={'is_unfamiliar': 'true'}, headers=headers)
+        assert [w['word'] for w in json.loads(response.data)['words']] == ['good']
+        response = client.post('/due_words', headers=headers)
+        assert json.loads(response.data)['success'] == False
+        response = client.post('/review_result', data={'word': 'missing', 'quality': 4}, headers=headers)
+        assert json.loads(response.data)['message'] == "找不到此單字！"
+
+    @allure.feature('間隔複習')
+    def test_schedule(self):
+        allure.step("測試 SM-2 排程計算與 SQLite 到期查詢")
+        logger.info("測試 SM-2 排程計算與 SQLite 到期查詢")
+        from datetime import timedelta
+        from scheduler import Schedule, MIN_EASE, utcnow
+        from word_store import SQLiteWordStore
+        now = utcnow()
+        schedule = Schedule.new(now)
+        intervals = []
+        for _ in range(4):
+            schedule = schedule.review(4, now)
+            intervals.append(schedule.interval)
+        assert intervals == [1, 6, 15, 38]
+        schedule = schedule.review(0, now)
+        assert (schedule.interval, schedule.repetitions) == (1, 0)
+        assert Schedule(ease=MIN_EASE).review(0, now).ease == MIN_EASE
+        store = SQLiteWordStore(':memory:')
+        store.add_many('test_user_id', ['exam', 'good', 'cool'])
+        store.record_review('test_user_id', 'good', 5, now)
+        due = store.load_due('test_user_id', now + timedelta(seconds=1), 10)
+        assert sorted(record.word for record, _ in due) == ['cool', 'exam']
+        due = store.load_due('test_user_id', now + timedelta(days=2), 10)
+        assert [record.word for record, _ in due][-1] == 'good'
+        assert store.record_review('test_user_id', 'missing', 5, now) is None
+        # 舊單字匯出的排程欄位為 None：還原時不寫入，讀取時使用預設值
+        from word_export import import_row
+        assert import_row({'word': 'exam', 'interval': None, 'due': None}) == {'word': 'exam'}
+        legacy = Schedule.from_dict({'interval': None, 'ease': None, 'repetitions': None, 'due': None})
+        assert legacy.review(4, now).interval == 1
+
+    @allure.feature('單字統計')
+    def test_stats(self, client, mock_token):
+        allure.step("測試單字統計隨新增、標記與刪除更新")
+        logger.info("測試單字統計隨新增、標記與刪除更新")
+        headers = {'Authorization': f'Bearer {mock_token}'}
+
+        def stats():
+            data = json.loads(client.post('/stats', headers=headers).data)
+            assert data['success'] == True
+            return data['stats']['total'], data['stats']['unfamiliar']
+        # 測試前清理直接刪除文件，不經過統計，因此以差值比較
+        total, unfamiliar = stats()
+        client.post('/save_words', json=['exam', 'good', 'cool'], headers=headers)
+        client.post('/save_word', data={'word': 'test'}, headers=headers)
+        client.post('/save_word', data={'word': 'test'}, headers=headers)
+        assert stats() == (total + 4, unfamiliar)
+        client.post('/mark_unfamiliar', data={'word': 'exam'}, headers=headers)
+        client.post('/mark_unfamiliar', data={'word': 'exam'}, headers=headers)
+        client.post('/mark_unfamiliar_words', json=['good', 'cool'], headers=headers)
+        client.post('/unmark_unfamiliar', data={'word': 'cool'}, headers=headers)
+        assert stats() == (total + 4, unfamiliar + 2)
+        client.post('/delete_word', data={'word': 'exam'}, headers=headers)
+        client.post('/delete_words', json=['good', 'test', 'missing'], headers=headers)
+        assert stats() == (total + 1, unfamiliar)
+        client.post('/delete_word', data={'word': 'cool'}, headers=headers)
+        # SQLite 以觸發器維護統計
+        from word_store import SQLiteWordStore
+        store = SQLiteWordStore(':memory:')
+        store.add_many('test_user_id', ['exam', 'good'])
+        store.set_unfamiliar('test_user_id', 'good', True)
+        store.delete('test_user_id', 'exam')
+        user_stats = store.stats('test_user_id')
+        assert (user_stats['total'], user_stats['unfamiliar']) == (1, 1)
+        assert user_stats['last_updated'] is not None
+
+    @allure.feature('單字統計')
+    def test_stats_seeded_for_legacy_users(self):
+        allure.step("測試沒有統計文件的使用者第一次寫入時在交易中建立完整統計")
+        logger.info("測試沒有統計文件的使用者第一次寫入時在交易中建立完整統計")
+        from memory_firestore import Client
+        from word_store import FirestoreWordStore, UPDATED, new_word_doc
+        from words import word_doc_id
+        db = Client()
+        store = FirestoreWordStore(db)
+        # 加入統計前建立的單字，沒有統計文件
+        for word in ['exam', 'good', 'cool']:
+            data = new_word_doc('legacy', word)
+            data['is_unfamiliar'] = word == 'cool'
+            db.collection('toeic_words').document(word_doc_id('legacy', word)).set(data)
+        assert store.add('legacy', 'test') is not None
+        user_stats = store.stats('legacy')
+        assert (user_stats['total'], user_stats['unfamiliar']) == (4, 1)
+        db.collection('toeic_user_stats').document('legacy').delete()
+        assert store.set_unfamiliar('legacy', 'exam', True) == UPDATED
+        user_stats = store.stats('legacy')
+        assert (user_stats['total'], user_stats['unfamiliar']) == (4, 2)
+        db.collection('toeic_user_stats').document('legacy').delete()
+        assert store.delete_many('legacy', ['good', 'Cool', 'missing']) == ['good', 'Cool']
+        user_stats = store.stats('legacy')
+        assert (user_stats['total'], user_stats['unfamiliar']) == (2, 1)
+
+    @allure.feature('單字統計')
+    def test_async_firestore_word_store(self):
+        allure.step("測試 Firestore 非同步單字儲存的讀取、交易新增與統計建立")
+        logger.info("測試 Firestore 非同步單字儲存的讀取、交易新增與統計建立")
+        import asyncio
+        from memory_firestore import AsyncClient, Client
+        from word_store import AsyncFirestoreWordStore, FirestoreWordStore, new_word_doc
+        from words import word_doc_id
+        db = Client()
+        store = AsyncFirestoreWordStore(AsyncClient(db))
+        # 加入統計前建立的單字，沒有統計文件
+        for word in ['exam', 'good', 'cool']:
+            data = new_word_doc('legacy', word)
+            data['is_unfamiliar'] = word == 'cool'
+            db.collection('toeic_words').document(word_doc_id('legacy', word)).set(data)
+
+        async def run():
+            assert await store.version('legacy') == 0
+            versions = []
+            assert (await store.add('legacy', 'test', versions)).word == 'test'
+            assert await store.add('legacy', 'Test', versions) is None
+            assert versions == [(0, 1), (1, 1)]
+            words, cursor = await store.load_page('legacy', None, 2)
+            assert [w.word for w in words] == ['cool', 'exam'] and cursor == 'exam'
+            assert [w.word async for w in store.iter_words('legacy', True)] == ['cool']
+            assert sorted(w.word for w in await store.load('legacy')) == ['cool', 'exam', 'good', 'test']
+            return await store.version('legacy')
+        assert asyncio.run(run()) == 1
+        user_stats = FirestoreWordStore(db).stats('legacy')
+        assert (user_stats['total'], user_stats['unfamiliar']) == (4, 1)
+
+    @allure.feature('條件式請求')
+    def test_word_list_etag(self, client, mock_token):
+        allure.step("測試單字清單的 ETag 與 304 回應")
+        logger.info("測試單字清單的 ETag 與 304 回應")
+        import app as app_module
+        headers = {'Authorization': f'Bearer {mock_token}'}
+        client.post('/save_words', json=['exam', 'good'], headers=headers)
+        response = client.get('/load_all_words', headers=headers)
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+        assert 'Authorization' in response.headers['Vary']
+        response = client.get('/load_all_words', headers={**headers, 'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        response = client.get('/review_words?is_unfamiliar=false&limit=10',
+                              headers={**headers, 'If-None-Match': etag})
+        assert response.status_code == 304
+        # 本程序寫入後版本改變，回傳新的內容
+        client.post('/mark_unfamiliar', data={'word': 'exam'}, headers=headers)
+        response = client.get('/review_words?is_unfamiliar=true', headers={**headers, 'If-None-Match': etag})
+        assert response.status_code == 200
+        assert [w['word'] for w in json.loads(response.data)['words']] == ['exam']
+        etag = response.headers['ETag']
+        # 其他程序直接寫入儲存時，快取的版本不同而重新載入
+        app_module.word_store.add('test_user_id', 'cool')
+        response = client.post('/load_all_words', headers={**headers, 'If-None-Match': etag})
+        assert response.status_code == 200
+        assert sorted(w['word'] for w in json.loads(response.data)['words']) == ['cool', 'exam', 'good']
+
+    @allure.feature('匯出單字')
+    def test_export(self, client, mock_token):
+        allure.step("測試以 CSV 與 NDJSON 串流匯出單字")
+        logger.info("測試以 CSV 與 NDJSON 串流匯出單字")
+        import csv
+        import gzip
+        import io
+        headers = {'Authorization': f'Bearer {mock_token}'}
+        client.post('/save_words', json=['exam', 'good'], headers=headers)
+        client.post('/mark_unfamiliar', data={'word': 'good'}, headers=headers)
+        response = client.get('/export', headers=headers)
+        assert response.mimetype == 'text/csv'
+        assert 'toeic_words.csv' in response.headers['Content-Disposition']
+        rows = list(csv.DictReader(io.StringIO(response.data.decode('utf-8'))))
+        assert sorted((r['word'], r['is_unfamiliar']) for r in rows) == [('exam', 'false'), ('good', 'true')]
+        assert all(r['due'] for r in rows)
+        response = client.get('/export?format=ndjson&compress=gzip', headers=headers)
+        assert response.mimetype == 'application/gzip'
+        lines = gzip.decompress(response.data).decode('utf-8').splitlines()
+        assert sorted(json.loads(line)['word'] for line in lines) == ['exam', 'good']
+        response = client.get('/export?format=xml', headers=headers)
+        assert response.status_code == 400
+
+    @allure.feature('流量限制')
+    def test_rate_limit(self, client, mock_token, monkeypatch):
+        allure.step("測試以使用者為單位的流量限制與並行上限")
+        logger.info("測試以使用者為單位的流量限制與並行上限")
+        import app as app_module
+        from rate_limit import RateLimiter, MemoryBackend, ConcurrencyLimiter, parse_route_costs
+        limiter = RateLimiter(MemoryBackend(), rate=0.5, burst=10)
+        monkeypatch.setattr(app_module, 'rate_limiter', limiter)
+        headers = {'Authorization': f'Bearer {mock_token}'}
+        # 搜尋需要讀取所有單字，每次消耗 5 個權杖
+        for _ in range(2):
+            response = client.post('/search_word', data={'keyword': 'exam'}, headers=headers)
+            assert response.status_code == 200
+        response = client.post('/search_word', data={'keyword': 'exam'}, headers=headers)
+        assert response.status_code == 429
+        assert int(response.headers['Retry-After']) >= 1
+        # 未通過驗證的請求不消耗權杖
+        response = client.post('/search_word', data={'keyword': 'exam'})
+        assert response.status_code == 401
+        assert limiter.limited == 1
+        assert parse_route_costs("/export=50, /stats=2")['/export'] == 50
+        # 單字清單：200 個一頁只收 1 個權杖，304 只收基本成本，整份清單收完整的路由成本
+        limiter = RateLimiter(MemoryBackend(), rate=0.001, burst=3)
+        monkeypatch.setattr(app_module, 'rate_limiter', limiter)
+        response = client.get('/load_all_words?limit=200', headers=headers)
+        assert response.status_code == 200
+        response = client.get('/load_all_words?limit=200',
+                              headers={**headers, 'If-None-Match': response.headers['ETag']})
+        assert response.status_code == 304
+        response = client.get('/load_all_words', headers=headers)
+        assert response.status_code == 429
+        concurrency = ConcurrencyLimiter(2)
+        assert concurrency.acquire() and concurrency.acquire()
+        assert not concurrency.acquire()
+        concurrency.release()
+        assert concurrency.acquire()
+        assert concurrency.stats() == {"in_flight": 2, "max": 2, "rejected": 1}
+
+    @allure.feature('回應壓縮與靜態檔案快取')
+    def test_compression_and_static_cache(self, client, mock_token, monkeypatch):
+        allure.step("測試主頁快取、回應壓縮與帶雜湊的靜態檔案網址")
+        logger.info("測試主頁快取、回應壓縮與帶雜湊的靜態檔案網址")
+        import gzip
+        import re
+        import app as app_module
+        from compression import brotli
+        response = client.get('/')
+        html = response.data
+        etag = response.headers['ETag']
+        assert 'Content-Encoding' not in response.headers
+        assert client.get('/', headers={'If-None-Match': etag}).status_code == 304
+        response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.headers['ETag'] != etag
+        assert gzip.decompress(response.data) == html
+        if brotli is not None:
+            response = client.get('/', headers={'Accept-Encoding': 'gzip, br'})
+            assert response.headers['Content-Encoding'] == 'br'
+            assert brotli.decompress(response.data) == html
+        response = client.get('/', headers={'Accept-Encoding': 'gzip;q=0'})
+        assert 'Content-Encoding' not in response.headers
+        # 靜態檔案網址帶有內容雜湊，可長期快取；雜湊不符時不加上長期快取
+        css_url = re.search(rb'href="(/static/index\.css\?v=\w+)"', html).group(1).decode()
+        response = client.get(css_url)
+        assert response.status_code == 200
+        assert 'immutable' in response.headers['Cache-Control']
+        response.close()
+        response = client.get('/static/index.css?v=stale')
+        assert 'immutable' not in response.headers.get('Cache-Control', '')
+        response.close()
+        # 超過門檻的 JSON 回應依 Accept-Encoding 壓縮
+        monkeypatch.setattr(app_module, 'COMPRESS_MIN_SIZE', 10)
+        headers = {'Authorization': f'Bearer {mock_token}'}
+        client.post('/save_words', json=['exam', 'good'], headers=headers)
+        response = client.get('/load_all_words', headers={**headers, 'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        words = json.loads(gzip.decompress(response.data))['words']
+        assert sorted(w['word'] for w in words) == ['exam', 'good']
+
+    @allure.feature('效能指標')
+    def test_metrics(self, client):
+        allure.step("測試計時、讀寫計數與 Prometheus 輸出")
+        logger.info("測試計時、讀寫計數與 Prometheus 輸出")
+        from metrics import create_metrics, InstrumentedWordStore, NULL_TIMER
+        from word_store import SQLiteWordStore
+        assert create_metrics().timer("verify_user") is NULL_TIMER
+        metrics = create_metrics(enabled=True, server_timing=True)
+        store = InstrumentedWordStore(SQLiteWordStore(':memory:'), metrics)
+        token = metrics.begin_request()
+        store.add_many('test_user_id', ['exam', 'good', 'cool'])
+        store.set_unfamiliar('test_user_id', 'cool', True)
+        assert len(store.load('test_user_id')) == 3
+        assert len(list(store.iter_words('test_user_id', True))) == 1
+        server_timing = metrics.end_request(token, '/review_words', 'POST', 200, 0.002)
+        assert 'store_add_many;dur=' in server_timing
+        assert server_timing.endswith('total;dur=2.00')
+        body = metrics.render({"toeic_word_cache": {"users": 1}})
+        assert 'toeic_store_writes_total{method="add_many"} 3' in body
+        assert 'toeic_store_writes_total{method="set_unfamiliar"} 1' in body
+        assert 'toeic_store_documents_read_total{method="load"} 3' in body
+        assert 'toeic_store_documents_read_total{method="iter_words"} 1' in body
+        assert 'toeic_request_duration_seconds_count{route="/review_words",method="POST"} 1' in body
+        assert 'toeic_word_cache_users 1' in body
+        # 未啟用時 /metrics 回傳 404
+        import app as app_module
+        response = client.get('/metrics')
+        assert response.status_code == (200 if app_module.metrics.enabled else 404)
+
+    @allure.feature('日誌')
+    def test_queue_logging(self):
+        allure.step("測試佇列日誌、JSON 格式與抽樣")
+        logger.info("測試佇列日誌、JSON 格式與抽樣")
+        import io
+        from log_queue import JsonFormatter, start_queue_logging
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(JsonFormatter())
+        handler.setLevel(logging.INFO)
+        queue_logger = logging.getLogger('test_queue_logging')
+        queue_logger.setLevel(logging.DEBUG)
+        queue_logger.propagate = False
+        queue_handler = start_queue_logging(queue_logger, [handler], queue_size=100, sample_rate=0.25)
+        try:
+            for i in range(8):
+                queue_logger.info(f"sampled {i}", extra={"sample": True})
+            queue_logger.debug("below handler level")
+            try:
+                raise ValueError("boom")
+            except ValueError:
+                queue_logger.error("failed", exc_info=True, extra={"uid": "test_user_id"})
+        finally:
+            queue_handler.listener.stop()
+            queue_logger.removeHandler(queue_handler)
+        records = [json.loads(line) for line in stream.getvalue().splitlines()]
+        # 每 4 筆保留 1 筆，並記錄略過的筆數
+        assert [r['message'] for r in records[:2]] == ['sampled 3', 'sampled 7']
+        assert records[0]['sampled_out'] == 3
+        assert records[2]['message'] == 'failed'
+        assert records[2]['uid'] == 'test_user_id'
+        assert 'ValueError: boom' in records[2]['exc_info']
+        assert len(records) == 3
+
+    @allure.feature('ASGI 模式')
+    def test_asgi_routes(self, mock_token, monkeypatch):
+        allure.step("測試 ASGI 模式的非同步路由與預先載入")
+        logger.info("測試 ASGI 模式的非同步路由與預先載入")
+        import base64
+        from starlette.testclient import TestClient
+        import asgi_app
+        from word_store import SQLiteWordStore, ThreadedAsyncWordStore
+        store = SQLiteWordStore(':memory:')
+        monkeypatch.setattr(asgi_app, 'async_word_store', ThreadedAsyncWordStore(store))
+        monkeypatch.setattr(asgi_app.flask_module, 'word_store', store)
+        store.add_many('test_user_id', ['exam', 'good', 'cool'])
+        store.set_unfamiliar('test_user_id', 'cool', True)
+        client = TestClient(asgi_app.app)
+        headers = {'Authorization': f'Bearer {mock_token}'}
+        response = client.post('/save_word', data={'word': 'test'}, headers=headers)
+        assert response.status_code == 201
+        response = client.post('/save_word', data={'word': 'Test'}, headers=headers)
+        assert response.status_code == 409
+        response = client.post('/search_word', data={'keyword': 'oo'}, headers=headers)
+        assert response.json()['words'] == ['cool', 'good']
+        response = client.post('/review_words', data={'is_unfamiliar': 'true'}, headers=headers)
+        assert [w['word'] for w in response.json()['words']] == ['cool']
+        response = client.post('/load_all_words', data={'limit': 2}, headers=headers)
+        data = response.json()
+        assert [w['word'] for w in data['words']] == ['cool', 'exam']
+        assert data['next_cursor'] == 'exam'
+        response = client.post('/load_all_words', data={'stream': 'ndjson'}, headers=headers)
+        assert len(response.text.splitlines()) == 4
+        response = client.get('/load_all_words', headers={**headers, 'If-None-Match': response.headers['ETag']})
+        assert response.status_code == 304
+        response = client.post('/random_words', data={'n': 2}, headers=headers)
+        assert len(response.json()['words']) == 2
+        # 其餘路由交給 Flask 應用程式
+        response = client.post('/delete_word', data={'word': 'test'}, headers=headers)
+        assert response.json()['success'] is True
+        # token 未快取時同時驗證與預先載入（需啟用流量限制）；驗證失敗時不回傳預先載入的單字
+        from rate_limit import MemoryBackend
+        monkeypatch.setattr(asgi_app, 'SPECULATIVE_LOAD', True)
+        monkeypatch.setattr(asgi_app.rate_limiter, 'backend', MemoryBackend())
+        monkeypatch.setattr(asgi_app.rate_limiter, 'rate', 0.001)
+        monkeypatch.setattr(asgi_app.rate_limiter, 'burst', 20)
+        monkeypatch.setattr(asgi_app.rate_limiter, 'limited', 0)
+        claims = base64.urlsafe_b64encode(json.dumps({'sub': 'test_user_id', 'exp': time.time() + 3600}).encode())
+        jwt_like = f"header.{claims.decode().rstrip('=')}.signature"
+        assert asgi_app.unverified_uid(jwt_like) == 'test_user_id'
+        word_cache.clear()
+        response = client.post('/random_words', data={'n': 10}, headers={'Authorization': f'Bearer {jwt_like}'})
+        assert sorted(w['word'] for w in response.json()['words']) == ['exam', 'good']
+        def reject(*args, **kwargs):
+            raise auth.InvalidIdTokenError('invalid')
+        monkeypatch.setattr(auth, 'verify_id_token', reject)
+        token_cache.clear()
+        word_cache.clear()
+        response = client.post('/search_word', data={'keyword': 'oo'}, headers={'Authorization': f'Bearer {jwt_like}'})
+        assert response.status_code == 401
+        assert word_cache.get('test_user_id') is None
+        # 偽造的 token 觸發的預先載入共用一個額度（burst 20、每次 5），用完後不再讀取儲存
+        loads = []
+        monkeypatch.setattr(store, 'load', lambda uid: loads.append(uid) or [])
+        for _ in range(5):
+            response = client.post('/search_word', data={'keyword': 'oo'},
+                                   headers={'Authorization': f'Bearer {jwt_like}'})
+            assert response.status_code == 401
+        assert len(loads) <= 2
+        assert asgi_app.rate_limiter.limited == 0
+
+    @allure.feature('離線測試')
+    def test_memory_firestore(self):
+        allure.step("測試記憶體中的 Firestore 替身")
+        logger.info("測試記憶體中的 Firestore 替身")
+        from google.api_core.exceptions import AlreadyExists
+        from google.cloud.firestore import FieldFilter, Increment
+        from memory_firestore import Client, transactional
+        db = Client()
+        words = db.collection("toeic_words")
+        for i, word in enumerate(['exam', 'good', 'cool']):
+            words.document(word).set({"user_id": "u", "word": word, "rank": i})
+        query = words.where(filter=FieldFilter("user_id", "==", "u")).order_by("word")
+        assert [doc.id for doc in query.start_after({"word": "cool"}).limit(1).stream()] == ['exam']
+        assert query.select(["word"]).get()[0].to_dict() == {"word": "cool"}
+        assert words.where(filter=FieldFilter("rank", ">=", 1)).count().get()[0][0].value == 2
+        # 批次寫入任一失敗時整批不套用
+        batch = db.batch()
+        batch.set(words.document("bad"), {"user_id": "u", "word": "bad"})
+        batch.create(words.document("exam"), {"word": "exam"})
+        with pytest.raises(AlreadyExists):
+            batch.commit()
+        assert not words.document("bad").get().exists
+
+        @transactional
+        def bump(transaction, ref):
+            snapshot = next(db.get_all([ref], transaction=transaction))
+            transaction.update(ref, {"rank": Increment(10)})
+            return snapshot.get("rank")
+        assert bump(db.transaction(), words.document("good")) == 1
+        assert words.document("good").get().get("rank") == 11
+
+        # 交易中發生例外時不套用任何寫入
+        @transactional
+        def fail(transaction, ref):
+            transaction.update(ref, {"rank": Increment(10)})
+            raise ValueError("交易失敗")
+        with pytest.raises(ValueError):
+            fail(db.transaction(), words.document("good"))
+        assert words.document("good").get().get("rank") == 11
+        db.reset()
+        assert words.get() == []
+
+    @allure.feature('延遲初始化')
+    def test_lazy_firestore_client(self):
+        allure.step("測試 Firestore 用戶端延遲建立")
+        logger.info("測試 Firestore 用戶端延遲建立")
+        import app as app_module
+        from word_store import FirestoreWordStore
+        calls = []
+        store = FirestoreWordStore(lambda: calls.append(1) or app_module.db)
+        assert calls == []
+        store.collection
+        assert calls == [1]
+        # 同一程序內只建立一次用戶端
+        assert app_module.get_db() is app_module.get_db()
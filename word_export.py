@@ -0,0 +1,71 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+
+from scheduler import SCHEDULE_FIELDS
+
+# 匯出的欄位：單字、不熟標記與複習排程
+EXPORT_FIELDS = ["word", "is_unfamiliar"] + SCHEDULE_FIELDS
+# 整個集合備份時另外保留文件 ID 與使用者
+DUMP_FIELDS = ["id", "user_id"] + EXPORT_FIELDS
+
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+# 累積到此大小才輸出一段，避免每筆單字都產生一次寫入
+CHUNK_SIZE = 64 * 1024
+
+
+def export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def export_row(data, fields=EXPORT_FIELDS):
+    return {field: export_value(data.get(field)) for field in fields}
+
+
+# 還原時把 ISO 8601 字串轉回時間；舊文件匯出的空欄位（None）不寫入，與原本沒有該欄位相同
+def import_row(data):
+    row = {field: value for field, value in data.items() if value is not None}
+    if isinstance(row.get("due"), str):
+        row["due"] = datetime.fromisoformat(row["due"])
+    return row
+
+
+def _csv_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return "" if value is None else value
+
+
+# 逐筆編碼為 CSV（含標題列）或 NDJSON，每段約 CHUNK_SIZE 大小
+def encode_rows(rows, fmt, fields=EXPORT_FIELDS):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        writer.writerow(fields)
+    for data in rows:
+        row = export_row(data, fields)
+        if fmt == "csv":
+            writer.writerow([_csv_value(row[field]) for field in fields])
+        else:
+            buffer.write(json.dumps(row, ensure_ascii=False) + "\n")
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+# 以串流方式 gzip 壓縮，輸出與 gzip 檔案相同的格式
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode("utf-8"))
+        if compressed:
+            yield compressed
+    yield compressor.flush()
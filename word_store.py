@@ -0,0 +1,738 @@
+import asyncio
+import itertools
+import os
+import random
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from google.api_core.exceptions import GoogleAPICallError, AlreadyExists
+from google.cloud.firestore import (FieldFilter, Increment, SERVER_TIMESTAMP, async_transactional,
+                                    transactional)
+
+from scheduler import Schedule, SCHEDULE_FIELDS, DEFAULT_EASE, PASSING_QUALITY, utcnow
+from search_index import SearchIndex
+from word_export import EXPORT_FIELDS
+from words import WordRecord, normalize_word, word_doc_id
+
+# Firestore 單一批次寫入上限
+FIRESTORE_BATCH_LIMIT = 500
+
+# 設定不熟標記的結果
+UPDATED = "updated"
+ALREADY = "already"
+NOT_FOUND = "not_found"
+
+# 各實作可能拋出的資料庫錯誤
+STORE_ERRORS = (GoogleAPICallError, sqlite3.Error)
+
+
+# 使用者統計文件（單字數、不熟單字數、最後更新時間）所在的集合，文件 ID 為 uid
+STATS_COLLECTION = "toeic_user_stats"
+
+
+# 使用者統計的增量，以 merge 寫入；文件不存在時由 Firestore 建立
+# version 在每次寫入時遞增，作為單字清單的 ETag
+def stats_delta(total=0, unfamiliar=0):
+    return {"total": Increment(total), "unfamiliar": Increment(unfamiliar), "version": Increment(1),
+            "last_updated": SERVER_TIMESTAMP}
+
+
+# 新單字文件的欄位，排程設為立即到期
+def new_word_doc(uid, word, now=None):
+    data = {"user_id": uid, "word": word, "is_unfamiliar": False}
+    data.update(Schedule.new(now or utcnow()).to_fields())
+    return data
+
+
+# 單字儲存介面，涵蓋路由使用的所有資料存取操作
+# 寫入方法的 versions 為 list 時，每次提交後附加 (寫入前版本, 寫入後版本)，
+# 供單字快取判斷兩個版本之間是否只有本次寫入（見 WordCache.add_words）
+class WordStore:
+    # 載入使用者所有單字
+    def load(self, uid):
+        raise NotImplementedError
+
+    # 逐筆讀取單字，不需先載入完整清單
+    def iter_words(self, uid, is_unfamiliar=None):
+        raise NotImplementedError
+
+    # 依單字原文排序分頁，回傳 (單字資料列, 下一頁游標)
+    def load_page(self, uid, is_unfamiliar, limit, start_after=None):
+        raise NotImplementedError
+
+    # 新增單字，已存在時回傳 None
+    def add(self, uid, word, versions=None):
+        raise NotImplementedError
+
+    # 批次新增單字，回傳成功建立的單字資料列
+    def add_many(self, uid, words, versions=None):
+        raise NotImplementedError
+
+    # 刪除單字，回傳是否有刪除
+    def delete(self, uid, word, versions=None):
+        raise NotImplementedError
+
+    # 批次刪除單字，回傳有刪除的單字
+    def delete_many(self, uid, words, versions=None):
+        raise NotImplementedError
+
+    # 設定不熟標記，回傳 UPDATED、ALREADY 或 NOT_FOUND
+    def set_unfamiliar(self, uid, word, is_unfamiliar, versions=None):
+        raise NotImplementedError
+
+    # 批次設定不熟標記，回傳 (已更新, 原本即為目標狀態, 找不到) 三個清單
+    def set_unfamiliar_many(self, uid, words, is_unfamiliar, versions=None):
+        raise NotImplementedError
+
+    # 搜尋單字（預設以記憶體索引實作）
+    def search(self, uid, keyword, limit=50, fuzzy=False):
+        return SearchIndex(r.word for r in self.load(uid)).search(keyword, limit=limit, fuzzy=fuzzy)
+
+    # 隨機抽樣單字（預設以完整清單實作）
+    def sample(self, uid, n, is_unfamiliar=None):
+        records = [r for r in self.load(uid) if is_unfamiliar is None or r.is_unfamiliar == is_unfamiliar]
+        return random.sample(records, min(n, len(records)))
+
+    # 取得已到期（due <= now）的單字，依到期時間排序，回傳 [(單字資料列, 排程), ...]
+    def load_due(self, uid, now, limit):
+        raise NotImplementedError
+
+    # 記錄複習結果並更新排程與不熟標記，回傳新的排程；找不到單字時回傳 None
+    def record_review(self, uid, word, quality, now, versions=None):
+        raise NotImplementedError
+
+    # 使用者統計：{"total": 單字數, "unfamiliar": 不熟單字數, "version": 單字版本, "last_updated": 最後更新時間}
+    def stats(self, uid):
+        raise NotImplementedError
+
+    # 單字版本，每次寫入後遞增
+    def version(self, uid):
+        return self.stats(uid)["version"]
+
+    # 逐筆讀取單字的完整欄位（EXPORT_FIELDS，含複習排程），供匯出使用
+    def export(self, uid):
+        raise NotImplementedError
+
+
+# Firestore 集合與查詢，同步與非同步實作共用
+# client 可為用戶端，或回傳用戶端的函式（延遲到第一次查詢時才建立）
+class FirestoreCollection:
+    def __init__(self, client, collection="toeic_words"):
+        self._client = client
+        self.collection_name = collection
+
+    @property
+    def client(self):
+        return self._client() if callable(self._client) else self._client
+
+    @property
+    def collection(self):
+        return self.client.collection(self.collection_name)
+
+    # 使用者的單字查詢（可加上不熟單字條件），只投影單字資料列需要的欄位
+    def _query(self, uid, is_unfamiliar=None):
+        query = self.collection.where(filter=FieldFilter("user_id", "==", uid))
+        if is_unfamiliar is not None:
+            query = query.where(filter=FieldFilter("is_unfamiliar", "==", is_unfamiliar))
+        return query.select(WordRecord.FIELDS)
+
+    def _page_query(self, uid, is_unfamiliar, limit, start_after=None):
+        query = self._query(uid, is_unfamiliar).order_by("word")
+        if start_after is not None:
+            query = query.start_after({"word": start_after})
+        return query.limit(limit)
+
+    def _stats_ref(self, uid):
+        return self.client.collection(STATS_COLLECTION).document(uid)
+
+    # 使用者單字數與不熟單字數的聚合查詢，尚未有統計文件的使用者第一次寫入時用來建立統計
+    def _count_queries(self, uid):
+        query = self.collection.where(filter=FieldFilter("user_id", "==", uid))
+        return query.count(), query.where(filter=FieldFilter("is_unfamiliar", "==", True)).count()
+
+
+# Firestore 實作
+class FirestoreWordStore(FirestoreCollection, WordStore):
+    # 交易裝飾器；離線測試換成記憶體替身的版本（見 conftest.py）
+    transactional = staticmethod(transactional)
+
+    # 單字文件的固定 ID 由正規化單字產生，刪除與標記和新增時的重複判斷相同（"Apple" 與 "apple" 為同一個單字）
+    # 舊的自動 ID 文件需先執行 migrate_word_ids.py
+    def _word_ref(self, uid, word):
+        return self.collection.document(word_doc_id(uid, word))
+
+    def load(self, uid):
+        return [WordRecord.from_doc(doc) for doc in self._query(uid).stream()]
+
+    def iter_words(self, uid, is_unfamiliar=None):
+        for doc in self._query(uid, is_unfamiliar).stream():
+            yield WordRecord.from_doc(doc)
+
+    def load_page(self, uid, is_unfamiliar, limit, start_after=None):
+        query = self._page_query(uid, is_unfamiliar, limit, start_after)
+        records = [WordRecord.from_doc(doc) for doc in query.stream()]
+        return records, records[-1].word if len(records) == limit else None
+
+    # 在交易中讀取文件並寫入變更，統計增量與變更在同一次提交生效，並行請求不會重複計數
+    # change(文件資料) 回傳 (更新欄位, 單字數增量, 不熟單字數增量)，更新欄位為 None 表示刪除；
+    # 不需變更時回傳 None。回傳 (存在的文件 ID, 有變更的文件 ID)
+    def _transact(self, uid, refs, change, versions=None):
+        # 不同寫法的單字可能對應同一份文件，只讀寫一次
+        refs = list({ref.id: ref for ref in refs}.values())
+        found, changed = set(), set()
+        # 每次交易保留一個寫入給統計文件
+        for start in range(0, len(refs), FIRESTORE_BATCH_LIMIT - 1):
+            chunk = refs[start:start + FIRESTORE_BATCH_LIMIT - 1]
+            chunk_found, chunk_changed, version = self.transactional(self._transact_chunk)(
+                self.client.transaction(), uid, chunk, change)
+            found |= chunk_found
+            changed |= chunk_changed
+            if versions is not None:
+                versions.append(version)
+        return found, changed
+
+    # 統計文件與單字文件在同一次交易中讀取；統計文件不存在（加入統計前的使用者）時，
+    # 在交易中以聚合查詢計數後寫入完整的統計，避免只累加本次變更而得到錯誤的總數
+    # 另外回傳 (寫入前版本, 寫入後版本)：版本同樣在交易中讀取，寫入時遞增 1
+    def _transact_chunk(self, transaction, uid, refs, change):
+        stats_ref = self._stats_ref(uid)
+        snapshots = {snapshot.reference.path: snapshot
+                     for snapshot in self.client.get_all(refs + [stats_ref], transaction=transaction)}
+        found, changed = set(), set()
+        total = unfamiliar = 0
+        version = (snapshots[stats_ref.path].to_dict() or {}).get("version", 0)
+        # 交易中的讀取必須在寫入之前
+        if not snapshots[stats_ref.path].exists:
+            total, unfamiliar = [query.get(transaction=transaction)[0][0].value for query in self._count_queries(uid)]
+        for ref in refs:
+            snapshot = snapshots[ref.path]
+            data = snapshot.to_dict() if snapshot.exists else None
+            if data is not None:
+                found.add(ref.id)
+            result = change(ref.id, data)
+            if result is None:
+                continue
+            fields, total_delta, unfamiliar_delta = result
+            if fields is None:
+                transaction.delete(ref)
+            elif data is None:
+                transaction.create(ref, fields)
+            else:
+                transaction.update(ref, fields)
+            total += total_delta
+            unfamiliar += unfamiliar_delta
+            changed.add(ref.id)
+        if changed:
+            transaction.set(stats_ref, stats_delta(total, unfamiliar), merge=True)
+        return found, changed, (version, version + 1 if changed else version)
+
+    # change(文件 ID, 文件資料) 中文件不存在時資料為 None
+    @staticmethod
+    def _delete_change(doc_id, data):
+        if data is None:
+            return None
+        return None, -1, -int(data.get("is_unfamiliar", False))
+
+    @staticmethod
+    def _flag_change(is_unfamiliar):
+        def change(doc_id, data):
+            if data is None or data.get("is_unfamiliar", False) == is_unfamiliar:
+                return None
+            return {"is_unfamiliar": is_unfamiliar}, 0, 1 if is_unfamiliar else -1
+        return change
+
+    def add(self, uid, word, versions=None):
+        created = self.add_many(uid, [word], versions)
+        return created[0] if created else None
+
+    # 在交易中建立尚不存在的單字，已存在的單字（含其他請求同時寫入的）不建立
+    def add_many(self, uid, words, versions=None):
+        now = utcnow()
+        refs = {}
+        new_docs = {}
+        for word in words:
+            ref = self._word_ref(uid, word)
+            if ref.id not in new_docs:
+                refs[word] = ref
+                new_docs[ref.id] = new_word_doc(uid, word, now)
+
+        def change(doc_id, data):
+            return (new_docs[doc_id], 1, 0) if data is None else None
+        _, changed = self._transact(uid, list(refs.values()), change, versions)
+        return [WordRecord(ref.id, word) for word, ref in refs.items() if ref.id in changed]
+
+    def delete(self, uid, word, versions=None):
+        _, changed = self._transact(uid, [self._word_ref(uid, word)], self._delete_change, versions)
+        return bool(changed)
+
+    def delete_many(self, uid, words, versions=None):
+        refs = {word: self._word_ref(uid, word) for word in words}
+        _, changed = self._transact(uid, list(refs.values()), self._delete_change, versions)
+        return [w for w in words if refs[w].id in changed]
+
+    def set_unfamiliar(self, uid, word, is_unfamiliar, versions=None):
+        updated, already, _ = self.set_unfamiliar_many(uid, [word], is_unfamiliar, versions)
+        return UPDATED if updated else ALREADY if already else NOT_FOUND
+
+    # 文件只在交易中讀取一次，已是目標狀態的文件不寫入
+    def set_unfamiliar_many(self, uid, words, is_unfamiliar, versions=None):
+        refs = {word: self._word_ref(uid, word) for word in words}
+        found, changed = self._transact(uid, list(refs.values()), self._flag_change(is_unfamiliar), versions)
+        updated, already, not_found = [], [], []
+        for word in words:
+            if refs[word].id in changed:
+                updated.append(word)
+            elif refs[word].id in found:
+                already.append(word)
+            else:
+                not_found.append(word)
+        return updated, already, not_found
+
+    # 以 (user_id, due) 複合索引做範圍查詢，只讀取到期的文件
+    def load_due(self, uid, now, limit):
+        query = (self.collection
+                 .where(filter=FieldFilter("user_id", "==", uid))
+                 .where(filter=FieldFilter("due", "<=", now))
+                 .order_by("due")
+                 .limit(limit)
+                 .select(WordRecord.FIELDS + SCHEDULE_FIELDS))
+        due_words = []
+        for doc in query.stream():
+            data = doc.to_dict()
+            due_words.append((WordRecord.from_dict(doc.id, data), Schedule.from_dict(data)))
+        return due_words
+
+    def record_review(self, uid, word, quality, now, versions=None):
+        schedules = []
+
+        def change(doc_id, data):
+            if data is None:
+                return None
+            schedules.append(Schedule.from_dict(data).review(quality, now))
+            fields = schedules[-1].to_fields()
+            fields["is_unfamiliar"] = quality < PASSING_QUALITY
+            return fields, 0, int(fields["is_unfamiliar"]) - int(data.get("is_unfamiliar", False))
+        self._transact(uid, [self._word_ref(uid, word)], change, versions)
+        # 交易重試時 change 會再次執行，以最後一次的結果為準
+        return schedules[-1] if schedules else None
+
+    # 讀取單一統計文件；尚未建立統計文件的使用者以聚合查詢計數後建立
+    def stats(self, uid):
+        snapshot = self._stats_ref(uid).get()
+        data = snapshot.to_dict() if snapshot.exists else self._count_stats(uid)
+        return {"total": data.get("total", 0),
+                "unfamiliar": data.get("unfamiliar", 0),
+                "version": data.get("version", 0),
+                "last_updated": data.get("last_updated")}
+
+    def export(self, uid):
+        query = self.collection.where(filter=FieldFilter("user_id", "==", uid)).select(EXPORT_FIELDS)
+        for doc in query.stream():
+            yield doc.to_dict()
+
+    # 只讀取統計文件；尚未建立時版本為 0
+    def version(self, uid):
+        return (self._stats_ref(uid).get().to_dict() or {}).get("version", 0)
+
+    def _count_stats(self, uid):
+        total, unfamiliar = self._count_queries(uid)
+        data = {"total": total.get()[0][0].value,
+                "unfamiliar": unfamiliar.get()[0][0].value,
+                "last_updated": utcnow()}
+        try:
+            self._stats_ref(uid).create(data)
+        except AlreadyExists:
+            pass
+        return data
+
+
+# SQLite 中目前的 Unix 時間（秒）
+SQLITE_NOW = "(julianday('now') - 2440587.5) * 86400.0"
+
+
+# SQLite 實作，可用於離線測試、基準測試與壓力測試
+# path 為 ":memory:" 時資料只存在記憶體中
+class SQLiteWordStore(WordStore):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS toeic_words (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            word TEXT NOT NULL,
+            word_key TEXT NOT NULL,
+            is_unfamiliar INTEGER NOT NULL DEFAULT 0
+        );
+    """
+    # 後來新增的欄位，舊的資料庫檔案開啟時補上；due 為 Unix 時間，預設 0 即立即到期
+    COLUMNS = {
+        "interval": "INTEGER NOT NULL DEFAULT 0",
+        "ease": f"REAL NOT NULL DEFAULT {DEFAULT_EASE}",
+        "repetitions": "INTEGER NOT NULL DEFAULT 0",
+        "due": "REAL NOT NULL DEFAULT 0"
+    }
+    # 使用者統計由觸發器在同一個交易中維護；last_updated 為 Unix 時間
+    STATS = """
+        CREATE TABLE IF NOT EXISTS toeic_user_stats (
+            user_id TEXT PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0,
+            unfamiliar INTEGER NOT NULL DEFAULT 0,
+            last_updated REAL
+        );
+    """
+    STATS_COLUMNS = {
+        "version": "INTEGER NOT NULL DEFAULT 0"
+    }
+    # 觸發器每次開啟時重建，讓舊資料庫檔案也使用目前的定義
+    STATS_TRIGGERS = f"""
+        DROP TRIGGER IF EXISTS trg_words_insert_stats;
+        CREATE TRIGGER trg_words_insert_stats AFTER INSERT ON toeic_words BEGIN
+            INSERT INTO toeic_user_stats (user_id, total, unfamiliar, version, last_updated)
+            VALUES (NEW.user_id, 1, NEW.is_unfamiliar, 1, {SQLITE_NOW})
+            ON CONFLICT (user_id) DO UPDATE SET total = total + 1, unfamiliar = unfamiliar + NEW.is_unfamiliar,
+                version = version + 1, last_updated = excluded.last_updated;
+        END;
+        DROP TRIGGER IF EXISTS trg_words_delete_stats;
+        CREATE TRIGGER trg_words_delete_stats AFTER DELETE ON toeic_words BEGIN
+            UPDATE toeic_user_stats SET total = total - 1, unfamiliar = unfamiliar - OLD.is_unfamiliar,
+                version = version + 1, last_updated = {SQLITE_NOW} WHERE user_id = OLD.user_id;
+        END;
+        DROP TRIGGER IF EXISTS trg_words_flag_stats;
+        CREATE TRIGGER trg_words_flag_stats AFTER UPDATE OF is_unfamiliar ON toeic_words
+        WHEN NEW.is_unfamiliar != OLD.is_unfamiliar BEGIN
+            UPDATE toeic_user_stats SET unfamiliar = unfamiliar + NEW.is_unfamiliar - OLD.is_unfamiliar,
+                version = version + 1, last_updated = {SQLITE_NOW} WHERE user_id = NEW.user_id;
+        END;
+    """
+    INDEXES = """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_words_user_key ON toeic_words (user_id, word_key);
+        CREATE INDEX IF NOT EXISTS idx_words_user_word ON toeic_words (user_id, word);
+        CREATE INDEX IF NOT EXISTS idx_words_user_flag_word ON toeic_words (user_id, is_unfamiliar, word);
+        CREATE INDEX IF NOT EXISTS idx_words_user_due ON toeic_words (user_id, due);
+    """
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self._connect()
+        with self._lock:
+            self._conn.executescript(self.SCHEMA)
+            self._add_columns("toeic_words", self.COLUMNS)
+            self._conn.executescript(self.INDEXES)
+            has_stats = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'toeic_user_stats'").fetchone()
+            self._conn.executescript(self.STATS)
+            self._add_columns("toeic_user_stats", self.STATS_COLUMNS)
+            self._conn.executescript(self.STATS_TRIGGERS)
+            # 舊的資料庫檔案第一次建立統計表時，由現有單字計算
+            if not has_stats:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT INTO toeic_user_stats (user_id, total, unfamiliar, last_updated) "
+                        f"SELECT user_id, COUNT(*), SUM(is_unfamiliar), {SQLITE_NOW} FROM toeic_words GROUP BY user_id")
+        # SQLite 連線不能跨 fork 使用，檔案資料庫在子程序重新連線
+        if path != ":memory:" and hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._connect)
+
+    def _add_columns(self, table, columns):
+        existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+        for column, definition in columns.items():
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def _connect(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        if self.path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+
+    def _rows(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _record(row):
+        return WordRecord(row[0], row[1], bool(row[2]))
+
+    @staticmethod
+    def _where(uid, is_unfamiliar):
+        if is_unfamiliar is None:
+            return "user_id = ?", [uid]
+        return "user_id = ? AND is_unfamiliar = ?", [uid, int(is_unfamiliar)]
+
+    def load(self, uid):
+        rows = self._rows("SELECT id, word, is_unfamiliar FROM toeic_words WHERE user_id = ?", (uid,))
+        return [self._record(row) for row in rows]
+
+    def iter_words(self, uid, is_unfamiliar=None):
+        where, params = self._where(uid, is_unfamiliar)
+        for row in self._rows(f"SELECT id, word, is_unfamiliar FROM toeic_words WHERE {where}", params):
+            yield self._record(row)
+
+    def load_page(self, uid, is_unfamiliar, limit, start_after=None):
+        where, params = self._where(uid, is_unfamiliar)
+        if start_after is not None:
+            where += " AND word > ?"
+            params.append(start_after)
+        rows = self._rows(f"SELECT id, word, is_unfamiliar FROM toeic_words WHERE {where} "
+                          f"ORDER BY word LIMIT ?", params + [limit])
+        records = [self._record(row) for row in rows]
+        return records, records[-1].word if len(records) == limit else None
+
+    def add(self, uid, word, versions=None):
+        created = self.add_many(uid, [word], versions)
+        return created[0] if created else None
+
+    def add_many(self, uid, words, versions=None):
+        created = []
+        due = utcnow().timestamp()
+        with self._lock, self._conn:
+            before = self._version(uid)
+            for word in words:
+                doc_id = word_doc_id(uid, word)
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO toeic_words (id, user_id, word, word_key, is_unfamiliar, due) "
+                    "VALUES (?, ?, ?, ?, 0, ?)", (doc_id, uid, word, normalize_word(word), due))
+                if cursor.rowcount:
+                    created.append(WordRecord(doc_id, word))
+            self._report(uid, before, versions)
+        return created
+
+    def delete(self, uid, word, versions=None):
+        return bool(self.delete_many(uid, [word], versions))
+
+    def delete_many(self, uid, words, versions=None):
+        deleted = []
+        with self._lock, self._conn:
+            before = self._version(uid)
+            for word in words:
+                cursor = self._conn.execute("DELETE FROM toeic_words WHERE user_id = ? AND word_key = ?",
+                                            (uid, normalize_word(word)))
+                if cursor.rowcount:
+                    deleted.append(word)
+            self._report(uid, before, versions)
+        return deleted
+
+    def set_unfamiliar(self, uid, word, is_unfamiliar, versions=None):
+        updated, already, _ = self.set_unfamiliar_many(uid, [word], is_unfamiliar, versions)
+        return UPDATED if updated else ALREADY if already else NOT_FOUND
+
+    def set_unfamiliar_many(self, uid, words, is_unfamiliar, versions=None):
+        updated, already, not_found = [], [], []
+        with self._lock, self._conn:
+            before = self._version(uid)
+            for word in words:
+                cursor = self._conn.execute(
+                    "UPDATE toeic_words SET is_unfamiliar = ? WHERE user_id = ? AND word_key = ? AND is_unfamiliar != ?",
+                    (int(is_unfamiliar), uid, normalize_word(word), int(is_unfamiliar)))
+                if cursor.rowcount:
+                    updated.append(word)
+                elif self._conn.execute("SELECT 1 FROM toeic_words WHERE user_id = ? AND word_key = ?",
+                                        (uid, normalize_word(word))).fetchone():
+                    already.append(word)
+                else:
+                    not_found.append(word)
+            self._report(uid, before, versions)
+        return updated, already, not_found
+
+    # 非模糊搜尋直接以 SQL 排序：完全相符、前綴、子字串，再依長度
+    def search(self, uid, keyword, limit=50, fuzzy=False):
+        if fuzzy:
+            return super().search(uid, keyword, limit=limit, fuzzy=fuzzy)
+        key = normalize_word(keyword)
+        if not key:
+            return []
+        escaped = key.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        rows = self._rows(
+            "SELECT word FROM toeic_words WHERE user_id = ? AND word_key LIKE ? ESCAPE '\\' "
+            "ORDER BY word_key != ?, word_key NOT LIKE ? ESCAPE '\\', length(word_key), word_key LIMIT ?",
+            (uid, f"%{escaped}%", key, f"{escaped}%", limit))
+        return [row[0] for row in rows]
+
+    def sample(self, uid, n, is_unfamiliar=None):
+        where, params = self._where(uid, is_unfamiliar)
+        rows = self._rows(f"SELECT id, word, is_unfamiliar FROM toeic_words WHERE {where} "
+                          f"ORDER BY RANDOM() LIMIT ?", params + [n])
+        return [self._record(row) for row in rows]
+
+    @staticmethod
+    def _schedule(row):
+        return Schedule(row[0], row[1], row[2], datetime.fromtimestamp(row[3], timezone.utc))
+
+    def load_due(self, uid, now, limit):
+        rows = self._rows("SELECT id, word, is_unfamiliar, interval, ease, repetitions, due FROM toeic_words "
+                          "WHERE user_id = ? AND due <= ? ORDER BY due LIMIT ?", (uid, now.timestamp(), limit))
+        return [(self._record(row), self._schedule(row[3:])) for row in rows]
+
+    def record_review(self, uid, word, quality, now, versions=None):
+        with self._lock, self._conn:
+            before = self._version(uid)
+            row = self._conn.execute("SELECT interval, ease, repetitions, due FROM toeic_words "
+                                     "WHERE user_id = ? AND word_key = ?", (uid, normalize_word(word))).fetchone()
+            if row is None:
+                return None
+            schedule = self._schedule(row).review(quality, now)
+            self._conn.execute("UPDATE toeic_words SET interval = ?, ease = ?, repetitions = ?, due = ?, "
+                               "is_unfamiliar = ? WHERE user_id = ? AND word_key = ?",
+                               (schedule.interval, schedule.ease, schedule.repetitions, schedule.due.timestamp(),
+                                int(quality < PASSING_QUALITY), uid, normalize_word(word)))
+            self._report(uid, before, versions)
+        return schedule
+
+    def stats(self, uid):
+        row = next(iter(self._rows("SELECT total, unfamiliar, version, last_updated FROM toeic_user_stats "
+                                   "WHERE user_id = ?", (uid,))), None)
+        if row is None:
+            return {"total": 0, "unfamiliar": 0, "version": 0, "last_updated": None}
+        return {"total": row[0], "unfamiliar": row[1], "version": row[2],
+                "last_updated": datetime.fromtimestamp(row[3], timezone.utc) if row[3] is not None else None}
+
+    def version(self, uid):
+        with self._lock:
+            return self._version(uid)
+
+    # 以下兩個方法需持有 self._lock
+    def _version(self, uid):
+        row = self._conn.execute("SELECT version FROM toeic_user_stats WHERE user_id = ?", (uid,)).fetchone()
+        return row[0] if row is not None else 0
+
+    # 寫入交易中回報 (寫入前版本, 寫入後版本)；觸發器在同一個交易中遞增版本
+    def _report(self, uid, before, versions):
+        if versions is not None:
+            versions.append((before, self._version(uid)))
+
+    # 依主鍵分段讀取，同時只持有一段資料列
+    EXPORT_CHUNK = 1000
+
+    def export(self, uid):
+        last_id = ""
+        while True:
+            rows = self._rows("SELECT id, word, is_unfamiliar, interval, ease, repetitions, due FROM toeic_words "
+                              "WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?", (uid, last_id, self.EXPORT_CHUNK))
+            for row in rows:
+                yield {"word": row[1], "is_unfamiliar": bool(row[2]), "interval": row[3], "ease": row[4],
+                       "repetitions": row[5], "due": datetime.fromtimestamp(row[6], timezone.utc)}
+            if len(rows) < self.EXPORT_CHUNK:
+                return
+            last_id = rows[-1][0]
+
+
+# 非同步單字儲存介面，供 ASGI 模式的路由使用（讀取與新增單字）
+class AsyncWordStore:
+    async def load(self, uid):
+        raise NotImplementedError
+
+    # 逐筆讀取單字，回傳非同步迭代器
+    def iter_words(self, uid, is_unfamiliar=None):
+        raise NotImplementedError
+
+    async def load_page(self, uid, is_unfamiliar, limit, start_after=None):
+        raise NotImplementedError
+
+    async def add(self, uid, word, versions=None):
+        raise NotImplementedError
+
+    async def version(self, uid):
+        raise NotImplementedError
+
+    async def search(self, uid, keyword, limit=50, fuzzy=False):
+        records = await self.load(uid)
+        return SearchIndex(r.word for r in records).search(keyword, limit=limit, fuzzy=fuzzy)
+
+    async def sample(self, uid, n, is_unfamiliar=None):
+        records = [r for r in await self.load(uid) if is_unfamiliar is None or r.is_unfamiliar == is_unfamiliar]
+        return random.sample(records, min(n, len(records)))
+
+
+# Firestore 非同步實作，使用 AsyncClient，等待查詢時不佔用執行緒
+class AsyncFirestoreWordStore(FirestoreCollection, AsyncWordStore):
+    # 交易裝飾器；離線測試換成記憶體替身的版本（見 conftest.py）
+    async_transactional = staticmethod(async_transactional)
+
+    async def load(self, uid):
+        return [WordRecord.from_doc(doc) async for doc in self._query(uid).stream()]
+
+    async def iter_words(self, uid, is_unfamiliar=None):
+        async for doc in self._query(uid, is_unfamiliar).stream():
+            yield WordRecord.from_doc(doc)
+
+    async def load_page(self, uid, is_unfamiliar, limit, start_after=None):
+        query = self._page_query(uid, is_unfamiliar, limit, start_after)
+        records = [WordRecord.from_doc(doc) async for doc in query.stream()]
+        return records, records[-1].word if len(records) == limit else None
+
+    # 與同步版本相同：在交易中建立單字並更新統計，統計文件不存在時以聚合查詢計數後寫入完整的統計
+    async def add(self, uid, word, versions=None):
+        doc_ref = self.collection.document(word_doc_id(uid, word))
+        stats_ref = self._stats_ref(uid)
+
+        @self.async_transactional
+        async def create(transaction):
+            snapshots = {snapshot.reference.path: snapshot
+                         async for snapshot in self.client.get_all([doc_ref, stats_ref], transaction=transaction)}
+            version = (snapshots[stats_ref.path].to_dict() or {}).get("version", 0)
+            if snapshots[doc_ref.path].exists:
+                return None, (version, version)
+            total, unfamiliar = 1, 0
+            if not snapshots[stats_ref.path].exists:
+                counts = [(await query.get(transaction=transaction))[0][0].value
+                          for query in self._count_queries(uid)]
+                total += counts[0]
+                unfamiliar += counts[1]
+            transaction.create(doc_ref, new_word_doc(uid, word))
+            transaction.set(stats_ref, stats_delta(total, unfamiliar), merge=True)
+            return WordRecord(doc_ref.id, word), (version, version + 1)
+        record, version = await create(self.client.transaction())
+        if versions is not None:
+            versions.append(version)
+        return record
+
+    async def version(self, uid):
+        snapshot = await self._stats_ref(uid).get()
+        return (snapshot.to_dict() or {}).get("version", 0)
+
+
+# 在執行緒池中呼叫同步單字儲存，供沒有非同步用戶端的實作（SQLite）使用
+class ThreadedAsyncWordStore(AsyncWordStore):
+    # 逐筆讀取時每次在執行緒中取出的筆數
+    ITER_CHUNK = 500
+
+    def __init__(self, store):
+        self.store = store
+
+    async def load(self, uid):
+        return await asyncio.to_thread(self.store.load, uid)
+
+    async def iter_words(self, uid, is_unfamiliar=None):
+        words = iter(self.store.iter_words(uid, is_unfamiliar))
+        while True:
+            chunk = await asyncio.to_thread(list, itertools.islice(words, self.ITER_CHUNK))
+            if not chunk:
+                return
+            for record in chunk:
+                yield record
+
+    async def load_page(self, uid, is_unfamiliar, limit, start_after=None):
+        return await asyncio.to_thread(self.store.load_page, uid, is_unfamiliar, limit, start_after)
+
+    async def add(self, uid, word, versions=None):
+        return await asyncio.to_thread(self.store.add, uid, word, versions)
+
+    async def search(self, uid, keyword, limit=50, fuzzy=False):
+        return await asyncio.to_thread(self.store.search, uid, keyword, limit, fuzzy)
+
+    async def sample(self, uid, n, is_unfamiliar=None):
+        return await asyncio.to_thread(self.store.sample, uid, n, is_unfamiliar)
+
+    async def version(self, uid):
+        return await asyncio.to_thread(self.store.version, uid)
+
+
+# 依環境變數 WORD_STORE 建立單字儲存實作：firestore（預設）、sqlite 或 memory
+# firestore_client 可為用戶端或回傳用戶端的函式
+def create_word_store(backend=None, firestore_client=None):
+    backend = (backend or os.getenv("WORD_STORE", "firestore")).lower()
+    if backend == "firestore":
+        return FirestoreWordStore(firestore_client)
+    if backend == "sqlite":
+        return SQLiteWordStore(os.getenv("WORD_STORE_PATH", "toeic_words.db"))
+    if backend == "memory":
+        return SQLiteWordStore(":memory:")
+    raise ValueError(f"不支援的 WORD_STORE: {backend}")
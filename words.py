@@ -0,0 +1,38 @@
+import hashlib
+import unicodedata
+
+
+# 單字正規化，用於重複判斷與產生文件 ID
+def normalize_word(word):
+    return unicodedata.normalize("NFKC", word).strip().lower()
+
+
+# 由使用者與單字產生固定的 Firestore 文件 ID
+def word_doc_id(uid, word):
+    key = f"{uid}\n{normalize_word(word)}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+# 單字資料列，以 __slots__ 減少每筆單字的記憶體用量
+class WordRecord:
+    __slots__ = ("id", "word", "is_unfamiliar")
+
+    # 查詢時只需投影這些欄位
+    FIELDS = ["word", "is_unfamiliar"]
+
+    def __init__(self, id, word, is_unfamiliar=False):
+        self.id = id
+        self.word = word
+        self.is_unfamiliar = is_unfamiliar
+
+    # 由 Firestore 文件建立，每份文件只呼叫一次 to_dict()
+    @classmethod
+    def from_doc(cls, doc):
+        return cls.from_dict(doc.id, doc.to_dict())
+
+    @classmethod
+    def from_dict(cls, id, data):
+        return cls(id, data.get("word", ""), data.get("is_unfamiliar", False))
+
+    def to_dict(self):
+        return {"id": self.id, "word": self.word, "is_unfamiliar": self.is_unfamiliar}
@@ -0,0 +1,346 @@
+import asyncio
+import atexit
+import glob
+import json
+import os
+import re
+import threading
+
+from word_store import UPDATED, ALREADY, NOT_FOUND
+from words import normalize_word
+
+# 檔案鎖只在 Unix 上提供；沒有時不檢查日誌檔是否仍被其他程序使用
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 持久性等級：
+# none    只保存在記憶體，程序異常結束時遺失尚未寫入的變更
+# journal 每次變更附加到本機日誌檔（寫入作業系統緩衝），程序異常結束後由下一個程序重播
+# fsync   同 journal，且每次變更都 fsync，主機斷電也不遺失
+DURABILITY_LEVELS = ("none", "journal", "fsync")
+
+# 寫入前一定要先送出該使用者的待寫入變更：寫入需維持順序，load / version 決定快取內容與 ETag
+FLUSH_BEFORE = {"load", "version", "add", "add_many", "delete", "delete_many",
+                "set_unfamiliar", "set_unfamiliar_many", "record_review"}
+# 其他讀取只在 flush_on_read 時先送出，否則可能讀到尚未寫入的不熟標記
+FLUSH_ON_READ = {"load_page", "iter_words", "search", "sample", "load_due", "stats", "export"}
+
+
+# 不熟標記的延後寫入佇列：變更立即套用到單字快取並放入佇列，
+# 同一個單字的多次切換只保留最後一次，由背景執行緒定期以批次寫入儲存
+class WriteBehindQueue:
+    def __init__(self, store, cache, interval=0, max_pending=500, durability="none",
+                 journal_path="write_behind.journal", flush_on_read=False, logger=None):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"不支援的持久性等級: {durability}")
+        self.store = store
+        self.cache = cache
+        self.interval = interval
+        self.max_pending = max_pending
+        self.durability = durability
+        self.journal_path = journal_path
+        self.flush_on_read = flush_on_read
+        self.logger = logger
+        # {uid: {正規化單字: (單字, 是否不熟)}}
+        self._pending = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        # 同時只進行一次寫入，讀取前的 flush 會等待進行中的寫入完成
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._journal = None
+        self._journal_name = f"{journal_path}.{os.getpid()}"
+        self.flushed = 0
+        self.coalesced = 0
+        self.failed = 0
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_in_child)
+
+    # 需要單字快取判斷目前的標記，停用快取時不啟用
+    @property
+    def enabled(self):
+        return self.interval > 0 and self.cache.enabled
+
+    # 依快取中的標記回傳 UPDATED / ALREADY / NOT_FOUND，並在 UPDATED 時放入佇列
+    def set_unfamiliar(self, uid, word, is_unfamiliar, entry):
+        self.start()
+        with self._lock:
+            cached = entry.get(word)
+            if cached is None:
+                return NOT_FOUND
+            if cached.is_unfamiliar == is_unfamiliar:
+                return ALREADY
+            entry.set_unfamiliar(word, is_unfamiliar)
+            self.cache.set_unfamiliar(uid, [word], is_unfamiliar)
+            self._enqueue(uid, cached.word, is_unfamiliar)
+        return UPDATED
+
+    def _enqueue(self, uid, word, is_unfamiliar):
+        words = self._pending.setdefault(uid, {})
+        key = normalize_word(word)
+        if key in words:
+            self.coalesced += 1
+        else:
+            self._size += 1
+        words[key] = (word, is_unfamiliar)
+        self._append_journal(uid, word, is_unfamiliar)
+        if self._size >= self.max_pending:
+            self._wakeup.set()
+
+    def pending(self, uid=None):
+        with self._lock:
+            return self._size if uid is None else len(self._pending.get(uid, ()))
+
+    # 寫入指定使用者（預設為全部）的待寫入變更，回傳實際更新的單字數
+    def flush(self, uid=None):
+        if uid is not None and uid not in self._pending and not self._flush_lock.locked():
+            return 0
+        with self._flush_lock:
+            with self._lock:
+                if uid is None:
+                    batch, self._pending = self._pending, {}
+                else:
+                    batch = {uid: self._pending.pop(uid)} if uid in self._pending else {}
+                self._size -= sum(len(words) for words in batch.values())
+            if not batch:
+                return 0
+            written = 0
+            # 任何例外都不能遺失已取出的變更：尚未寫入的使用者放回佇列，並照常整理日誌
+            remaining = dict(batch)
+            try:
+                for user, words in batch.items():
+                    written += self._write(user, words)
+                    del remaining[user]
+            finally:
+                with self._lock:
+                    for user, words in remaining.items():
+                        self._requeue(user, words.values())
+                    self._compact_journal()
+                self.flushed += written
+            return written
+
+    # 依標記分成兩批寫入；任何例外都放回佇列（已有較新的變更則保留較新的），下次再試
+    def _write(self, uid, words):
+        written = 0
+        versions = []
+        for is_unfamiliar in (True, False):
+            group = [word for word, flag in words.values() if flag == is_unfamiliar]
+            if not group:
+                continue
+            try:
+                updated, _, _ = self.store.set_unfamiliar_many(uid, group, is_unfamiliar, versions)
+                written += len(updated)
+            except Exception as e:
+                self.failed += 1
+                if self.logger is not None:
+                    self.logger.error(f"延後寫入使用者 {uid} 的不熟標記失敗，稍後重試: {e}", exc_info=True)
+                with self._lock:
+                    self._requeue(uid, [(word, is_unfamiliar) for word in group])
+        # 變更已在快取中，只接續寫入後的版本（期間有其他程序寫入時移除快取）
+        self.cache.advance(uid, versions)
+        return written
+
+    # 放回佇列的變更不覆蓋期間新加入的較新變更；呼叫時需持有 self._lock
+    def _requeue(self, uid, changes):
+        retry = self._pending.setdefault(uid, {})
+        for word, is_unfamiliar in changes:
+            if normalize_word(word) not in retry:
+                retry[normalize_word(word)] = (word, is_unfamiliar)
+                self._size += 1
+
+    async def flush_async(self, uid):
+        if uid in self._pending or self._flush_lock.locked():
+            await asyncio.to_thread(self.flush, uid)
+
+    def flushes_before(self, name):
+        return name in FLUSH_BEFORE or (self.flush_on_read and name in FLUSH_ON_READ)
+
+    # 第一次使用時才啟動背景執行緒（gunicorn 預先載入時不在主程序啟動），並重播遺留的日誌
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        with self._flush_lock:
+            if self._thread is not None:
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+        self.recover()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                if self.logger is not None:
+                    self.logger.error(f"延後寫入失敗: {e}", exc_info=True)
+
+    # 停止背景執行緒並寫入所有待寫入變更（程式結束或 worker 關閉時呼叫）
+    def stop(self):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        thread.join()
+        self._thread = None
+        self.flush()
+        with self._lock:
+            if self._journal is not None and not self._pending:
+                self._close_journal(remove=True)
+
+    # 子程序不會繼承背景執行緒與檔案鎖；待寫入變更由父程序負責
+    def _reset_in_child(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._size = 0
+        self._thread = None
+        self._journal = None
+        self._journal_name = f"{self.journal_path}.{os.getpid()}"
+
+    # 以下為日誌檔：每個程序寫入 <journal_path>.<pid>，並在寫入期間持有檔案鎖
+    def _journal_file(self):
+        if self._journal is None:
+            self._journal = self._open_journal(self._journal_name)
+        return self._journal
+
+    @staticmethod
+    def _open_journal(path, mode="a"):
+        journal = open(path, mode, encoding="utf-8")
+        if fcntl is not None:
+            try:
+                fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                journal.close()
+                raise
+        return journal
+
+    def _append_journal(self, uid, word, is_unfamiliar):
+        if self.durability == "none":
+            return
+        journal = self._journal_file()
+        journal.write(json.dumps({"uid": uid, "word": word, "is_unfamiliar": is_unfamiliar},
+                                 ensure_ascii=False) + "\n")
+        journal.flush()
+        if self.durability == "fsync":
+            os.fsync(journal.fileno())
+
+    # 寫入後日誌只保留仍待寫入的變更：先寫好暫存檔並取得檔案鎖，再取代原檔
+    def _compact_journal(self):
+        if self._journal is None:
+            return
+        compacted = self._open_journal(self._journal_name + ".tmp", "w")
+        for uid, words in self._pending.items():
+            for word, is_unfamiliar in words.values():
+                compacted.write(json.dumps({"uid": uid, "word": word, "is_unfamiliar": is_unfamiliar},
+                                           ensure_ascii=False) + "\n")
+        compacted.flush()
+        if self.durability == "fsync":
+            os.fsync(compacted.fileno())
+        os.replace(compacted.name, self._journal_name)
+        self._journal.close()
+        self._journal = compacted
+
+    def _close_journal(self, remove=False):
+        self._journal.close()
+        self._journal = None
+        if remove:
+            os.remove(self._journal_name)
+
+    # 重播已結束程序留下的日誌檔（取得檔案鎖表示原程序已不存在），改由本程序寫入
+    def recover(self):
+        if self.durability == "none":
+            return 0
+        pattern = re.compile(re.escape(self.journal_path) + r"\.\d+(\.tmp)?$")
+        recovered = 0
+        for path in sorted(glob.glob(glob.escape(self.journal_path) + ".*")):
+            if not pattern.match(path) or path in (self._journal_name, self._journal_name + ".tmp"):
+                continue
+            try:
+                journal = self._open_journal(path)
+            except OSError:
+                continue
+            try:
+                if not path.endswith(".tmp"):
+                    with open(path, encoding="utf-8") as f:
+                        changes = [json.loads(line) for line in f if line.strip()]
+                    with self._lock:
+                        for change in changes:
+                            self._enqueue(change["uid"], change["word"], change["is_unfamiliar"])
+                    recovered += len(changes)
+                os.remove(path)
+            finally:
+                journal.close()
+        if recovered and self.logger is not None:
+            self.logger.info(f"重播延後寫入日誌：{recovered} 筆不熟標記變更")
+        return recovered
+
+    def stats(self):
+        with self._lock:
+            return {"pending": self._size, "flushed": self.flushed,
+                    "coalesced": self.coalesced, "failed": self.failed}
+
+
+# 讀寫儲存前先送出該使用者的待寫入變更（見 FLUSH_BEFORE / FLUSH_ON_READ）
+class WriteBehindWordStore:
+    def __init__(self, store, queue):
+        self._store = store
+        self._queue = queue
+
+    @property
+    def wrapped(self):
+        return self._store
+
+    def __getattr__(self, name):
+        attribute = getattr(self._store, name)
+        if not callable(attribute) or not self._queue.flushes_before(name):
+            return attribute
+        queue = self._queue
+
+        def flushed(uid, *args, **kwargs):
+            queue.flush(uid)
+            return attribute(uid, *args, **kwargs)
+        return flushed
+
+
+# 非同步儲存版本：在執行緒池中送出待寫入變更
+class AsyncWriteBehindWordStore:
+    def __init__(self, store, queue):
+        self._store = store
+        self._queue = queue
+
+    def __getattr__(self, name):
+        attribute = getattr(self._store, name)
+        if not callable(attribute) or not self._queue.flushes_before(name):
+            return attribute
+        queue = self._queue
+
+        async def flushed(uid, *args, **kwargs):
+            await queue.flush_async(uid)
+            return await attribute(uid, *args, **kwargs)
+        return flushed
+
+    async def iter_words(self, uid, is_unfamiliar=None):
+        if self._queue.flushes_before("iter_words"):
+            await self._queue.flush_async(uid)
+        async for record in self._store.iter_words(uid, is_unfamiliar):
+            yield record
+
+
+# 依環境變數建立延後寫入佇列；WRITE_BEHIND_INTERVAL（秒）大於 0 時啟用
+def create_write_behind(store, cache, logger=None):
+    return WriteBehindQueue(store, cache,
+                            interval=float(os.getenv("WRITE_BEHIND_INTERVAL", "0")),
+                            max_pending=int(os.getenv("WRITE_BEHIND_MAX_PENDING", "500")),
+                            durability=os.getenv("WRITE_BEHIND_DURABILITY", "none"),
+                            journal_path=os.getenv("WRITE_BEHIND_JOURNAL", "write_behind.journal"),
+                            flush_on_read=os.getenv("WRITE_BEHIND_FLUSH_ON_READ", "false").lower() == "true",
+                            logger=logger)